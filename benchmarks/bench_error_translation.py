@@ -0,0 +1,78 @@
+# Copyright 2015 ClusterHQ. See LICENSE file for details.
+
+"""
+Benchmark for the translation of large error lists.
+
+An error list with an entry for every entity of a failed multi-entity
+operation is translated into an exception for several error codes whose
+translation depends on all the names of the operation.  The time per
+error list is reported for the increasing sizes of the error list,
+a linear translation takes about ten times longer for ten times more
+errors.
+
+Usage: python benchmarks/bench_error_translation.py [max_entries]
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import errno
+import sys
+import time
+
+from libzfs_core import _error_translation as errors
+from libzfs_core import exceptions
+
+
+def _snapshot(count, err):
+    snaps = ['pool%d/fs%d@snap' % (i % 2, i) for i in range(count)]
+    errlist = dict((s, err) for s in snaps)
+    return lambda: errors.lzc_snapshot_translate_errors(err, dict(errlist), snaps, {})
+
+
+def _bookmark(count, err):
+    bookmarks = dict(('pool%d/fs%d#bmark' % (i % 2, i), 'pool%d/fs%d@snap' % (i % 2, i))
+                     for i in range(count))
+    errlist = dict((b, err) for b in bookmarks)
+    return lambda: errors.lzc_bookmark_translate_errors(err, dict(errlist), bookmarks)
+
+
+def _hold(count, err):
+    holds = dict(('pool%d/fs%d@snap' % (i % 2, i), 'tag') for i in range(count))
+    errlist = dict((s, err) for s in holds)
+    return lambda: errors.lzc_hold_translate_errors(err, dict(errlist), holds, -1)
+
+
+def _measure(func):
+    start = time.time()
+    try:
+        func()
+    except exceptions.MultipleOperationsFailure as e:
+        assert len(e.errors) > 0
+    return time.time() - start
+
+
+def main(argv):
+    max_entries = int(argv[1]) if len(argv) > 1 else 10000
+    cases = [
+        ("snapshot EXDEV", _snapshot, errno.EXDEV),
+        ("snapshot EINVAL", _snapshot, errno.EINVAL),
+        ("bookmark EINVAL", _bookmark, errno.EINVAL),
+        ("hold EINVAL", _hold, errno.EINVAL),
+    ]
+    counts = []
+    count = max_entries
+    while count >= 100 and len(counts) < 3:
+        counts.insert(0, count)
+        count //= 10
+    print("%-16s" % "errlist" + "".join("%12d" % c for c in counts))
+    for (label, factory, err) in cases:
+        times = [_measure(factory(c, err)) for c in counts]
+        print("%-16s" % label + "".join("%10.1fms" % (t * 1000) for t in times))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
+
+
+# vim: softtabstop=4 tabstop=4 expandtab shiftwidth=4
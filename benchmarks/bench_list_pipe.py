@@ -0,0 +1,180 @@
+# Copyright 2015 ClusterHQ. See LICENSE file for details.
+
+"""
+Benchmark for reading a large dataset listing.
+
+The kernel side of lzc_list is simulated by a process that writes
+a synthetic record stream to the pipe as fast as the pipe accepts it.
+Each record is a packed nvlist resembling a snapshot listing record.
+The listing is consumed through _list() in the synchronous and in the
+pipelined mode and the following is reported:
+- the throughput of the consumer;
+- the time the writer spent blocked on the full pipe;
+- the peak of the memory allocated by Python while listing.
+
+Usage: python benchmarks/bench_list_pipe.py [records]
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import struct
+import sys
+import time
+import tracemalloc
+
+from libzfs_core import _libzfs_core as lzc
+
+# data_type_t values
+_DATA_TYPE_UINT64 = 8
+_DATA_TYPE_STRING = 9
+_DATA_TYPE_NVLIST = 19
+
+
+def _align8(n):
+    return (n + 7) & ~7
+
+
+def _pack_pair(name, value):
+    name = name + b'\0'
+    valoff = _align8(16 + len(name))
+    nested = b''
+    if isinstance(value, dict):
+        (typeid, data) = (_DATA_TYPE_NVLIST, b'\0' * 24)
+        nested = _pack_nvlist(value)
+    elif isinstance(value, bytes):
+        (typeid, data) = (_DATA_TYPE_STRING, value + b'\0')
+    else:
+        (typeid, data) = (_DATA_TYPE_UINT64, struct.pack('<Q', value))
+    size = _align8(valoff + len(data))
+    pair = struct.pack('<ihhii', size, len(name), 0, 1, typeid) + name
+    pair = pair.ljust(valoff, b'\0') + data
+    return pair.ljust(size, b'\0') + nested
+
+
+def _pack_nvlist(props):
+    # version 0, NV_UNIQUE_NAME
+    data = struct.pack('<iI', 0, 1)
+    for name, value in sorted(props.items()):
+        data += _pack_pair(name, value)
+    return data + b'\0' * 4
+
+
+def _pack(props):
+    # NV_ENCODE_NATIVE, little endian
+    return b'\0\1\0\0' + _pack_nvlist(props)
+
+
+def _record(payload, err=0):
+    return struct.pack(lzc._PIPE_RECORD_FORMAT, len(payload), 0, err, 0, 0) + payload
+
+
+def _stream(count):
+    records = []
+    for i in range(count):
+        props = {
+            b'name': b'pool/fs@snap%d' % i,
+            b'dmu_objset_stats': {b'dds_type': 2, b'dds_is_snapshot': 1},
+            b'properties': {
+                b'createtxg': {b'value': i},
+                b'guid': {b'value': i * 7919},
+                b'used': {b'value': i * 4096},
+                b'referenced': {b'value': i * 8192},
+            },
+        }
+        records.append(_record(_pack(props)))
+    records.append(_record(b''))
+    return b''.join(records)
+
+
+class _FakeKernel(object):
+
+    """
+    The writer runs in a child process, so that, like the real kernel,
+    it does not compete with the consumer for the interpreter lock.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.blocked = None
+
+    def lzc_list(self, name, options):
+        (rfd, wfd) = os.pipe()
+        (self._result_rfd, result_wfd) = os.pipe()
+        self.pid = os.fork()
+        if self.pid == 0:
+            os.close(rfd)
+            os.close(self._result_rfd)
+            blocked = self._write(wfd)
+            os.write(result_wfd, struct.pack('d', blocked))
+            os._exit(0)
+        os.close(result_wfd)
+        # The real kernel keeps its own reference to the write end.
+        return (rfd, wfd)
+
+    def _write(self, wfd):
+        blocked = 0.0
+        view = memoryview(self.data)
+        while view:
+            start = time.time()
+            n = os.write(wfd, view[:65536])
+            blocked += time.time() - start
+            view = view[n:]
+        os.close(wfd)
+        return blocked
+
+    def join(self):
+        os.waitpid(self.pid, 0)
+        (self.blocked,) = struct.unpack('d', os.read(self._result_rfd, 8))
+        os.close(self._result_rfd)
+
+
+def _run(data, trace, **kwargs):
+    kernel = _FakeKernel(data)
+    orig = lzc.lzc_list
+    lzc.lzc_list = kernel.lzc_list
+    try:
+        if trace:
+            tracemalloc.start()
+        start = time.time()
+        count = 0
+        for entry in lzc._list(b'pool/fs', **kwargs):
+            entry[b'name']
+            count += 1
+        elapsed = time.time() - start
+        peak = 0
+        if trace:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    finally:
+        lzc.lzc_list = orig
+    kernel.join()
+    return (count, elapsed, kernel.blocked, peak)
+
+
+def main(argv):
+    count = int(argv[1]) if len(argv) > 1 else 100000
+    data = _stream(count)
+    print("%d records, %.1f MiB" % (count, len(data) / 2 ** 20))
+    modes = [
+        ("sync", {}),
+        ("pipelined", {"pipelined": True}),
+        ("pipelined, 1MiB pipe", {"pipelined": True, "pipe_size": 2 ** 20}),
+    ]
+    for lazy in [False, True]:
+        for label, kwargs in modes:
+            kwargs = dict(kwargs, lazy=lazy)
+            (listed, elapsed, blocked, _) = _run(data, False, **kwargs)
+            assert listed == count
+            (_, _, _, peak) = _run(data, True, **kwargs)
+            print("%-5s %-21s %7.0f records/s %6.1f MiB/s  writer blocked %5.2f s  peak %5.1f MiB" % (
+                "lazy" if lazy else "eager", label, count / elapsed,
+                len(data) / elapsed / 2 ** 20, blocked, peak / 2 ** 20))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
+
+
+# vim: softtabstop=4 tabstop=4 expandtab shiftwidth=4
@@ -0,0 +1,173 @@
+# Copyright 2015 ClusterHQ. See LICENSE file for details.
+
+"""
+Benchmark for the projection of the listing records.
+
+A snapshot listing is simulated like in bench_list_pipe.py, but the records
+carry a realistic set of properties and the stream is generated by the
+writer process on the fly, so that a listing of a million snapshots does
+not have to be kept in memory.  The listing is consumed through _list()
+with the full decoding, with the lazy views and with a projection to
+the name, createtxg and guid, the latter also with the pure Python
+decoder.  The throughput and the peak of the memory allocated by Python
+while listing are reported.  Finally the same columns
+are listed into a columnar listing and its size per record is reported.
+
+Usage: python benchmarks/bench_list_projection.py [records]
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import struct
+import sys
+import time
+import tracemalloc
+
+from libzfs_core import _libzfs_core as lzc
+from libzfs_core._columnar import list_columnar
+
+from bench_list_pipe import _pack, _record
+
+_NAME_FORMAT = b'pool/fs@snap%09d'
+_BATCH = 1024
+
+_PROPERTIES = [
+    b'type', b'creation', b'used', b'referenced', b'compressratio',
+    b'devices', b'exec', b'setuid', b'xattr', b'version', b'utf8only',
+    b'normalization', b'casesensitivity', b'nbmand', b'primarycache',
+    b'secondarycache', b'defer_destroy', b'userrefs', b'objsetid',
+    b'mlslabel', b'refcompressratio', b'written', b'logicalreferenced',
+    b'acltype', b'context', b'fscontext', b'defcontext', b'rootcontext',
+    b'encryption', b'unique',
+]
+
+
+def _template():
+    '''
+    Build a packed record with placeholders for the varying values.
+    '''
+    properties = dict((p, {b'value': 1, b'source': b'pool/fs'}) for p in _PROPERTIES)
+    properties[b'createtxg'] = {b'value': 0x7eadbeef01010101}
+    properties[b'guid'] = {b'value': 0x7eadbeef02020202}
+    props = {
+        b'name': _NAME_FORMAT % 0,
+        b'dmu_objset_stats': {b'dds_type': 2, b'dds_is_snapshot': 1, b'dds_num_clones': 0},
+        b'properties': properties,
+    }
+    record = bytearray(_record(_pack(props)))
+    offsets = (
+        record.index(_NAME_FORMAT % 0),
+        record.index(struct.pack('<Q', 0x7eadbeef01010101)),
+        record.index(struct.pack('<Q', 0x7eadbeef02020202)),
+    )
+    return (record, offsets)
+
+
+class _GeneratingKernel(object):
+
+    def __init__(self, count):
+        self.count = count
+
+    def lzc_list(self, name, options):
+        (rfd, wfd) = os.pipe()
+        self.pid = os.fork()
+        if self.pid == 0:
+            os.close(rfd)
+            self._write(wfd)
+            os._exit(0)
+        return (rfd, wfd)
+
+    def _write(self, wfd):
+        (record, (name_off, txg_off, guid_off)) = _template()
+        size = len(record)
+        batch = bytearray(record * _BATCH)
+        i = 0
+        while i < self.count:
+            n = min(_BATCH, self.count - i)
+            for j in range(n):
+                base = j * size
+                batch[base + name_off:base + name_off + len(_NAME_FORMAT % 0)] = _NAME_FORMAT % (i + j)
+                struct.pack_into('<Q', batch, base + txg_off, i + j)
+                struct.pack_into('<Q', batch, base + guid_off, (i + j) * 7919)
+            view = memoryview(batch)[:n * size]
+            while view:
+                written = os.write(wfd, view)
+                view = view[written:]
+            i += n
+        os.write(wfd, _record(b''))
+        os.close(wfd)
+
+    def join(self):
+        os.waitpid(self.pid, 0)
+
+
+def _run(count, trace, **kwargs):
+    kernel = _GeneratingKernel(count)
+    orig = lzc.lzc_list
+    lzc.lzc_list = kernel.lzc_list
+    try:
+        if trace:
+            tracemalloc.start()
+        start = time.time()
+        results = []
+        for entry in lzc._list(b'pool/fs', **kwargs):
+            props = entry[b'properties']
+            results.append((entry[b'name'], props[b'createtxg'][b'value'],
+                            props[b'guid'][b'value']))
+        elapsed = time.time() - start
+        peak = 0
+        if trace:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    finally:
+        lzc.lzc_list = orig
+    kernel.join()
+    return (len(results), elapsed, peak)
+
+
+def _run_columnar(count):
+    kernel = _GeneratingKernel(count)
+    orig = lzc.lzc_list
+    lzc.lzc_list = kernel.lzc_list
+    try:
+        start = time.time()
+        listing = list_columnar(b'pool/fs', columns=[b'createtxg', b'guid'])
+        elapsed = time.time() - start
+    finally:
+        lzc.lzc_list = orig
+    kernel.join()
+    return (len(listing), elapsed, listing.nbytes())
+
+
+def main(argv):
+    count = int(argv[1]) if len(argv) > 1 else 1000000
+    modes = [
+        ("full", {}),
+        ("lazy", {"lazy": True}),
+        ("projected", {"fields": {b'name': None,
+                                  b'properties': {b'createtxg': [b'value'],
+                                                  b'guid': [b'value']}}}),
+        ("pure", {"pure_python": True,
+                  "fields": {b'name': None,
+                             b'properties': {b'createtxg': [b'value'],
+                                             b'guid': [b'value']}}}),
+    ]
+    for label, kwargs in modes:
+        (listed, elapsed, _) = _run(count, False, **kwargs)
+        assert listed == count
+        (_, _, peak) = _run(min(count, 100000), True, **kwargs)
+        print("%-10s %9.0f records/s  peak per 100k records %6.1f MiB" % (
+            label, count / elapsed, peak / 2 ** 20))
+    (listed, elapsed, nbytes) = _run_columnar(count)
+    assert listed == count
+    print("%-10s %9.0f records/s  %.1f bytes per record" % (
+        "columnar", count / elapsed, nbytes / count))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
+
+
+# vim: softtabstop=4 tabstop=4 expandtab shiftwidth=4
@@ -0,0 +1,113 @@
+# Copyright 2015 ClusterHQ. See LICENSE file for details.
+
+"""
+Microbenchmark for the nvlist to dictionary conversion.
+
+The per-pair decoding cost is measured for a flat nvlist with integer and
+string values and for a nested nvlist resembling a dataset listing record.
+The 'legacy' row is a copy of the conversion that looked up the type
+information and the C functions anew for every pair, it is kept here
+for comparison only.
+
+Usage: python benchmarks/bench_nvlist_decode.py [repeat]
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import sys
+import timeit
+
+from libzfs_core import _nvlist
+from libzfs_core._nvlist import nvlist_in, _nvlist_to_dict, _nvlist_to_dict_native
+from libzfs_core.bindings import libnvpair
+
+_ffi = libnvpair.ffi
+_lib = libnvpair.lib
+
+
+def _legacy_type_info(typeid):
+    return {
+        _lib.DATA_TYPE_BOOLEAN:         _nvlist._TypeInfo(None, None, None, None),
+        _lib.DATA_TYPE_BOOLEAN_VALUE:   _nvlist._TypeInfo("boolean_value", "boolean_t *", False, bool),
+        _lib.DATA_TYPE_UINT64:          _nvlist._TypeInfo("uint64", "uint64_t *", False, int),
+        _lib.DATA_TYPE_STRING:          _nvlist._TypeInfo("string", "char **", False, _ffi.string),
+        _lib.DATA_TYPE_NVLIST:          _nvlist._TypeInfo("nvlist", "nvlist_t **", False,
+                                                          lambda x: _legacy_nvlist_to_dict(x, {})),
+        _lib.DATA_TYPE_UINT64_ARRAY:    _nvlist._TypeInfo("uint64_array", "uint64_t **", True, int),
+        _lib.DATA_TYPE_STRING_ARRAY:    _nvlist._TypeInfo("string_array", "char ***", True, _ffi.string),
+        _lib.DATA_TYPE_NVLIST_ARRAY:    _nvlist._TypeInfo("nvlist_array", "nvlist_t ***", True,
+                                                          lambda x: _legacy_nvlist_to_dict(x, {})),
+    }[typeid]
+
+
+def _legacy_nvlist_to_dict(nvlist, props):
+    pair = _lib.nvlist_next_nvpair(nvlist, _ffi.NULL)
+    while pair != _ffi.NULL:
+        name = _ffi.string(_lib.nvpair_name(pair))
+        typeid = int(_lib.nvpair_type(pair))
+        typeinfo = _legacy_type_info(typeid)
+        cfunc = getattr(_lib, "nvpair_value_%s" % (typeinfo.suffix,), None)
+        if typeinfo.is_array:
+            valptr = _ffi.new(typeinfo.ctype)
+            lenptr = _ffi.new("uint_t *")
+            cfunc(pair, valptr, lenptr)
+            val = []
+            for i in range(int(lenptr[0])):
+                val.append(typeinfo.convert(valptr[0][i]))
+        elif typeid == _lib.DATA_TYPE_BOOLEAN:
+            val = None
+        else:
+            valptr = _ffi.new(typeinfo.ctype)
+            cfunc(pair, valptr)
+            val = typeinfo.convert(valptr[0])
+        props[name] = val
+        pair = _lib.nvlist_next_nvpair(nvlist, pair)
+    return props
+
+
+def _flat():
+    props = {}
+    for i in range(64):
+        props[b"int%d" % i] = i * 1000
+        props[b"str%d" % i] = b"value-%d" % i
+    return props, 128
+
+
+def _nested():
+    # A listing record: every property is an nvlist with value and source.
+    properties = {}
+    for i in range(32):
+        properties[b"prop%d" % i] = {b"value": i, b"source": b"pool/fs"}
+    props = {
+        b"name": b"pool/fs",
+        b"dmu_objset_stats": {b"dds_type": 2, b"dds_guid": 1234567},
+        b"properties": properties,
+    }
+    pairs = 3 + 2 + 32 + 32 * 2
+    return props, pairs
+
+
+def _bench(label, func, nvlist, pairs, repeat):
+    number = 200
+    best = min(timeit.repeat(lambda: func(nvlist, {}), number=number, repeat=repeat))
+    print("%-8s %-22s %8.2f us/pair" % (label, func.__name__.lstrip("_"),
+                                       best / number / pairs * 1e6))
+
+
+def main(argv):
+    repeat = int(argv[1]) if len(argv) > 1 else 5
+    funcs = [_legacy_nvlist_to_dict, _nvlist_to_dict]
+    if libnvpair.api_mode:
+        funcs.append(_nvlist_to_dict_native)
+    for label, factory in [("flat", _flat), ("nested", _nested)]:
+        props, pairs = factory()
+        nvlist = nvlist_in(props)
+        for func in funcs:
+            _bench(label, func, nvlist, pairs, repeat)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
+
+
+# vim: softtabstop=4 tabstop=4 expandtab shiftwidth=4
@@ -0,0 +1,135 @@
+# Copyright 2015 ClusterHQ. See LICENSE file for details.
+
+"""
+Benchmark for the peak memory use of the nvlist conversion in large
+batched calls.
+
+Every round converts a batch of snapshot names, a batch of holds and
+a dictionary with a large nvlist array, like the inputs of lzc_snapshot,
+lzc_hold and a bulk operation, and sizes the nvlists as the ioctl would.
+The 'legacy' mode is a copy of the conversion that built every embedded
+nvlist separately and left the nvlists to the garbage collector, it is
+kept here for comparison only.  The 'gc' mode uses nvlist_in and the
+'scoped' mode uses nvlist_in_scope.  Every mode runs in a child process
+and the growth of its peak resident set size is reported.
+
+Usage: python benchmarks/bench_nvlist_memory.py [batch] [rounds]
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import resource
+import sys
+import time
+import traceback
+
+from libzfs_core import _nvlist
+from libzfs_core._nvlist import nvlist_in, nvlist_in_scope
+from libzfs_core._schema import _NAMES, _HOLDS
+from libzfs_core.bindings import libnvpair
+
+_ffi = libnvpair.ffi
+_lib = libnvpair.lib
+
+
+def _legacy_nvlist_in(props):
+    nvlistp = _ffi.new("nvlist_t **")
+    _lib.nvlist_alloc(nvlistp, 1, 0)
+    nvlist = _ffi.gc(nvlistp[0], _lib.nvlist_free)
+    for (k, v) in props.items():
+        if isinstance(v, dict):
+            _lib.nvlist_add_nvlist(nvlist, k, _legacy_nvlist_in(v))
+        elif isinstance(v, list) and v and isinstance(v[0], dict):
+            c_array = [_legacy_nvlist_in(d) for d in v]
+            _lib.nvlist_add_nvlist_array(nvlist, k, c_array, len(c_array))
+        else:
+            _nvlist._nvlist_add_value(nvlist, k, v)
+    return nvlist
+
+
+def _inputs(batch, i):
+    snaps = dict.fromkeys((b'pool/fs%d@snap%d' % (n, i) for n in range(batch)))
+    holds = dict((b'pool/fs%d@snap%d' % (n, i), b'tag') for n in range(batch))
+    records = {b'records': [{b'name': b'pool/fs%d' % n, b'props': {b'guid': n}}
+                            for n in range(batch)]}
+    return [(snaps, _NAMES), (holds, _HOLDS), (records, None)]
+
+
+def _size(nvlist):
+    sizep = _ffi.new("size_t *")
+    _lib.nvlist_size(nvlist, sizep, 0)
+    return sizep[0]
+
+
+def _run_legacy(inputs):
+    nvlists = [_legacy_nvlist_in(props) for (props, _) in inputs]
+    return sum(_size(nvlist) for nvlist in nvlists)
+
+
+def _run_gc(inputs):
+    nvlists = [nvlist_in(props, schema) for (props, schema) in inputs]
+    return sum(_size(nvlist) for nvlist in nvlists)
+
+
+def _run_scoped(inputs):
+    (snaps, holds, records) = inputs
+    with nvlist_in_scope(*snaps) as snaps_nv, \
+            nvlist_in_scope(*holds) as holds_nv, \
+            nvlist_in_scope(*records) as records_nv:
+        return _size(snaps_nv) + _size(holds_nv) + _size(records_nv)
+
+
+def _rss():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def _measure(func, batch, rounds):
+    '''
+    :return: the time and the growth of the peak RSS of the rounds,
+        measured in a child process.
+    '''
+    (rfd, wfd) = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        status = 1
+        try:
+            os.close(rfd)
+            inputs = [_inputs(batch, i) for i in range(rounds)]
+            start_rss = _rss()
+            start = time.time()
+            for i in range(rounds):
+                func(inputs[i])
+            elapsed = time.time() - start
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+            os.write(wfd, ('%f %d' % (elapsed, peak - start_rss)).encode())
+            status = 0
+        except Exception:
+            traceback.print_exc()
+        finally:
+            os._exit(status)
+    os.close(wfd)
+    data = os.read(rfd, 64).decode()
+    os.close(rfd)
+    (_, status) = os.waitpid(pid, 0)
+    if status != 0:
+        raise RuntimeError('the measurement failed')
+    (elapsed, growth) = data.split()
+    return (float(elapsed), int(growth))
+
+
+def main(argv):
+    batch = int(argv[1]) if len(argv) > 1 else 100000
+    rounds = int(argv[2]) if len(argv) > 2 else 10
+    for (label, func) in [("legacy", _run_legacy), ("gc", _run_gc), ("scoped", _run_scoped)]:
+        (elapsed, growth) = _measure(func, batch, rounds)
+        print("%-8s %8.3f s  peak RSS growth %8.1f MiB" % (label, elapsed, growth / 2 ** 20))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
+
+
+# vim: softtabstop=4 tabstop=4 expandtab shiftwidth=4
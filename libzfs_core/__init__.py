@@ -48,6 +48,7 @@ from ._libzfs_core import (
     lzc_receive,
     lzc_recv,
     lzc_exists,
+    prime_exists_cache,
     is_supported,
     lzc_promote,
     lzc_rename,
@@ -55,8 +56,41 @@ from ._libzfs_core import (
     lzc_inherit_prop,
     lzc_set_prop,
     lzc_get_props,
+    lzc_get_props_recursive,
     lzc_list_children,
     lzc_list_snaps,
+    lzc_iter_children,
+    lzc_iter_snaps,
+)
+from ._parallel import (
+    map_parallel,
+)
+from ._batch import (
+    Batcher,
+)
+from ._cache import (
+    enable_props_cache,
+    disable_props_cache,
+    props_cache_stats,
+    enable_exists_cache,
+    disable_exists_cache,
+    exists_cache_stats,
+)
+from ._tree import (
+    DatasetTree,
+)
+from ._columnar import (
+    ColumnarListing,
+    ListingRow,
+    list_columnar,
+)
+from ._bulk import (
+    bulk_snapshot,
+    bulk_destroy_snaps,
+    bulk_hold,
+    bulk_release,
+    bulk_bookmark,
+    bulk_destroy_bookmarks,
 )
 
 __all__ = [
@@ -88,8 +122,30 @@ __all__ = [
     'lzc_inherit_prop',
     'lzc_set_prop',
     'lzc_get_props',
+    'lzc_get_props_recursive',
     'lzc_list_children',
     'lzc_list_snaps',
+    'lzc_iter_children',
+    'lzc_iter_snaps',
+    'map_parallel',
+    'Batcher',
+    'bulk_snapshot',
+    'bulk_destroy_snaps',
+    'bulk_hold',
+    'bulk_release',
+    'bulk_bookmark',
+    'bulk_destroy_bookmarks',
+    'enable_props_cache',
+    'disable_props_cache',
+    'props_cache_stats',
+    'enable_exists_cache',
+    'disable_exists_cache',
+    'exists_cache_stats',
+    'prime_exists_cache',
+    'DatasetTree',
+    'ColumnarListing',
+    'ListingRow',
+    'list_columnar',
 ]
 
 # vim: softtabstop=4 tabstop=4 expandtab shiftwidth=4
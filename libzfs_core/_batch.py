@@ -0,0 +1,269 @@
+# Copyright 2015 ClusterHQ. See LICENSE file for details.
+
+"""
+Coalescing of the concurrent snapshot, hold and bookmark requests.
+
+Every :func:`.lzc_snapshot`, :func:`.lzc_hold` or :func:`.lzc_bookmark`
+call waits for at least one transaction group sync, although each call
+can operate on many entities in the same pool.  :class:`Batcher` collects
+single-entity requests made by any number of threads during a short
+window and then makes one call per pool and operation for all of them.
+"""
+from __future__ import unicode_literals
+
+import collections
+import concurrent.futures
+import threading
+import time
+
+from builtins import object
+
+from . import _libzfs_core as _lzc
+from . import exceptions
+from ._bulk import _best_effort
+from ._parallel import _dataset_pool
+
+# The default time in seconds a request can wait for other requests.
+_WINDOW = 0.01
+# The default maximum number of the entities in a single call.
+_MAX_BATCH = 1000
+
+
+def _b(name):
+    if isinstance(name, bytes):
+        return name
+    return name.encode('utf-8')
+
+
+def _props_key(props):
+    if not props:
+        return ()
+    return tuple(sorted(props.items()))
+
+
+class _Request(object):
+
+    def __init__(self, name, value):
+        self.name = name
+        self.value = value
+        self.future = concurrent.futures.Future()
+
+
+class _Group(object):
+
+    '''
+    The requests that are going to be made by the same call.
+    '''
+
+    def __init__(self, op, pool, extra, deadline):
+        self.op = op
+        self.pool = pool
+        self.extra = extra
+        self.deadline = deadline
+        self.requests = collections.OrderedDict()
+
+
+class Batcher(object):
+
+    '''
+    Coalesce the snapshot, hold and bookmark requests made concurrently.
+
+    Each request is held for up to ``window`` seconds, the requests for
+    the same operation in the same pool that arrive during that time are
+    made by a single call.  The snapshot requests are coalesced only if
+    they have equal properties and the hold requests only if they use
+    the same cleanup file descriptor.  If a batch grows to ``max_batch``
+    entities, then it is made without waiting for the rest of the window.
+
+    The methods return :class:`concurrent.futures.Future` objects that
+    are resolved with the result of the request, that is, with what
+    the corresponding function would have returned for the single entity,
+    or with the exception it would have raised.  When the call for
+    a batch fails the errors are routed to the requests for the entities
+    they name and the call is repeated for the other requests, because
+    the operations are atomic and a single bad entity would otherwise
+    fail the whole batch.  If the errors do not name any entity, then
+    the batch is split in halves until the failing requests are isolated.
+
+    :param float window: the maximum time in seconds a request waits
+        for other requests.
+    :param int max_batch: the maximum number of the entities in
+        a single call.
+
+    The batcher can be used as a context manager, it is closed on exit.
+
+    Example::
+
+        with Batcher() as batcher:
+            future = batcher.snapshot(b'pool/fs@snap')
+            ...
+            future.result()
+    '''
+
+    def __init__(self, window=_WINDOW, max_batch=_MAX_BATCH):
+        if window < 0 or max_batch < 1:
+            raise ValueError('invalid batching limits')
+        self._window = window
+        self._max_batch = max_batch
+        self._cond = threading.Condition()
+        self._groups = []
+        self._closed = False
+        self._flusher = None
+
+    def snapshot(self, snap, props=None):
+        '''
+        Request creation of a snapshot.
+
+        :param bytes snap: the name of the snapshot.
+        :param props: the properties to set on the snapshot.
+        :type props: dict of bytes:bytes or None
+        :return: a future resolved with ``None`` once the snapshot is created.
+        :rtype: concurrent.futures.Future
+        '''
+        return self._submit('snapshot', snap, props, _props_key(props))
+
+    def hold(self, snap, tag, fd=None):
+        '''
+        Request a user hold on a snapshot.
+
+        :param bytes snap: the name of the snapshot.
+        :param bytes tag: the name of the hold.
+        :param fd: the cleanup file descriptor as for :func:`.lzc_hold`.
+        :type fd: int or None
+        :return: a future resolved with the list of the missing snapshots,
+            that is, either an empty list or a list of ``snap``.
+        :rtype: concurrent.futures.Future
+        '''
+        return self._submit('hold', snap, tag, fd)
+
+    def bookmark(self, bookmark, snap):
+        '''
+        Request creation of a bookmark.
+
+        :param bytes bookmark: the name of the bookmark.
+        :param bytes snap: the name of the snapshot to bookmark.
+        :return: a future resolved with ``None`` once the bookmark is created.
+        :rtype: concurrent.futures.Future
+        '''
+        return self._submit('bookmark', bookmark, snap, None)
+
+    def close(self):
+        '''
+        Make the pending requests without waiting and stop accepting
+        new requests.
+
+        The method waits until the pending requests are handed over,
+        but it does not wait for their completion.
+        '''
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            flusher = self._flusher
+        if flusher is not None:
+            flusher.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        return False
+
+    def _submit(self, op, name, value, extra):
+        name = _b(name)
+        pool = _dataset_pool(name)
+        request = _Request(name, value)
+        with self._cond:
+            if self._closed:
+                raise ValueError('the batcher is closed')
+            group = self._find_group(op, pool, extra, name)
+            group.requests[name] = request
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, name='lzc batcher')
+                self._flusher.daemon = True
+                self._flusher.start()
+            self._cond.notify_all()
+        return request.future
+
+    def _find_group(self, op, pool, extra, name):
+        for group in self._groups:
+            if (group.op == op and group.pool == pool and group.extra == extra and
+                    name not in group.requests and len(group.requests) < self._max_batch):
+                return group
+        # A request for an entity that is already in the batch goes
+        # to the next batch.
+        group = _Group(op, pool, extra, time.time() + self._window)
+        self._groups.append(group)
+        return group
+
+    def _flush_loop(self):
+        with self._cond:
+            while True:
+                now = time.time()
+                due = [g for g in self._groups
+                       if self._closed or g.deadline <= now or len(g.requests) >= self._max_batch]
+                for group in due:
+                    self._groups.remove(group)
+                    thread = threading.Thread(target=self._execute, args=(group,), name='lzc batch')
+                    thread.daemon = True
+                    thread.start()
+                if self._closed and not self._groups:
+                    return
+                if due:
+                    continue
+                if self._groups:
+                    self._cond.wait(min(g.deadline for g in self._groups) - now)
+                else:
+                    self._cond.wait()
+
+    def _execute(self, group):
+        try:
+            self._execute_requests(group)
+        except BaseException as e:
+            # Nobody else would complete the futures.
+            for request in group.requests.values():
+                if not request.future.done():
+                    request.future.set_exception(e)
+
+    def _execute_requests(self, group):
+        requests = collections.OrderedDict(
+            (r.name, r) for r in group.requests.values()
+            if r.future.set_running_or_notify_cancel())
+        aliases = None
+        if group.op == 'bookmark':
+            # A bookmark can fail because of its snapshot.
+            aliases = collections.defaultdict(list)
+            for request in requests.values():
+                aliases[_b(request.value)].append(request.name)
+        (result, failed, _) = _best_effort(
+            lambda names: self._call(group, [requests[n] for n in names]),
+            list(requests.keys()), aliases)
+        missing = set(_b(name) for name in result)
+        for (name, request) in requests.items():
+            if name in failed:
+                errors = failed[name]
+                if isinstance(errors, list):
+                    errors = self._failures[group.op](errors, 0)
+                request.future.set_exception(errors)
+            elif group.op == 'hold':
+                request.future.set_result([name] if name in missing else [])
+            else:
+                request.future.set_result(None)
+
+    _failures = {
+        'snapshot': exceptions.SnapshotFailure,
+        'hold': exceptions.HoldFailure,
+        'bookmark': exceptions.BookmarkFailure,
+    }
+
+    def _call(self, group, requests):
+        if group.op == 'snapshot':
+            props = dict(group.extra) if group.extra else None
+            return _lzc.lzc_snapshot([r.name for r in requests], props)
+        elif group.op == 'hold':
+            holds = dict((r.name, r.value) for r in requests)
+            return _lzc.lzc_hold(holds, group.extra)
+        else:
+            return _lzc.lzc_bookmark(dict((r.name, r.value) for r in requests))
+
+# vim: softtabstop=4 tabstop=4 expandtab shiftwidth=4
@@ -0,0 +1,364 @@
+# Copyright 2015 ClusterHQ. See LICENSE file for details.
+
+"""
+Wrappers for the multi-entity operations that accept any number of
+entities in any number of pools.
+
+The underlying functions require all the entities to be in the same pool
+and the kernel limits the size of the arguments and of the error list
+of a single call.  The wrappers split the input by pool and then into
+chunks limited by the number of the entities and by the estimated size
+of the packed arguments.  The chunks for different pools are processed
+in parallel, the chunks for the same pool one after another.
+
+The chunks are independent calls, so the atomicity of the underlying
+operation holds only within a chunk: if one chunk fails, the entities
+in the other chunks are still processed.  The errors of all chunks are
+reported by a single exception of the same type as the one raised by
+the underlying function.
+
+The wrappers for the atomic creation operations also have a best effort
+mode, in which a failed chunk is retried without the entities that
+caused the failure.
+"""
+from __future__ import unicode_literals
+
+import collections
+
+from . import _libzfs_core as _lzc
+from . import exceptions
+from ._parallel import map_parallel, _dataset_pool, _MAX_WORKERS
+
+# The default limits on a single chunk.
+_MAX_CHUNK_ENTRIES = 5000
+_MAX_CHUNK_BYTES = 1024 * 1024
+
+# The size of the packed nvlist and nvpair headers.
+_NVLIST_HEADER_SIZE = 24
+_NVPAIR_HEADER_SIZE = 16
+
+
+def _align8(size):
+    return (size + 7) & ~7
+
+
+def _packed_size(name, value):
+    '''
+    Estimate the size of an nvpair in the native packed encoding.
+    '''
+    size = _NVPAIR_HEADER_SIZE + _align8(len(name) + 1)
+    if isinstance(value, list):
+        size += _NVLIST_HEADER_SIZE + sum(
+            _NVPAIR_HEADER_SIZE + _align8(len(v) + 1) for v in value)
+    elif hasattr(value, '__len__'):
+        size += _align8(len(value) + 1)
+    elif value is not None:
+        size += 8
+    return size
+
+
+def _chunks(names, values, max_entries, max_bytes):
+    '''
+    Split the names into the lists of the names in the same pool that
+    satisfy the limits.  A single entity that is larger than ``max_bytes``
+    makes up a chunk of its own.
+    '''
+    pools = collections.OrderedDict()
+    for name in names:
+        pools.setdefault(_dataset_pool(name), []).append(name)
+    chunks = []
+    for pool_names in pools.values():
+        chunk = []
+        chunk_bytes = _NVLIST_HEADER_SIZE
+        for name in pool_names:
+            size = _packed_size(name, values.get(name) if values else None)
+            if chunk and (len(chunk) >= max_entries or chunk_bytes + size > max_bytes):
+                chunks.append(chunk)
+                chunk = []
+                chunk_bytes = _NVLIST_HEADER_SIZE
+            chunk.append(name)
+            chunk_bytes += size
+        if chunk:
+            chunks.append(chunk)
+    return chunks
+
+
+def _best_effort(call, names, aliases=None):
+    '''
+    Make the call for as many of the entities as possible.
+
+    The entities named by the errors of a failed call are dropped and
+    the call is repeated for the rest.  If none of the errors names an
+    entity, then the entities are split in halves that are tried
+    separately, so the number of the calls grows with the number of
+    the failing entities rather than with the number of all entities.
+
+    The errors that a failed call did not report may belong to
+    the entities that are tried again, they are counted as suppressed
+    only if the repeated call succeeds, otherwise its own errors are
+    reported instead.
+
+    :param call: the function that makes the call for a list of names.
+    :param names: the names of the entities.
+    :param aliases: a dictionary that maps other names that can appear
+        in the errors to the lists of the entities they belong to.
+    :return: a tuple of the concatenated results of the successful calls,
+        an ordered dictionary that maps the names of the failed
+        entities to the lists of their errors or to the ZFS error raised
+        by a call that failed for a reason not specific to any entity,
+        and the number of the errors that were not reported.
+    '''
+    results = []
+    failed = collections.OrderedDict()
+    suppressed_count = 0
+    # The batches to try with the numbers of the errors not reported
+    # by the failed calls that they are retried after.
+    pending = [(list(names), 0)]
+    while pending:
+        (batch, carried) = pending.pop()
+        try:
+            result = call(batch)
+        except exceptions.MultipleOperationsFailure as e:
+            in_batch = set(batch)
+            named = collections.OrderedDict()
+            for error in e.errors:
+                name = getattr(error, 'name', None)
+                if name is None:
+                    continue
+                owners = [name] + list(aliases.get(name, ())) if aliases else [name]
+                for owner in owners:
+                    if owner in in_batch:
+                        named.setdefault(owner, []).append(error)
+            if named:
+                failed.update(named)
+                rest = [n for n in batch if n not in named]
+                if rest:
+                    pending.append((rest, e.suppressed_count))
+                else:
+                    suppressed_count += e.suppressed_count
+            elif len(batch) == 1:
+                failed[batch[0]] = list(e.errors)
+                suppressed_count += e.suppressed_count
+            else:
+                # The errors are found again by the calls for the halves.
+                middle = len(batch) // 2
+                pending.append((batch[middle:], 0))
+                pending.append((batch[:middle], 0))
+        except exceptions.ZFSError as e:
+            # An error that is not specific to any entity, there is
+            # no point in repeating the call.
+            for name in batch:
+                failed[name] = e
+        else:
+            suppressed_count += carried
+            if result:
+                results.extend(result)
+    return (results, failed, suppressed_count)
+
+
+def _call_chunk(call, chunk, best_effort, aliases):
+    if best_effort:
+        (result, failed, suppressed_count) = _best_effort(call, chunk, aliases)
+        errors = []
+        for errs in failed.values():
+            if not isinstance(errs, list):
+                errs = [errs]
+            for error in errs:
+                if error not in errors:
+                    errors.append(error)
+        return (result, errors, suppressed_count)
+    try:
+        return (call(chunk), [], 0)
+    except exceptions.MultipleOperationsFailure as e:
+        return (None, e.errors, e.suppressed_count)
+    except exceptions.ZFSError as e:
+        # An error that is not specific to any entity in the chunk.
+        return (None, [e], 0)
+
+
+def _bulk(call, names, values, exception, max_entries, max_bytes, max_workers,
+          best_effort=False, aliases=None):
+    if max_entries < 1:
+        raise ValueError('the chunk limits must be positive')
+    chunks = _chunks(names, values, max_entries, max_bytes)
+    results = map_parallel(
+        lambda first, chunk: _call_chunk(call, chunk, best_effort, aliases),
+        [(c[0], c) for c in chunks], max_workers=max_workers, max_per_pool=1)
+
+    merged = []
+    errors = []
+    suppressed_count = 0
+    for chunk_result in results:
+        if isinstance(chunk_result, Exception):
+            # Not an error of the operation, a bug or a bad argument.
+            raise chunk_result
+        (result, chunk_errors, chunk_suppressed) = chunk_result
+        if result:
+            merged.extend(result)
+        errors.extend(chunk_errors)
+        suppressed_count += chunk_suppressed
+    if errors:
+        raise exception(errors, suppressed_count)
+    return merged
+
+
+def bulk_snapshot(snaps, props=None, max_entries=_MAX_CHUNK_ENTRIES,
+                  max_bytes=_MAX_CHUNK_BYTES, max_workers=_MAX_WORKERS, best_effort=False):
+    '''
+    Create snapshots in any number of pools.
+
+    :param snaps: a list of names of snapshots to be created.
+    :type snaps: list of bytes
+    :param props: a `dict` of ZFS dataset property name-value pairs (empty by default).
+    :type props: dict of bytes:bytes
+    :param int max_entries: the maximum number of the snapshots per call.
+    :param int max_bytes: the maximum estimated size of the arguments per call.
+    :param int max_workers: the maximum number of the pools processed
+        concurrently.
+
+    :param bool best_effort: whether to create the snapshots that can be
+        created when some of the snapshots in the same chunk can not be.
+
+    :raises SnapshotFailure: if one or more snapshots could not be created.
+
+    See :func:`.lzc_snapshot` for the possible errors.  The snapshots in
+    the chunks that did not fail are created even if an exception is raised.
+    In the best effort mode all the snapshots that are not named by
+    the errors of the exception are created.
+    '''
+    return _bulk(lambda chunk: _lzc.lzc_snapshot(chunk, props), snaps, None,
+                 exceptions.SnapshotFailure, max_entries, max_bytes, max_workers,
+                 best_effort)
+
+
+def bulk_destroy_snaps(snaps, defer, max_entries=_MAX_CHUNK_ENTRIES,
+                       max_bytes=_MAX_CHUNK_BYTES, max_workers=_MAX_WORKERS):
+    '''
+    Destroy snapshots in any number of pools.
+
+    :param snaps: a list of names of snapshots to be destroyed.
+    :type snaps: list of bytes
+    :param bool defer: whether to mark busy snapshots for deferred destruction.
+    :param int max_entries: the maximum number of the snapshots per call.
+    :param int max_bytes: the maximum estimated size of the arguments per call.
+    :param int max_workers: the maximum number of the pools processed
+        concurrently.
+
+    :raises SnapshotDestructionFailure: if one or more snapshots could not
+        be destroyed.
+
+    See :func:`.lzc_destroy_snaps` for the details.
+    '''
+    return _bulk(lambda chunk: _lzc.lzc_destroy_snaps(chunk, defer), snaps, None,
+                 exceptions.SnapshotDestructionFailure, max_entries, max_bytes, max_workers)
+
+
+def bulk_hold(holds, fd=None, max_entries=_MAX_CHUNK_ENTRIES,
+              max_bytes=_MAX_CHUNK_BYTES, max_workers=_MAX_WORKERS, best_effort=False):
+    '''
+    Create *user holds* on snapshots in any number of pools.
+
+    :param holds: the dictionary of names of the snapshots to hold mapped to the hold names.
+    :type holds: dict of bytes : bytes
+    :param fd: the cleanup file descriptor as for :func:`.lzc_hold`.
+    :type fd: int or None
+    :param int max_entries: the maximum number of the holds per call.
+    :param int max_bytes: the maximum estimated size of the arguments per call.
+    :param int max_workers: the maximum number of the pools processed
+        concurrently.
+    :param bool best_effort: whether to create the holds that can be
+        created when some of the holds in the same chunk can not be.
+    :return: a list of the snapshots that do not exist.
+    :rtype: list of bytes
+
+    :raises HoldFailure: if a hold was impossible on one or more of the snapshots.
+
+    See :func:`.lzc_hold` for the details.  No holds are created only in
+    the chunks that failed.  In the best effort mode all the holds on
+    the snapshots that are not named by the errors of the exception
+    are created.
+    '''
+    return _bulk(lambda chunk: _lzc.lzc_hold(dict((k, holds[k]) for k in chunk), fd),
+                 list(holds.keys()), holds,
+                 exceptions.HoldFailure, max_entries, max_bytes, max_workers,
+                 best_effort)
+
+
+def bulk_release(holds, max_entries=_MAX_CHUNK_ENTRIES,
+                 max_bytes=_MAX_CHUNK_BYTES, max_workers=_MAX_WORKERS):
+    '''
+    Release *user holds* on snapshots in any number of pools.
+
+    :param holds: a ``dict`` where keys are snapshot names and values are
+                  lists of hold tags to remove.
+    :type holds: dict of bytes : list of bytes
+    :param int max_entries: the maximum number of the snapshots per call.
+    :param int max_bytes: the maximum estimated size of the arguments per call.
+    :param int max_workers: the maximum number of the pools processed
+        concurrently.
+    :return: a list of any snapshots that do not exist and of any tags that do not
+             exist for existing snapshots.
+    :rtype: list of bytes
+
+    :raises HoldReleaseFailure: if one or more existing holds could not be released.
+
+    See :func:`.lzc_release` for the details.
+    '''
+    return _bulk(lambda chunk: _lzc.lzc_release(dict((k, holds[k]) for k in chunk)),
+                 list(holds.keys()), holds,
+                 exceptions.HoldReleaseFailure, max_entries, max_bytes, max_workers)
+
+
+def bulk_bookmark(bookmarks, max_entries=_MAX_CHUNK_ENTRIES,
+                  max_bytes=_MAX_CHUNK_BYTES, max_workers=_MAX_WORKERS, best_effort=False):
+    '''
+    Create bookmarks in any number of pools.
+
+    :param bookmarks: a dict that maps names of wanted bookmarks to names of existing snapshots.
+    :type bookmarks: dict of bytes to bytes
+    :param int max_entries: the maximum number of the bookmarks per call.
+    :param int max_bytes: the maximum estimated size of the arguments per call.
+    :param int max_workers: the maximum number of the pools processed
+        concurrently.
+
+    :param bool best_effort: whether to create the bookmarks that can be
+        created when some of the bookmarks in the same chunk can not be.
+
+    :raises BookmarkFailure: if any of the bookmarks can not be created for any reason.
+
+    See :func:`.lzc_bookmark` for the details.  In the best effort mode
+    all the bookmarks that are not named by the errors of the exception,
+    either by their own names or by the names of their snapshots,
+    are created.
+    '''
+    # An error can name the snapshot rather than the bookmark.
+    aliases = collections.defaultdict(list)
+    for (bookmark, snap) in bookmarks.items():
+        aliases[snap].append(bookmark)
+    return _bulk(lambda chunk: _lzc.lzc_bookmark(dict((k, bookmarks[k]) for k in chunk)),
+                 list(bookmarks.keys()), bookmarks,
+                 exceptions.BookmarkFailure, max_entries, max_bytes, max_workers,
+                 best_effort, aliases)
+
+
+def bulk_destroy_bookmarks(bookmarks, max_entries=_MAX_CHUNK_ENTRIES,
+                           max_bytes=_MAX_CHUNK_BYTES, max_workers=_MAX_WORKERS):
+    '''
+    Destroy bookmarks in any number of pools.
+
+    :param bookmarks: a list of the bookmarks to be destroyed.
+    :type bookmarks: list of bytes
+    :param int max_entries: the maximum number of the bookmarks per call.
+    :param int max_bytes: the maximum estimated size of the arguments per call.
+    :param int max_workers: the maximum number of the pools processed
+        concurrently.
+
+    :raises BookmarkDestructionFailure: if any of the bookmarks may not be destroyed.
+
+    See :func:`.lzc_destroy_bookmarks` for the details.
+    '''
+    return _bulk(lambda chunk: _lzc.lzc_destroy_bookmarks(chunk), bookmarks, None,
+                 exceptions.BookmarkDestructionFailure, max_entries, max_bytes, max_workers)
+
+
+# vim: softtabstop=4 tabstop=4 expandtab shiftwidth=4
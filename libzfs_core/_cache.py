@@ -0,0 +1,337 @@
+# Copyright 2015 ClusterHQ. See LICENSE file for details.
+
+"""
+Opt-in caching of the dataset information.
+
+The caches are disabled by default.  When a cache is enabled the results
+of the corresponding function are kept for a limited time and the least
+recently used entries are evicted when the cache is full.  The wrappers
+of the operations that modify datasets invalidate the entries of
+the affected datasets and their descendants, so the changes made
+through this library are visible immediately.  The changes made by other
+processes become visible when the entries expire.
+"""
+from __future__ import unicode_literals
+
+import collections
+import threading
+import time
+
+from builtins import object
+
+from ._parallel import _dataset_pool
+
+# The default limits of a cache.
+_MAXSIZE = 4096
+_TTL = 5.0
+_EXISTS_TTL = 1.0
+
+_clock = getattr(time, 'monotonic', time.time)
+
+#: The statistics of a cache.
+CacheStats = collections.namedtuple(
+    'CacheStats', ['hits', 'misses', 'evictions', 'invalidations', 'size'])
+
+_MISSING = object()
+
+_SEPARATORS = bytearray(b'/@#')
+
+
+def _b(name):
+    if isinstance(name, bytes):
+        return name
+    return name.encode('utf-8')
+
+
+def _ancestors(name):
+    '''
+    Generate the name and the names of the datasets that contain it.
+    '''
+    name = _b(name)
+    yield name
+    for (i, c) in enumerate(bytearray(name)):
+        if c in _SEPARATORS:
+            yield name[:i]
+
+
+def _is_affected(key, names):
+    '''
+    Check if the dataset ``key`` is one of ``names``, or a snapshot,
+    or bookmark, or descendant of one of them.
+    '''
+    return any(a in names for a in _ancestors(key))
+
+
+class _Cache(object):
+
+    '''
+    A bounded mapping of dataset names to values with an expiration time.
+
+    Every invalidation starts a new generation.  A value computed before
+    an invalidation is not stored, because it could predate the change
+    that caused the invalidation.
+    '''
+
+    def __init__(self, maxsize, ttl):
+        if maxsize < 1 or ttl <= 0:
+            raise ValueError('invalid cache limits')
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self._generation = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._invalidations = 0
+
+    def lookup(self, key):
+        '''
+        :return: a tuple of the cached value or ``_MISSING`` and
+            the generation to pass to :meth:`store`.
+        '''
+        with self._lock:
+            value = self._get(key)
+            if value is _MISSING:
+                self._misses += 1
+            else:
+                self._hits += 1
+            return (value, self._generation)
+
+    def generation(self):
+        with self._lock:
+            return self._generation
+
+    def store(self, key, value, generation):
+        with self._lock:
+            if generation == self._generation:
+                self._put(key, value)
+
+    def invalidate(self, names):
+        with self._lock:
+            self._generation += 1
+            self._invalidate(set(_b(n) for n in names))
+
+    def _get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return _MISSING
+        (value, expires) = entry
+        if expires <= _clock():
+            del self._entries[key]
+            self._dropped(key, value)
+            return _MISSING
+        self._entries[key] = self._entries.pop(key)
+        return value
+
+    def _put(self, key, value):
+        self._entries.pop(key, None)
+        self._entries[key] = (value, _clock() + self._ttl)
+        while len(self._entries) > self._maxsize:
+            (evicted, (evicted_value, _)) = self._entries.popitem(last=False)
+            self._evictions += 1
+            self._dropped(evicted, evicted_value)
+
+    def _dropped(self, key, value):
+        '''
+        Called when an entry is evicted or expires.
+        '''
+
+    def _invalidate(self, names):
+        for key in [k for k in self._entries if _is_affected(k, names)]:
+            del self._entries[key]
+            self._invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            return CacheStats(self._hits, self._misses, self._evictions,
+                              self._invalidations, len(self._entries))
+
+
+class _ExistsCache(_Cache):
+
+    '''
+    A cache of the existence of datasets.
+
+    Besides the individual names the cache keeps the roots of the subtrees
+    that were listed completely.  A name in such a subtree that is not
+    in the cache does not exist.
+    '''
+
+    def __init__(self, maxsize, ttl):
+        super(_ExistsCache, self).__init__(maxsize, ttl)
+        self._complete = {}
+
+    def update(self, invalidated=(), values=None):
+        '''
+        Invalidate the subtrees of the ``invalidated`` names and then
+        set the existence of the names in ``values``.
+        '''
+        with self._lock:
+            self._generation += 1
+            if invalidated:
+                self._invalidate(set(_b(n) for n in invalidated))
+            for (name, exists) in (values or {}).items():
+                self._put(_b(name), exists)
+
+    def prime(self, root, names, generation):
+        '''
+        Record the result of a complete listing of the subtree of ``root``.
+        '''
+        with self._lock:
+            if generation != self._generation:
+                return
+            now = _clock()
+            self._complete = dict((k, v) for (k, v) in self._complete.items() if v > now)
+            # Mark the root first, so that a name evicted while priming
+            # clears the mark again.
+            self._complete[_b(root)] = now + self._ttl
+            for name in names:
+                self._put(_b(name), True)
+
+    def _get(self, key):
+        value = super(_ExistsCache, self)._get(key)
+        if value is _MISSING and self._complete:
+            now = _clock()
+            if any(self._complete.get(root, 0) > now for root in _ancestors(key)):
+                return False
+        return value
+
+    def _dropped(self, key, value):
+        # A subtree that lost one of its existing names is no longer
+        # completely known.
+        if value and self._complete:
+            for root in _ancestors(key):
+                self._complete.pop(root, None)
+
+    def _invalidate(self, names):
+        super(_ExistsCache, self)._invalidate(names)
+        # A changed subtree is no longer completely known.
+        for root in list(self._complete):
+            if _is_affected(root, names) or any(a == root for n in names for a in _ancestors(n)):
+                del self._complete[root]
+
+
+_props_cache = None
+_exists_cache = None
+
+
+def enable_props_cache(maxsize=_MAXSIZE, ttl=_TTL):
+    '''
+    Enable caching of the results of :func:`.lzc_get_props`.
+
+    :param int maxsize: the maximum number of the cached datasets.
+    :param float ttl: the time in seconds after which a cached result expires.
+
+    Enabling the cache again discards the cached results.
+    '''
+    global _props_cache
+    _props_cache = _Cache(maxsize, ttl)
+
+
+def disable_props_cache():
+    '''
+    Disable caching of the results of :func:`.lzc_get_props`
+    and discard the cached results.
+    '''
+    global _props_cache
+    _props_cache = None
+
+
+def props_cache_stats():
+    '''
+    Get the statistics of the :func:`.lzc_get_props` cache.
+
+    :return: the numbers of the hits, misses, evictions and invalidated
+        entries since the cache was enabled and the current number of
+        the entries, or ``None`` if the cache is disabled.
+    :rtype: CacheStats or None
+    '''
+    cache = _props_cache
+    if cache is None:
+        return None
+    return cache.stats()
+
+
+def enable_exists_cache(maxsize=_MAXSIZE, ttl=_EXISTS_TTL):
+    '''
+    Enable caching of the results of :func:`.lzc_exists`.
+
+    Both the existing and the missing datasets are cached.
+
+    :param int maxsize: the maximum number of the cached names.
+    :param float ttl: the time in seconds after which a cached result expires.
+
+    Enabling the cache again discards the cached results.
+    The cache can be filled in advance with :func:`.prime_exists_cache`.
+    '''
+    global _exists_cache
+    _exists_cache = _ExistsCache(maxsize, ttl)
+
+
+def disable_exists_cache():
+    '''
+    Disable caching of the results of :func:`.lzc_exists`
+    and discard the cached results.
+    '''
+    global _exists_cache
+    _exists_cache = None
+
+
+def exists_cache_stats():
+    '''
+    Get the statistics of the :func:`.lzc_exists` cache.
+
+    :return: the numbers of the hits, misses, evictions and invalidated
+        entries since the cache was enabled and the current number of
+        the entries, or ``None`` if the cache is disabled.
+    :rtype: CacheStats or None
+    '''
+    cache = _exists_cache
+    if cache is None:
+        return None
+    return cache.stats()
+
+
+def _exists_changed(ret, values, invalidated=()):
+    '''
+    Update the existence cache after an operation.
+
+    :param int ret: the return code of the operation.
+    :param values: the existence of the datasets after a successful operation.
+    :type values: dict of bytes:bool
+    :param invalidated: the names of the datasets the subtrees of which
+        are changed by a successful operation.
+
+    If the operation fails, then all the names are invalidated, because
+    the operation could be partially completed.
+    '''
+    cache = _exists_cache
+    if cache is None:
+        return
+    if ret == 0:
+        cache.update(invalidated, values)
+    else:
+        cache.update(list(invalidated) + list(values))
+
+
+def _invalidate(*names):
+    '''
+    Invalidate the cached information about the given datasets and their
+    snapshots, bookmarks and descendants.
+    '''
+    cache = _props_cache
+    if cache is None:
+        return
+    cache.invalidate(names)
+
+
+def _invalidate_pool(name):
+    pool = _dataset_pool(name)
+    _invalidate(pool)
+    cache = _exists_cache
+    if cache is not None:
+        cache.update([pool])
+
+
+# vim: softtabstop=4 tabstop=4 expandtab shiftwidth=4
@@ -0,0 +1,248 @@
+# Copyright 2015 ClusterHQ. See LICENSE file for details.
+
+"""
+Columnar storage of large dataset listings.
+
+A listing of many datasets, typically snapshots, is kept as a few
+contiguous arrays instead of a dictionary per dataset: the names are
+concatenated into a single string table indexed by an array of offsets
+and every numeric property is a column of unsigned 64-bit integers.
+A dataset then takes tens of bytes rather than kilobytes.
+"""
+from __future__ import unicode_literals
+
+import array
+import sys
+
+from builtins import object
+from builtins import range
+
+from . import _libzfs_core as _lzc
+from ._packed import _array_typecode
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# The numeric properties stored by default.
+_COLUMNS = ('guid', 'createtxg', 'used', 'referenced', 'creation')
+
+# 'Q' is not available on Python 2, where 'L' is 64-bit on LP64 systems.
+_UINT64 = _array_typecode('Q')
+
+
+class ListingRow(object):
+
+    '''
+    A lightweight proxy for a single dataset of a :class:`ColumnarListing`.
+
+    The proxy does not copy any data, the values are fetched from
+    the columns of the listing when they are accessed.
+    '''
+
+    __slots__ = ('_listing', '_index')
+
+    def __init__(self, listing, index):
+        self._listing = listing
+        self._index = index
+
+    @property
+    def name(self):
+        '''
+        The name of the dataset.
+        '''
+        return self._listing.name(self._index)
+
+    def __getitem__(self, prop):
+        return self._listing.column(prop)[self._index]
+
+    def __repr__(self):
+        return 'ListingRow(%r)' % (self.to_dict(),)
+
+    def to_dict(self):
+        '''
+        :return: a dictionary with the name of the dataset under ``name``
+            and the values of all stored properties.
+        :rtype: dict of bytes:Any
+        '''
+        result = {b'name': self.name}
+        for prop in self._listing.columns:
+            result[prop] = self[prop]
+        return result
+
+
+class ColumnarListing(object):
+
+    '''
+    A listing of datasets stored column by column.
+
+    The listing is a sequence of :class:`ListingRow` objects in the order
+    the datasets were listed.  The names and the columns of the property
+    values can also be accessed in bulk.
+
+    :param columns: the names of the numeric properties to store.
+    :type columns: list of bytes
+    '''
+
+    def __init__(self, columns=_COLUMNS):
+        self._names = bytearray()
+        self._offsets = array.array(_UINT64, [0])
+        self._columns = dict((_lzc._b(c), array.array(_UINT64)) for c in columns)
+        self._column_names = tuple(_lzc._b(c) for c in columns)
+
+    @property
+    def columns(self):
+        '''
+        The names of the stored properties.
+        '''
+        return self._column_names
+
+    def append(self, name, values):
+        '''
+        Add a dataset to the listing.
+
+        :param bytes name: the name of the dataset.
+        :param values: the values of the properties, a missing property
+            is stored as zero.
+        :type values: dict of bytes:int
+        :raises BufferError: if a view of a column returned by
+            :meth:`numpy_column` is alive, the listing is not modified.
+        '''
+        name = _lzc._b(name)
+        appended = []
+        try:
+            for (prop, column) in self._columns.items():
+                column.append(values.get(prop, 0))
+                appended.append(column)
+        except Exception:
+            for column in appended:
+                column.pop()
+            raise
+        self._names += name
+        self._offsets.append(len(self._names))
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def _index(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('listing index out of range')
+        return index
+
+    def __getitem__(self, index):
+        return ListingRow(self, self._index(index))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield ListingRow(self, i)
+
+    def name(self, index):
+        '''
+        Get the name of a dataset.
+
+        :param int index: the position of the dataset in the listing.
+        :rtype: bytes
+        '''
+        index = self._index(index)
+        return bytes(self._names[self._offsets[index]:self._offsets[index + 1]])
+
+    def names(self):
+        '''
+        Generate the names of all datasets in the listing.
+        '''
+        names = self._names
+        offsets = self._offsets
+        for i in range(len(self)):
+            yield bytes(names[offsets[i]:offsets[i + 1]])
+
+    def column(self, prop):
+        '''
+        Get the values of a property of all datasets.
+
+        :param bytes prop: the name of the property.
+        :return: the column, it must not be modified.
+        :rtype: array.array
+        :raises KeyError: if the property is not stored.
+        '''
+        return self._columns[_lzc._b(prop)]
+
+    def numpy_column(self, prop):
+        '''
+        Get the values of a property of all datasets as a NumPy array.
+
+        On Python 3 the array is a view of the column, the data is not
+        copied, and :meth:`append` is refused while the view is alive.
+        On Python 2 the buffer of the column can not be locked and
+        the array is a copy.
+
+        :param bytes prop: the name of the property.
+        :rtype: numpy.ndarray
+        :raises KeyError: if the property is not stored.
+        :raises ImportError: if NumPy is not installed.
+        '''
+        if numpy is None:
+            raise ImportError('NumPy is not installed')
+        column = self.column(prop)
+        if len(column) == 0:
+            return numpy.zeros(0, dtype=numpy.uint64)
+        if sys.version_info[0] < 3:
+            return numpy.array(column, dtype=numpy.uint64)
+        return numpy.frombuffer(column, dtype=numpy.uint64)
+
+    def nbytes(self):
+        '''
+        :return: the number of bytes occupied by the names and the columns.
+        :rtype: int
+        '''
+        size = len(self._names) + len(self._offsets) * self._offsets.itemsize
+        for column in self._columns.values():
+            size += len(column) * column.itemsize
+        return size
+
+
+def list_columnar(name, types=('snapshot',), recurse=1, columns=_COLUMNS):
+    '''
+    List the datasets below the given dataset into a :class:`ColumnarListing`.
+
+    Only the names and the given numeric properties of the datasets
+    are decoded from the listing, the other values are skipped.
+
+    :param bytes name: the name of the filesystem or volume.
+    :param types: the types of the datasets to list, any of
+        "filesystem", "volume" and "snapshot".
+    :type types: list of str
+    :param recurse: the depth of the listing, by default the snapshots
+        and children of the dataset are listed.  If ``None`` the depth
+        is not limited.
+    :type recurse: int or None
+    :param columns: the names of the numeric properties to store.
+    :type columns: list of bytes
+    :return: the listing, it does not include the dataset itself.
+    :rtype: ColumnarListing
+    :raises DatasetNotFound: if the dataset does not exist.
+
+    Example::
+
+        snaps = list_columnar(b'pool/fs')
+        newest = max(snaps, key=lambda snap: snap[b'createtxg'])
+    '''
+    name = _lzc._b(name)
+    listing = ColumnarListing(columns)
+    properties = dict((c, [b'value']) for c in listing.columns)
+    fields = {b'name': None, b'properties': properties}
+    entries = _lzc._list(name, recurse=recurse, types=list(types), fields=fields)
+    for entry in entries:
+        entry_name = entry[b'name']
+        if entry_name == name:
+            continue
+        values = {}
+        for (prop, value) in entry.get(b'properties', {}).items():
+            values[prop] = value[b'value']
+        listing.append(entry_name, values)
+    return listing
+
+
+# vim: softtabstop=4 tabstop=4 expandtab shiftwidth=4
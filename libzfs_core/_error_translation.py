@@ -15,6 +15,7 @@ The parameters and exceptions are documented in the `libzfs_core` interfaces.
 from __future__ import unicode_literals
 
 from builtins import map
+from builtins import object
 import errno
 import re
 import string
@@ -74,18 +75,18 @@ def lzc_snapshot_translate_errors(ret, errlist, snaps, props):
     if ret == 0:
         return
 
+    names = _NameContext(snaps)
+
     def _map(ret, name):
         if ret == errno.EXDEV:
-            pool_names = list(map(_pool_name, snaps))
-            same_pool = all(x == pool_names[0] for x in pool_names)
-            if same_pool:
+            if names.same_pool():
                 return lzc_exc.DuplicateSnapshots(name)
             else:
                 return lzc_exc.PoolsDiffer(name)
         elif ret == errno.EINVAL:
-            if any(not _is_valid_snap_name(s) for s in snaps):
+            if names.invalid(_is_valid_snap_name):
                 return lzc_exc.NameInvalid(name)
-            elif any(len(s) > MAXNAMELEN for s in snaps):
+            elif names.too_long():
                 return lzc_exc.NameTooLong(name)
             else:
                 return lzc_exc.PropertyInvalid(name)
@@ -119,21 +120,22 @@ def lzc_bookmark_translate_errors(ret, errlist, bookmarks):
     if ret == 0:
         return
 
+    names = _NameContext(list(bookmarks.keys()))
+
     def _map(ret, name):
         if ret == errno.EINVAL:
             if name:
                 snap = bookmarks[name]
-                pool_names = list(map(_pool_name, list(bookmarks.keys())))
                 if not _is_valid_bmark_name(name):
                     return lzc_exc.BookmarkNameInvalid(name)
                 elif not _is_valid_snap_name(snap):
                     return lzc_exc.SnapshotNameInvalid(snap)
                 elif _fs_name(name) != _fs_name(snap):
                     return lzc_exc.BookmarkMismatch(name)
-                elif any(x != _pool_name(name) for x in pool_names):
+                elif names.pools_differ(name):
                     return lzc_exc.PoolsDiffer(name)
             else:
-                invalid_names = [b for b in list(bookmarks.keys()) if not _is_valid_bmark_name(b)]
+                invalid_names = names.invalid(_is_valid_bmark_name)
                 if invalid_names:
                     return lzc_exc.BookmarkNameInvalid(invalid_names[0])
         if ret == errno.EEXIST:
@@ -197,20 +199,21 @@ def lzc_hold_translate_errors(ret, errlist, holds, fd):
     if ret == 0:
         return
 
+    names = _NameContext(list(holds.keys()))
+
     def _map(ret, name):
         if ret == errno.EXDEV:
             return lzc_exc.PoolsDiffer(name)
         elif ret == errno.EINVAL:
             if name:
-                pool_names = list(map(_pool_name, list(holds.keys())))
                 if not _is_valid_snap_name(name):
                     return lzc_exc.NameInvalid(name)
                 elif len(name) > MAXNAMELEN:
                     return lzc_exc.NameTooLong(name)
-                elif any(x != _pool_name(name) for x in pool_names):
+                elif names.pools_differ(name):
                     return lzc_exc.PoolsDiffer(name)
             else:
-                invalid_names = [b for b in list(holds.keys()) if not _is_valid_snap_name(b)]
+                invalid_names = names.invalid(_is_valid_snap_name)
                 if invalid_names:
                     return lzc_exc.NameInvalid(invalid_names[0])
         fs_name = None
@@ -242,20 +245,21 @@ def lzc_release_translate_errors(ret, errlist, holds):
         if not isinstance(hold_list, list):
             raise lzc_exc.TypeError('holds must be in a list')
 
+    names = _NameContext(list(holds.keys()))
+
     def _map(ret, name):
         if ret == errno.EXDEV:
             return lzc_exc.PoolsDiffer(name)
         elif ret == errno.EINVAL:
             if name:
-                pool_names = list(map(_pool_name, list(holds.keys())))
                 if not _is_valid_snap_name(name):
                     return lzc_exc.NameInvalid(name)
                 elif len(name) > MAXNAMELEN:
                     return lzc_exc.NameTooLong(name)
-                elif any(x != _pool_name(name) for x in pool_names):
+                elif names.pools_differ(name):
                     return lzc_exc.PoolsDiffer(name)
             else:
-                invalid_names = [b for b in list(holds.keys()) if not _is_valid_snap_name(b)]
+                invalid_names = names.invalid(_is_valid_snap_name)
                 if invalid_names:
                     return lzc_exc.NameInvalid(invalid_names[0])
         elif ret == errno.ENOENT:
@@ -533,6 +537,57 @@ def _handle_err_list(ret, errlist, names, exception, mapper):
     raise exception(errors, suppressed_count)
 
 
+class _NameContext(object):
+
+    '''
+    The facts about all the names of a multi-entity operation that are used
+    to translate the errors of the individual entities.
+
+    Each fact is computed on the first use and then reused for the other
+    errors of the same call, so that the translation of a large error list
+    takes linear time.
+    '''
+
+    def __init__(self, names):
+        self._names = names
+        self._pools = None
+        self._invalid = {}
+        self._too_long = None
+
+    def _pool_set(self):
+        if self._pools is None:
+            self._pools = set(map(_pool_name, self._names))
+        return self._pools
+
+    def same_pool(self):
+        '''
+        Return True if all the names are in the same pool.
+        '''
+        return len(self._pool_set()) <= 1
+
+    def pools_differ(self, name):
+        '''
+        Return True if any of the names is in a pool other than that of ``name``.
+        '''
+        return bool(self._pool_set() - set([_pool_name(name)]))
+
+    def invalid(self, validator):
+        '''
+        Return the list of the names rejected by ``validator``.
+        '''
+        if validator not in self._invalid:
+            self._invalid[validator] = [n for n in self._names if not validator(n)]
+        return self._invalid[validator]
+
+    def too_long(self):
+        '''
+        Return True if any of the names is longer than ``MAXNAMELEN``.
+        '''
+        if self._too_long is None:
+            self._too_long = any(len(n) > MAXNAMELEN for n in self._names)
+        return self._too_long
+
+
 def _pool_name(name):
     '''
     Extract a pool name from the given dataset or bookmark name.
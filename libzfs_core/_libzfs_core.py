@@ -14,10 +14,13 @@ rather than by integer error codes.
 """
 from __future__ import unicode_literals
 
+import copy
 import errno
 import fcntl
 import functools
+import io
 import os
+import queue
 import struct
 import threading
 
@@ -25,12 +28,16 @@ from builtins import next
 from builtins import object
 from builtins import str
 
+from . import _cache
 from . import _error_translation as errors
 from . import exceptions
 from ._constants import MAXNAMELEN
-from ._nvlist import nvlist_in, nvlist_out
+from ._nvlist import nvlist_in_scope, nvlist_out, NvlistView, _projection
+from ._packed import unpack_nvlist
+from ._schema import (
+    _ZFS_PROPS, _RECEIVE_PROPS, _LIST_OPTIONS, _NAMES, _HOLDS, _RELEASE, _BOOKMARKS
+)
 from .bindings import libzfs_core
-from .ctypes import int32_t
 
 
 def _b(s):
@@ -66,8 +73,10 @@ def lzc_create(name, ds_type='zfs', props=None):
         ds_type = _lib.DMU_OST_ZVOL
     else:
         raise exceptions.DatasetTypeInvalid(ds_type)
-    nvlist = nvlist_in(props)
-    ret = _lib.lzc_create(_b(name), ds_type, nvlist)
+    with nvlist_in_scope(props, _ZFS_PROPS, cached=True) as nvlist:
+        ret = _lib.lzc_create(_b(name), ds_type, nvlist)
+    _cache._invalidate(name)
+    _cache._exists_changed(ret, {name: True})
     errors.lzc_create_translate_error(ret, name, ds_type, props)
 
 
@@ -100,8 +109,10 @@ def lzc_clone(name, origin, props=None):
     '''
     if props is None:
         props = {}
-    nvlist = nvlist_in(props)
-    ret = _lib.lzc_clone(_b(name), _b(origin), nvlist)
+    with nvlist_in_scope(props, _ZFS_PROPS, cached=True) as nvlist:
+        ret = _lib.lzc_clone(_b(name), _b(origin), nvlist)
+    _cache._invalidate(name)
+    _cache._exists_changed(ret, {name: True})
     errors.lzc_clone_translate_error(ret, name, origin, props)
 
 
@@ -121,6 +132,7 @@ def lzc_rollback(name):
     # Account for terminating NUL in C strings.
     snapnamep = _ffi.new('char[]', MAXNAMELEN + 1)
     ret = _lib.lzc_rollback(_b(name), snapnamep, MAXNAMELEN + 1)
+    _cache._invalidate(name)
     errors.lzc_rollback_translate_error(ret, name)
     return _ffi.string(snapnamep)
 
@@ -175,12 +187,14 @@ def lzc_snapshot(snaps, props=None):
     '''
     snaps_dict = {name: None for name in snaps}
     errlist = {}
-    snaps_nvlist = nvlist_in(snaps_dict)
     if props is None:
         props = {}
-    props_nvlist = nvlist_in(props)
-    with nvlist_out(errlist) as errlist_nvlist:
+    with nvlist_in_scope(snaps_dict, _NAMES) as snaps_nvlist, \
+            nvlist_in_scope(props, _ZFS_PROPS) as props_nvlist, \
+            nvlist_out(errlist) as errlist_nvlist:
         ret = _lib.lzc_snapshot(snaps_nvlist, props_nvlist, errlist_nvlist)
+    _cache._invalidate(*snaps)
+    _cache._exists_changed(ret, dict.fromkeys(snaps, True))
     errors.lzc_snapshot_translate_errors(ret, errlist, snaps, props)
 
 
@@ -225,9 +239,15 @@ def lzc_destroy_snaps(snaps, defer):
     '''
     snaps_dict = {name: None for name in snaps}
     errlist = {}
-    snaps_nvlist = nvlist_in(snaps_dict)
-    with nvlist_out(errlist) as errlist_nvlist:
+    with nvlist_in_scope(snaps_dict, _NAMES) as snaps_nvlist, \
+            nvlist_out(errlist) as errlist_nvlist:
         ret = _lib.lzc_destroy_snaps(snaps_nvlist, defer, errlist_nvlist)
+    _cache._invalidate(*snaps)
+    if defer:
+        # The snapshots that are held or cloned continue to exist.
+        _cache._exists_changed(ret, {}, snaps)
+    else:
+        _cache._exists_changed(ret, dict.fromkeys(snaps, False))
     errors.lzc_destroy_snaps_translate_errors(ret, errlist, snaps, defer)
 
 
@@ -245,8 +265,8 @@ def lzc_bookmark(bookmarks):
     snapshots must be in the same pool.
     '''
     errlist = {}
-    nvlist = nvlist_in(bookmarks)
-    with nvlist_out(errlist) as errlist_nvlist:
+    with nvlist_in_scope(bookmarks, _BOOKMARKS) as nvlist, \
+            nvlist_out(errlist) as errlist_nvlist:
         ret = _lib.lzc_bookmark(nvlist, errlist_nvlist)
     errors.lzc_bookmark_translate_errors(ret, errlist, bookmarks)
 
@@ -281,8 +301,8 @@ def lzc_get_bookmarks(fsname, props=None):
     if props is None:
         props = []
     props_dict = {name: None for name in props}
-    nvlist = nvlist_in(props_dict)
-    with nvlist_out(bmarks) as bmarks_nvlist:
+    with nvlist_in_scope(props_dict, _NAMES) as nvlist, \
+            nvlist_out(bmarks) as bmarks_nvlist:
         ret = _lib.lzc_get_bookmarks(_b(fsname), nvlist, bmarks_nvlist)
     errors.lzc_get_bookmarks_translate_error(ret, fsname, props)
     return bmarks
@@ -309,8 +329,8 @@ def lzc_destroy_bookmarks(bookmarks):
     '''
     errlist = {}
     bmarks_dict = {name: None for name in bookmarks}
-    nvlist = nvlist_in(bmarks_dict)
-    with nvlist_out(errlist) as errlist_nvlist:
+    with nvlist_in_scope(bmarks_dict, _NAMES) as nvlist, \
+            nvlist_out(errlist) as errlist_nvlist:
         ret = _lib.lzc_destroy_bookmarks(nvlist, errlist_nvlist)
     errors.lzc_destroy_bookmarks_translate_errors(ret, errlist, bookmarks)
 
@@ -383,8 +403,8 @@ def lzc_hold(holds, fd=None):
     errlist = {}
     if fd is None:
         fd = -1
-    nvlist = nvlist_in(holds)
-    with nvlist_out(errlist) as errlist_nvlist:
+    with nvlist_in_scope(holds, _HOLDS) as nvlist, \
+            nvlist_out(errlist) as errlist_nvlist:
         ret = _lib.lzc_hold(nvlist, fd, errlist_nvlist)
     errors.lzc_hold_translate_errors(ret, errlist, holds, fd)
     # If there is no error (no exception raised by _handleErrList), but errlist
@@ -428,8 +448,8 @@ def lzc_release(holds):
         if not isinstance(hold_list, list):
             raise TypeError('holds must be in a list')
         holds_dict[snap] = {hold: None for hold in hold_list}
-    nvlist = nvlist_in(holds_dict)
-    with nvlist_out(errlist) as errlist_nvlist:
+    with nvlist_in_scope(holds_dict, _RELEASE) as nvlist, \
+            nvlist_out(errlist) as errlist_nvlist:
         ret = _lib.lzc_release(nvlist, errlist_nvlist)
     errors.lzc_release_translate_errors(ret, errlist, holds)
     # If there is no error (no exception raised by _handleErrList), but errlist
@@ -657,8 +677,11 @@ def lzc_receive(snapname, fd, force=False, origin=None, props=None):
         c_origin = _ffi.NULL
     if props is None:
         props = {}
-    nvlist = nvlist_in(props)
-    ret = _lib.lzc_receive(_b(snapname), nvlist, _b(c_origin), force, fd)
+    with nvlist_in_scope(props, _RECEIVE_PROPS) as nvlist:
+        ret = _lib.lzc_receive(_b(snapname), nvlist, _b(c_origin), force, fd)
+    fsname = _b(snapname).split(b'@')[0]
+    _cache._invalidate(fsname)
+    _cache._exists_changed(ret, {fsname: True, snapname: True}, [fsname])
     errors.lzc_receive_translate_error(ret, snapname, fd, force, origin, props)
 
 
@@ -676,9 +699,40 @@ def lzc_exists(name):
 
     .. note::
         ``lzc_exists`` can not be used to check for existence of bookmarks.
+
+    .. note::
+        The results can be cached, see :func:`.enable_exists_cache`.
     '''
-    ret = _lib.lzc_exists(_b(name))
-    return bool(ret)
+    cache = _cache._exists_cache
+    if cache is None:
+        return bool(_lib.lzc_exists(_b(name)))
+    (exists, generation) = cache.lookup(_b(name))
+    if exists is _cache._MISSING:
+        exists = bool(_lib.lzc_exists(_b(name)))
+        cache.store(_b(name), exists, generation)
+    return exists
+
+
+def prime_exists_cache(name):
+    '''
+    Fill the :func:`lzc_exists` cache with a listing of the given dataset,
+    its descendants and their snapshots.
+
+    Until the results expire, :func:`lzc_exists` answers for any name
+    in the listed subtree from the cache, including the names that
+    do not exist.  Nothing is done if the cache is not enabled.
+
+    :param bytes name: the name of the filesystem or volume to list.
+    :raises DatasetNotFound: if the dataset does not exist.
+    '''
+    cache = _cache._exists_cache
+    if cache is None:
+        return
+    generation = cache.generation()
+    entries = _list(name, recurse=None, types=['filesystem', 'volume', 'snapshot'],
+                    fields=_NAME_FIELDS)
+    names = [entry[b'name'] for entry in entries]
+    cache.prime(name, names, generation)
 
 
 def is_supported(func):
@@ -756,6 +810,8 @@ def lzc_promote(name):
                             the same name as one of the origin's snapshots.
     '''
     ret = _lib.lzc_promote(name, _ffi.NULL, _ffi.NULL)
+    # The snapshots move between the clone and its origin.
+    _cache._invalidate_pool(name)
     errors.lzc_promote_translate_error(ret, name)
 
 
@@ -776,6 +832,8 @@ def lzc_rename(source, target):
     :raises PoolsDiffer: if the source and target belong to different pools.
     '''
     ret = _lib.lzc_rename(source, target, _ffi.NULL, _ffi.NULL)
+    _cache._invalidate(source, target)
+    _cache._exists_changed(ret, {source: False, target: True}, [source, target])
     errors.lzc_rename_translate_error(ret, source, target)
 
 
@@ -790,6 +848,8 @@ def lzc_destroy_one(name):
     :raises FilesystemNotFound: if the dataset does not exist.
     '''
     ret = _lib.lzc_destroy_one(name, _ffi.NULL)
+    _cache._invalidate(name)
+    _cache._exists_changed(ret, {name: False}, [name])
     errors.lzc_destroy_translate_error(ret, name)
 
 
@@ -820,6 +880,7 @@ def lzc_inherit(name, prop):
     This function can be used on snapshots to inherit user defined properties.
     '''
     ret = _lib.lzc_inherit(name, prop, _ffi.NULL)
+    _cache._invalidate(name)
     errors.lzc_inherit_prop_translate_error(ret, name, prop)
 
 
@@ -852,8 +913,9 @@ def lzc_set_props(name, prop, val):
         without reporting any error.
     '''
     props = {prop: val}
-    props_nv = nvlist_in(props)
-    ret = _lib.lzc_set_props(name, props_nv, _ffi.NULL, _ffi.NULL)
+    with nvlist_in_scope(props, _ZFS_PROPS) as props_nv:
+        ret = _lib.lzc_set_props(name, props_nv, _ffi.NULL, _ffi.NULL)
+    _cache._invalidate(name)
     errors.lzc_set_prop_translate_error(ret, name, prop, val)
 
 
@@ -915,9 +977,9 @@ def lzc_list(name, options):
     fcntl.fcntl(rfd, fcntl.F_SETFD, fcntl.FD_CLOEXEC)
     fcntl.fcntl(wfd, fcntl.F_SETFD, fcntl.FD_CLOEXEC)
     options = options.copy()
-    options['fd'] = int32_t(wfd)
-    opts_nv = nvlist_in(options)
-    ret = _lib.lzc_list(name, opts_nv)
+    options['fd'] = wfd
+    with nvlist_in_scope(options, _LIST_OPTIONS) as opts_nv:
+        ret = _lib.lzc_list(name, opts_nv)
     if ret == errno.ESRCH:
         return (None, None)
     errors.lzc_list_translate_error(ret, name, options)
@@ -928,8 +990,276 @@ def lzc_list(name, options):
 _PIPE_RECORD_FORMAT = 'IBBBB'
 _PIPE_RECORD_SIZE = struct.calcsize(_PIPE_RECORD_FORMAT)
 
+# The default maximum size of the buffer for reading the listing data.
+_LIST_BUFSIZE = 1024 * 1024
+
+# The initial size of the buffer, enough for a typical single record.
+_LIST_INITIAL_BUFSIZE = 16 * 1024
+
+# The projections of the listing elements used by the wrappers.
+_NAME_FIELDS = {b'name': None}
+_PROPS_FIELDS = {
+    b'name': None,
+    b'dmu_objset_stats': [b'dds_is_snapshot', b'dds_type'],
+}
+
+
+class _RecordReader(object):
+
+    '''
+    A reader of the records written by the kernel to the :func:`lzc_list`
+    pipe.
+
+    The data is read in large chunks into a buffer that is reused for
+    the subsequent records, so a single system call usually fetches many
+    records.  A record payload is passed to C directly from the buffer.
+    The buffer starts small, so that a short listing does not pay for
+    a large allocation, and doubles up to ``bufsize`` every time it is
+    used up.  It also grows if a record does not fit into it.
+
+    The reader does not own the file descriptor.  Instead of the file
+    descriptor the reader can be given any object with a ``readinto``
+    method.
+    '''
+
+    def __init__(self, source, bufsize=_LIST_BUFSIZE):
+        if hasattr(source, 'readinto'):
+            self._file = source
+        else:
+            self._file = io.FileIO(source, 'rb', closefd=False)
+        self._bufsize = max(bufsize, _PIPE_RECORD_SIZE)
+        self._set_buffer(bytearray(min(self._bufsize, _LIST_INITIAL_BUFSIZE)))
+        # The unconsumed data is self._buf[self._start:self._end].
+        self._start = 0
+        self._end = 0
+        self._eof = False
+
+    def _set_buffer(self, buf):
+        self._buf = buf
+        self._view = memoryview(buf)
+        self._cbuf = _ffi.from_buffer(buf)
+
+    def _fill(self, needed):
+        '''
+        Make sure that at least ``needed`` unconsumed bytes are buffered.
+
+        :return: ``False`` if the end of the data is reached before that.
+        '''
+        while self._end - self._start < needed:
+            if self._eof:
+                return False
+            if self._start + needed > len(self._buf):
+                pending = self._end - self._start
+                data = self._view[self._start:self._end].tobytes()
+                size = max(needed, min(2 * len(self._buf), self._bufsize))
+                if size > len(self._buf):
+                    self._set_buffer(bytearray(size))
+                self._buf[:pending] = data
+                self._start = 0
+                self._end = pending
+            n = self._file.readinto(self._view[self._end:])
+            if not n:
+                self._eof = True
+            else:
+                self._end += n
+        return True
+
+    def read_header(self):
+        '''
+        Read the header of the next record.
+
+        :return: a tuple of the payload size and the error code or
+            ``None`` if there is no more data.
+        :rtype: tuple of (int, int) or None
+        :raises ZFSGenericError: if the data ends in the middle of the header.
+        '''
+        if not self._fill(_PIPE_RECORD_SIZE):
+            if self._end > self._start:
+                raise exceptions.ZFSGenericError(
+                    errno.EIO, None, "Truncated list data")
+            return None
+        (size, _, err, _, _) = struct.unpack_from(
+            _PIPE_RECORD_FORMAT, self._buf, self._start)
+        self._start += _PIPE_RECORD_SIZE
+        return (size, err)
+
+    def read_payload(self, size, raw=False):
+        '''
+        Read the payload of the current record.
+
+        :param int size: the payload size reported by the header.
+        :param bool raw: whether to return a view of the payload bytes
+            instead of a pointer.
+        :return: a pointer to the payload in the buffer or a view of it,
+            it is valid until the next record is read.
+        :rtype: CData or memoryview
+        :raises ZFSGenericError: if the data ends before the payload does.
+        '''
+        if not self._fill(size):
+            raise exceptions.ZFSGenericError(
+                errno.EIO, None, "Truncated list data")
+        if raw:
+            payload = self._view[self._start:self._start + size]
+        else:
+            payload = self._cbuf + self._start
+        self._start += size
+        return payload
+
+    def records(self, raw=False):
+        '''
+        Iterate over the records.
+
+        The iteration stops after a record that has an error code set
+        or an empty payload, such a record terminates the listing.
+
+        :param bool raw: passed to :meth:`read_payload`.
+        :return: an iterator that produces tuples of the payload size,
+            the error code and the payload as returned by
+            :meth:`read_payload`.
+        '''
+        while True:
+            header = self.read_header()
+            if header is None:
+                return
+            (size, err) = header
+            if err != 0 or size == 0:
+                yield (size, err, None)
+                return
+            yield (size, err, self.read_payload(size, raw))
+
+
+# The pipelined reader reads the pipe in chunks of up to this size
+# and queues up to this number of the chunks.
+_PUMP_CHUNK_SIZE = 256 * 1024
+_PUMP_QUEUE_SIZE = 64
 
-def _list(name, recurse=None, types=None):
+# Linux specific, fcntl provides the constant only since Python 3.10.
+_F_SETPIPE_SZ = getattr(fcntl, 'F_SETPIPE_SZ', 1031)
+
+
+def _set_pipe_size(fd, size):
+    '''
+    Try to change the capacity of the pipe, the failure is ignored as
+    the default capacity is sufficient for correctness.
+    '''
+    try:
+        fcntl.fcntl(fd, _F_SETPIPE_SZ, size)
+    except (IOError, OSError):
+        pass
+
+
+class _RecordPump(object):
+
+    '''
+    A pipelined source of the :func:`lzc_list` data.
+
+    A background thread drains the pipe, so that the kernel is not blocked
+    while the records are decoded, and puts the raw chunks of the data
+    to a bounded queue.  When the queue is full the thread waits for
+    the consumer.  The thread does nothing but reading, the records are
+    parsed by a :class:`_RecordReader` that reads from the pump.
+
+    The thread owns the read end of the pipe and it closes it when it
+    reaches the end of the data.  After :meth:`stop` the thread discards
+    any remaining data until the write end of the pipe is closed.
+    '''
+
+    def __init__(self, fd, chunk_size=_PUMP_CHUNK_SIZE, queue_size=_PUMP_QUEUE_SIZE):
+        self._fd = fd
+        self._chunk_size = chunk_size
+        self._queue = queue.Queue(queue_size)
+        self._stopped = threading.Event()
+        self._chunk = None
+        self._offset = 0
+        self._thread = threading.Thread(target=self._run, name='lzc_list reader')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _put(self, item):
+        while not self._stopped.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _run(self):
+        try:
+            while True:
+                chunk = os.read(self._fd, self._chunk_size)
+                if not self._put(chunk) or not chunk:
+                    break
+            # Keep draining the pipe if the consumer has gone away.
+            while chunk:
+                chunk = os.read(self._fd, self._chunk_size)
+        except Exception as e:
+            self._put(e)
+        finally:
+            os.close(self._fd)
+
+    def readinto(self, buf):
+        '''
+        Copy the queued data to the buffer.
+
+        :return: the number of the bytes copied, zero at the end of the data.
+        '''
+        if self._chunk is not None and len(self._chunk) == 0:
+            return 0
+        if self._chunk is None or self._offset == len(self._chunk):
+            item = self._queue.get()
+            if isinstance(item, Exception):
+                raise item
+            self._chunk = memoryview(item)
+            self._offset = 0
+        n = min(len(buf), len(self._chunk) - self._offset)
+        buf[:n] = self._chunk[self._offset:self._offset + n]
+        self._offset += n
+        return n
+
+    def stop(self):
+        '''
+        Stop queueing the data.  The write end of the pipe must be
+        closed afterwards, so that the thread can finish.
+        '''
+        self._stopped.set()
+
+
+def _list_options(recurse, types):
+    options = {}
+
+    # Convert types to a dict suitable for mapping to an nvlist.
+    if types is not None:
+        types = {x: None for x in types}
+        options['type'] = types
+    if recurse is None or recurse > 0:
+        options['recurse'] = recurse
+    return options
+
+
+def _decode_entry(payload, fields=None):
+    try:
+        return unpack_nvlist(payload, fields=fields)
+    except exceptions.ZFSGenericError as e:
+        if e.errno != errno.ENOTSUP:
+            raise
+    # Let libnvpair decode what the pure Python decoder does not support.
+    payload = payload.tobytes()
+    return _unpack_entry(_ffi.from_buffer(payload), len(payload), False, fields)
+
+
+def _unpack_entry(payload, size, lazy, fields=None):
+    result = NvlistView() if lazy and fields is None else {}
+    with nvlist_out(result, fields=fields) as nvp:
+        ret = _lib.nvlist_unpack(payload, size, nvp, 0)
+        if ret != 0:
+            raise exceptions.ZFSGenericError(ret, None,
+                                             "Failed to unpack list data")
+    return result
+
+
+def _list(name, recurse=None, types=None, lazy=False, bufsize=_LIST_BUFSIZE,
+          pipelined=False, pipe_size=None, fields=None, pure_python=False):
     '''
     A wrapper for :func:`lzc_list` that hides details of working
     with the file descriptors and provides data in an easy to
@@ -945,18 +1275,34 @@ def _list(name, recurse=None, types=None):
         named by `name`.
     :type types: list of bytes or None
     :type recurse: integer or None
+    :param bool lazy: if ``True``, then the elements are described by
+        views that decode their values only when they are accessed.
+    :param int bufsize: the size of the buffer for reading the listing
+        data, the buffer grows if a single record is larger.
+    :param bool pipelined: if ``True``, then the listing data is read
+        by a background thread, so that the kernel does not have to wait
+        while the records are decoded.
+    :param pipe_size: if not ``None``, then the capacity of the pipe
+        is changed to the given number of bytes where supported.
+    :type pipe_size: int or None
+    :param fields: if not ``None``, then only the given projection
+        of every element is decoded and the other values are skipped
+        without being fetched.  See :mod:`._nvlist` for the format of
+        the projection.  The elements are dictionaries even if ``lazy``
+        is ``True``.
+    :type fields: dict or list or None
+    :param bool pure_python: if ``True``, then the records are decoded
+        from the packed bytes by :mod:`._packed` instead of being unpacked
+        by libnvpair.  The elements are dictionaries even if ``lazy``
+        is ``True``.
     :return: a list of dictionaries each describing a single listed
              element.
-    :rtype: list of dict
+    :rtype: list of dict or list of NvlistView
     '''
-    options = {}
-
-    # Convert types to a dict suitable for mapping to an nvlist.
-    if types is not None:
-        types = {x: None for x in types}
-        options['type'] = types
-    if recurse is None or recurse > 0:
-        options['recurse'] = recurse
+    options = _list_options(recurse, types)
+    if fields is not None:
+        # Convert the projection once rather than for every element.
+        fields = _projection(fields)
 
     # Note that other_fd is used by the kernel side to write
     # the data, so we have to keep that descriptor open until
@@ -967,29 +1313,33 @@ def _list(name, recurse=None, types=None):
     if fd is None:
         return
 
+    if pipe_size is not None:
+        _set_pipe_size(fd, pipe_size)
+    pump = None
     try:
-        while True:
-            record_bytes = os.read(fd, _PIPE_RECORD_SIZE)
-            if not record_bytes:
-                break
-            (size, _, err, _, _) = struct.unpack(
-                _PIPE_RECORD_FORMAT, record_bytes)
+        if pipelined:
+            pump = _RecordPump(fd)
+            records = _RecordReader(pump, bufsize).records(pure_python)
+        else:
+            records = _RecordReader(fd, bufsize).records(pure_python)
+        for (size, err, payload) in records:
             if err == errno.ESRCH:
                 break
             errors.lzc_list_translate_error(err, name, options)
             if size == 0:
                 break
-            data_bytes = os.read(fd, size)
-            result = {}
-            with nvlist_out(result) as nvp:
-                ret = _lib.nvlist_unpack(data_bytes, size, nvp, 0)
-            if ret != 0:
-                raise exceptions.ZFSGenericError(ret, None,
-                                                 "Failed to unpack list data")
-            yield result
+            if pure_python:
+                yield _decode_entry(payload, fields)
+            else:
+                yield _unpack_entry(payload, size, lazy, fields)
     finally:
-        os.close(other_fd)
-        os.close(fd)
+        if pump is not None:
+            # The pump closes fd once it sees the end of the data.
+            pump.stop()
+            os.close(other_fd)
+        else:
+            os.close(other_fd)
+            os.close(fd)
 
 
 @_uncommitted(lzc_list)
@@ -1012,18 +1362,47 @@ def lzc_get_props(name):
         The returned dictionary does not contain entries for properties
         with default values.  One exception is the ``mountpoint`` property
         for which the default value is derived from the dataset name.
+
+    .. note::
+        The results can be cached, see :func:`.enable_props_cache`.
+    '''
+    cache = _cache._props_cache
+    if cache is None:
+        return _get_props(name)
+    (result, generation) = cache.lookup(name)
+    if result is _cache._MISSING:
+        result = _get_props(name)
+        cache.store(name, result, generation)
+    # The cached dictionary must not be changed by the caller.
+    return copy.deepcopy(result)
+
+
+def _get_props(name):
+    return _props_from_entry(name, next(_list(name, recurse=0, lazy=True)))
+
+
+def _props_from_entry(name, result, mountpoints=None):
+    '''
+    Convert a listing entry of the dataset ``name`` to the dictionary
+    returned by :func:`lzc_get_props`.
+
+    ``mountpoints`` maps the names of the already converted filesystems
+    to their final mountpoints.  If the dataset inherits the mountpoint
+    and its parent is in the mapping, then the mountpoint is derived from
+    that of the parent.  The final mountpoint of the dataset is added
+    to the mapping.
     '''
-    result = next(_list(name, recurse=0))
-    is_snapshot = result['dmu_objset_stats']['dds_is_snapshot']
-    result = result['properties']
+    name = _b(name)
+    is_snapshot = result[b'dmu_objset_stats'][b'dds_is_snapshot']
+    result = result[b'properties']
     # In most cases the source of the property is uninteresting and the
     # value alone is sufficient.  One exception is the 'mountpoint'
     # property the final value of which is not the same as the inherited
     # value.
-    mountpoint = result.get('mountpoint')
+    mountpoint = result.get(b'mountpoint')
     if mountpoint is not None:
-        mountpoint_src = mountpoint['source']
-        mountpoint_val = mountpoint['value']
+        mountpoint_src = mountpoint[b'source']
+        mountpoint_val = mountpoint[b'value']
         # 'source' is the name of the dataset that has 'mountpoint' set
         # to a non-default value and from which the current dataset inherits
         # the property.  'source' can be the current dataset if its
@@ -1032,20 +1411,130 @@ def lzc_get_props(name):
         # is equivalent to the property being set on the current dataset.
         # Note that a normal mountpoint value should start with '/'
         # unlike the special values "none" and "legacy".
-        if mountpoint_val.startswith('/') and not mountpoint_src.startswith('$'):
-            mountpoint_val = mountpoint_val + name[len(mountpoint_src):]
+        if mountpoint_val.startswith(b'/') and not mountpoint_src.startswith(b'$'):
+            parent = None
+            if mountpoints is not None and mountpoint_src != name:
+                parent = _parent_name(name)
+            if parent is not None and parent in mountpoints:
+                mountpoint_val = mountpoints[parent] + name[len(parent):]
+            else:
+                mountpoint_val = mountpoint_val + name[len(mountpoint_src):]
     elif not is_snapshot:
-        mountpoint_val = '/' + name
+        mountpoint_val = b'/' + name
     else:
         mountpoint_val = None
-    result = {k: v['value'] for k, v in result.items()}
-    if 'clones' in result:
-        result['clones'] = list(result['clones'].keys())
+    if mountpoints is not None and mountpoint_val is not None and not is_snapshot:
+        mountpoints[name] = mountpoint_val
+    # Only the values are decoded, the embedded nvlists are returned
+    # as dictionaries.
+    values = {}
+    for k, v in result.items():
+        value = v[b'value']
+        if isinstance(value, NvlistView):
+            value = value.to_dict()
+        values[k] = value
+    result = values
+    if b'clones' in result:
+        result[b'clones'] = list(result[b'clones'].keys())
     if mountpoint_val is not None:
-        result['mountpoint'] = mountpoint_val
+        result[b'mountpoint'] = mountpoint_val
     return result
 
 
+def _entry_type(entry):
+    '''
+    Get the type of the dataset described by a listing entry.
+    '''
+    stats = entry[b'dmu_objset_stats']
+    if stats[b'dds_is_snapshot']:
+        return 'snapshot'
+    if stats[b'dds_type'] == _lib.DMU_OST_ZVOL:
+        return 'volume'
+    return 'filesystem'
+
+
+def _parent_name(name):
+    '''
+    Get the name of the filesystem that contains the given dataset,
+    that is, the filesystem of a snapshot or the parent of a filesystem
+    or a volume, or ``None`` for a pool.
+    '''
+    if b'@' in name:
+        return name.split(b'@', 1)[0]
+    if b'/' in name:
+        return name.rsplit(b'/', 1)[0]
+    return None
+
+
+@_uncommitted(lzc_list)
+def lzc_get_props_recursive(root, depth=None, types=('filesystem', 'volume'), fields=None):
+    '''
+    Get properties of the ZFS dataset and of its descendants.
+
+    All properties are obtained from a single listing, which is much
+    cheaper than calling :func:`lzc_get_props` for every dataset
+    when the subtree is large.
+
+    :param bytes root: the name of the filesystem or volume.
+    :param depth: the depth of the descendants to include relative
+        to ``root``, ``0`` means ``root`` only.  If ``None`` the depth
+        is not limited.
+    :type depth: int or None
+    :param types: the types of the datasets to include, any of
+        "filesystem", "volume" and "snapshot".
+    :type types: list of str
+    :param fields: the names of the properties to get, by default all
+        properties are returned.  The values of the other properties
+        are not decoded.
+    :type fields: list of bytes or None
+    :return: a dictionary mapping the names of the datasets to the
+        dictionaries of their properties as returned by
+        :func:`lzc_get_props`.
+    :rtype: dict of bytes:dict
+    :raises DatasetNotFound: if the dataset does not exist.
+    :raises NameInvalid: if the dataset name is invalid.
+    :raises NameTooLong: if the dataset name is too long.
+
+    The filesystems are always listed, because their mountpoints are
+    needed to resolve those of their descendants, but they are included
+    in the result only if ``types`` has "filesystem".
+
+    .. note::
+        If the properties cache is enabled, see :func:`.enable_props_cache`,
+        then it is filled with the results.
+    '''
+    root = _b(root)
+    types = set(types)
+    projection = dict(_PROPS_FIELDS)
+    if fields is None:
+        projection[b'properties'] = None
+        cache = _cache._props_cache
+    else:
+        # The mountpoint is always needed to resolve the descendants.
+        fields = set(_b(f) for f in fields)
+        projection[b'properties'] = list(fields | set([b'mountpoint']))
+        # The cache holds only complete results.
+        cache = None
+    generation = cache.generation() if cache is not None else None
+    # The listing produces a parent before its descendants, so every
+    # inherited mountpoint is derived from the already resolved mountpoint
+    # of the parent in a single pass.
+    mountpoints = {}
+    results = {}
+    list_types = sorted(types | set(['filesystem']))
+    for entry in _list(root, recurse=depth, types=list_types, fields=projection):
+        name = entry[b'name']
+        props = _props_from_entry(name, entry, mountpoints)
+        if 'filesystem' not in types and _entry_type(entry) == 'filesystem':
+            continue
+        if fields is not None and b'mountpoint' not in fields:
+            props.pop(b'mountpoint', None)
+        if cache is not None:
+            cache.store(name, copy.deepcopy(props), generation)
+        results[name] = props
+    return results
+
+
 @_uncommitted(lzc_list)
 def lzc_list_children(name):
     '''
@@ -1064,12 +1553,7 @@ def lzc_list_children(name):
 
         An attempt to list children of a snapshot is silently ignored as well.
     '''
-    children = []
-    for entry in _list(name, recurse=1, types=['filesystem', 'volume']):
-        child = entry['name']
-        if child != name:
-            children.append(child)
-
+    children = list(_list_names(name, ['filesystem', 'volume']))
     return iter(children)
 
 
@@ -1091,15 +1575,92 @@ def lzc_list_snaps(name):
 
         An attempt to list snapshots of a snapshot is silently ignored as well.
     '''
-    snaps = []
-    for entry in _list(name, recurse=1, types=['snapshot']):
-        snap = entry['name']
-        if snap != name:
-            snaps.append(snap)
-
+    snaps = list(_list_names(name, ['snapshot']))
     return iter(snaps)
 
 
+def _list_names(name, types):
+    entries = _list(name, recurse=1, types=types, fields=_NAME_FIELDS)
+    try:
+        for entry in entries:
+            entry_name = entry[b'name']
+            if entry_name != name:
+                yield entry_name
+    finally:
+        # Close the listing pipe as soon as the names are no longer needed.
+        entries.close()
+
+
+@_uncommitted(lzc_list)
+def lzc_iter_children(name):
+    '''
+    Iterate over the children of the ZFS dataset.
+
+    Unlike :func:`lzc_list_children` this function produces the names
+    while the listing is still in progress, so the first name is available
+    immediately and the names are not accumulated in memory.
+
+    :param bytes name: the name of the dataset.
+    :return: a generator that produces the names of the children.
+    :raises NameInvalid: if the dataset name is invalid.
+    :raises NameTooLong: if the dataset name is too long.
+    :raises DatasetNotFound: if the dataset does not exist.
+
+    The exceptions are raised by the generator when it is iterated.
+
+    The listing resources are released when the generator is exhausted,
+    closed or garbage collected.  Use :func:`contextlib.closing` to release
+    them promptly if the iteration may stop early::
+
+        with contextlib.closing(lzc_iter_children(name)) as children:
+            for child in children:
+                if done(child):
+                    break
+
+    .. warning::
+        If the dataset does not exist, then the generator may produce
+        no results and no error is reported.
+        That case is indistinguishable from the dataset having no children.
+
+        An attempt to list children of a snapshot is silently ignored as well.
+    '''
+    return _list_names(name, ['filesystem', 'volume'])
+
+
+@_uncommitted(lzc_list)
+def lzc_iter_snaps(name):
+    '''
+    Iterate over the snapshots of the ZFS dataset.
+
+    Unlike :func:`lzc_list_snaps` this function produces the names
+    while the listing is still in progress, so the first name is available
+    immediately and the names are not accumulated in memory.
+
+    :param bytes name: the name of the dataset.
+    :return: a generator that produces the names of the snapshots.
+    :raises NameInvalid: if the dataset name is invalid.
+    :raises NameTooLong: if the dataset name is too long.
+    :raises DatasetNotFound: if the dataset does not exist.
+
+    The exceptions are raised by the generator when it is iterated.
+
+    The listing resources are released when the generator is exhausted,
+    closed or garbage collected.  Use :func:`contextlib.closing` to release
+    them promptly if the iteration may stop early::
+
+        with contextlib.closing(lzc_iter_snaps(name)) as snaps:
+            first = list(itertools.islice(snaps, 10))
+
+    .. warning::
+        If the dataset does not exist, then the generator may produce
+        no results and no error is reported.
+        That case is indistinguishable from the dataset having no snapshots.
+
+        An attempt to list snapshots of a snapshot is silently ignored as well.
+    '''
+    return _list_names(name, ['snapshot'])
+
+
 # TODO: a better way to init and uninit the library
 def _initialize():
     class LazyInit(object):
@@ -1117,7 +1678,10 @@ def _initialize():
                         if ret != 0:
                             raise exceptions.ZFSInitializationFailed(ret)
                         self._inited = True
-            return getattr(self._lib, name)
+            attr = getattr(self._lib, name)
+            # Subsequent lookups of the same name do not reach __getattr__.
+            setattr(self, name, attr)
+            return attr
 
     return LazyInit(libzfs_core.lib)
 
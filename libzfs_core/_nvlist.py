@@ -29,43 +29,174 @@ Format:
 - a value can be a list of bools, byte strings, integers or CData objects of types specified above
 - a value can be a list of dictionaries that adhere to this format
 - all elements of a list value must be of the same type
+- a value can be an array.array of integers, a bytearray or a memoryview
+  of integers; such a value is stored as an array of the matching C type
+  without converting the elements one by one, a bytearray and a byte
+  memoryview are stored as DATA_TYPE_BYTE_ARRAY; a memoryview format
+  may name an explicit byte order only if it is the native one
+
+nvlist_out can optionally produce compact arrays: an array of integers
+is decoded to an array.array with elements of the matching C type and
+a DATA_TYPE_BYTE_ARRAY is decoded to a byte string.  The elements are
+copied in one go rather than converted one by one.  Arrays of other
+types are always decoded to lists.
+
+nvlist_out can also be given an NvlistView instead of a dictionary.
+The view takes over the nvlist_t and decodes its pairs only when they
+are accessed, which is cheaper when only a few values are of interest.
+
+nvlist_out can also decode only a projection of the nvlist, the pairs
+that are not in the projection are skipped without fetching their values.
+A projection is a dictionary that maps the names of the wanted pairs to
+None, to select the whole value, or to a nested projection, to select only
+some pairs of an embedded nvlist or of the nvlists in an nvlist array.
+A list of names can be used instead of a dictionary where all values are
+None.
+
+nvlist_in_scope is a context manager variant of nvlist_in.  The nvlist_t
+is freed on exit from the with-block rather than when the CData object
+is collected, and it is taken from and returned to a small per-thread pool
+of nvlist_t objects.  nvlist_out takes its pointers from a similar pool.
+
+nvlist_in can be given an NvlistSchema that declares the C types of
+the pairs, otherwise the types are inferred from the values.
+
+nvlist_in_cached is nvlist_in for the dictionaries that are converted
+over and over again.  The nvlists built for the recently used dictionaries
+are kept as templates and the requested nvlist is duplicated from
+a template.
+
+nvlist_to_bytes and nvlist_from_bytes convert between an nvlist_t and
+its packed form, a byte string that can be stored or sent to another
+process and then unpacked without building the dictionary in between.
+
+When the bindings are loaded in the API mode nvlist_out uses a converter
+that walks the whole nvlist in a single native call.  _nvlist_to_dict is
+the reference implementation of the conversion and it is used otherwise.
 """
 from __future__ import unicode_literals
 
+import array
+import collections
+import errno
 import numbers
+import sys
+import threading
 from collections import namedtuple
 from contextlib import contextmanager
 
+from builtins import object
 from builtins import range
 from builtins import str
 
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+from . import exceptions
+from ._packed import _array_from_bytes
 from .bindings import libnvpair
 from .ctypes import _type_to_suffix
 
 _ffi = libnvpair.ffi
 _lib = libnvpair.lib
 
+# The encodings of the packed nvlists.
+NV_ENCODE_NATIVE = 0
+NV_ENCODE_XDR = 1
+
+# The maximum number of the nvlist templates kept by nvlist_in_cached.
+_TEMPLATES_MAXSIZE = 128
+
+# The number of the nvlist_t objects and of the pointers kept per thread
+# for reuse and the maximum number of the pairs that are removed from
+# an nvlist_t to reuse it, a larger one is freed.
+_POOL_SIZE = 8
+_POOL_MAX_PAIRS = 32
 
-def nvlist_in(props):
+
+def nvlist_in(props, schema=None):
     """
     This function converts a python dictionary to a C nvlist_t
     and provides automatic memory management for the latter.
 
     :param dict props: the dictionary to be converted.
+    :param schema: the types of the pairs, by default the types are
+        inferred from the values.
+    :type schema: NvlistSchema or None
+    :return: an FFI CData object representing the nvlist_t pointer.
+    :rtype: CData
+    """
+    nvlist = _nvlist_alloc()
+    _dict_to_nvlist(props, nvlist, schema)
+    return nvlist
+
+
+@contextmanager
+def nvlist_in_scope(props, schema=None, cached=False):
+    """
+    A context manager that converts a python dictionary to a C nvlist_t
+    like :func:`nvlist_in` and yields a CData object representing
+    the nvlist_t pointer via 'as' target.
+    The nvlist_t is freed upon leaving the 'with' block, so the pointer
+    must not be used after that.
+
+    :param dict props: the dictionary to be converted.
+    :param schema: the types of the pairs, see :func:`nvlist_in`.
+    :type schema: NvlistSchema or None
+    :param bool cached: whether the nvlist_t should be duplicated from
+        a template like :func:`nvlist_in_cached` does.
+    :return: an FFI CData object representing the nvlist_t pointer.
+    :rtype: CData
+    """
+    pool = _pool
+    template = _get_template(props, schema) if cached else None
+    if template is not None:
+        nvlistp = pool.get_nvlistp()
+        try:
+            if _lib.nvlist_dup(template, nvlistp, 0) != 0:
+                raise MemoryError('nvlist_dup failed')
+            yield nvlistp[0]
+        finally:
+            if nvlistp[0] != _ffi.NULL:
+                _lib.nvlist_free(nvlistp[0])
+            pool.put_nvlistp(nvlistp)
+        return
+    nvlist = pool.get_nvlist()
+    try:
+        _dict_to_nvlist(props, nvlist, schema)
+        yield nvlist
+    finally:
+        pool.put_nvlist(nvlist)
+
+
+def nvlist_in_cached(props, schema=None):
+    """
+    Like :func:`nvlist_in`, but the nvlist is duplicated from a template
+    built for an equal dictionary earlier, if there is one.
+
+    The dictionaries with values of the buffer types are not cached,
+    they are always converted with :func:`nvlist_in`.
+
+    :param dict props: the dictionary to be converted.
+    :param schema: the types of the pairs, see :func:`nvlist_in`.
+    :type schema: NvlistSchema or None
     :return: an FFI CData object representing the nvlist_t pointer.
     :rtype: CData
     """
+    template = _get_template(props, schema)
+    if template is None:
+        return nvlist_in(props, schema)
     nvlistp = _ffi.new("nvlist_t **")
-    res = _lib.nvlist_alloc(nvlistp, 1, 0)  # UNIQUE_NAME == 1
+    res = _lib.nvlist_dup(template, nvlistp, 0)
     if res != 0:
-        raise MemoryError('nvlist_alloc failed')
-    nvlist = _ffi.gc(nvlistp[0], _lib.nvlist_free)
-    _dict_to_nvlist(props, nvlist)
-    return nvlist
+        raise MemoryError('nvlist_dup failed')
+    return _ffi.gc(nvlistp[0], _lib.nvlist_free)
 
 
 @contextmanager
-def nvlist_out(props):
+def nvlist_out(props, compact_arrays=False, fields=None):
     """
     A context manager that allocates a pointer to a C nvlist_t and yields
     a CData object representing a pointer to the pointer via 'as' target.
@@ -75,66 +206,640 @@ def nvlist_out(props):
     and also populates the 'props' dictionary with data from the nvlist_t
     upon leaving the 'with' block.
 
-    :param dict props: the dictionary to be populated with data from the nvlist.
+    :param props: the dictionary to be populated with data from the nvlist
+        or a view that takes over the nvlist.
+    :type props: dict or NvlistView
+    :param bool compact_arrays: whether arrays of integers should be decoded
+        to ``array.array`` objects and byte arrays to byte strings
+        instead of lists.
+    :param fields: the projection of the nvlist to decode, by default
+        the whole nvlist is decoded.  A view can not be given a projection.
+    :type fields: dict or list or None
     :return: an FFI CData object representing the pointer to nvlist_t pointer.
     :rtype: CData
     """
-    nvlistp = _ffi.new("nvlist_t **")
-    nvlistp[0] = _ffi.NULL  # to be sure
+    if fields is not None:
+        if isinstance(props, NvlistView):
+            raise TypeError('A projection can not be decoded to a view')
+        fields = _projection(fields)
+    nvlistp = _pool.get_nvlistp()
     try:
         yield nvlistp
-        # clear old entries, if any
-        props.clear()
-        _nvlist_to_dict(nvlistp[0], props)
+        if isinstance(props, NvlistView):
+            props._adopt(nvlistp[0], compact_arrays)
+            nvlistp[0] = _ffi.NULL
+        else:
+            # clear old entries, if any
+            props.clear()
+            if fields is not None:
+                _nvlist_to_dict(nvlistp[0], props, compact_arrays, fields)
+            else:
+                _nvlist_out_to_dict(nvlistp[0], props, compact_arrays)
     finally:
         if nvlistp[0] != _ffi.NULL:
             _lib.nvlist_free(nvlistp[0])
-            nvlistp[0] = _ffi.NULL
+        _pool.put_nvlistp(nvlistp)
+
+
+def nvlist_to_bytes(props, encoding=NV_ENCODE_NATIVE):
+    """
+    Pack an nvlist into a byte string.
+
+    :param props: the nvlist or a dictionary to be converted to an nvlist
+        first.
+    :type props: CData or dict
+    :param int encoding: the encoding of the packed nvlist,
+        ``NV_ENCODE_NATIVE`` or ``NV_ENCODE_XDR``.
+    :return: the packed nvlist.
+    :rtype: bytes
+    :raises ZFSGenericError: if the nvlist can not be packed.
+    """
+    if isinstance(props, _ffi.CData):
+        nvlist = props
+    else:
+        nvlist = nvlist_in(props)
+    sizep = _ffi.new("size_t *")
+    ret = _lib.nvlist_size(nvlist, sizep, encoding)
+    if ret != 0:
+        raise exceptions.ZFSGenericError(ret, None, "Failed to size nvlist")
+    # nvlist_pack() uses the provided buffer rather than allocating one.
+    buf = _ffi.new("char[]", sizep[0])
+    bufp = _ffi.new("char **", buf)
+    ret = _lib.nvlist_pack(nvlist, bufp, sizep, encoding, 0)
+    if ret == errno.ENOMEM:
+        raise MemoryError('nvlist_pack failed')
+    if ret != 0:
+        raise exceptions.ZFSGenericError(ret, None, "Failed to pack nvlist")
+    return _ffi.buffer(buf, sizep[0])[:]
+
+
+def nvlist_from_bytes(data):
+    """
+    Unpack a packed nvlist into a C nvlist_t and provide automatic memory
+    management for the latter, like :func:`nvlist_in` does.
+
+    The nvlist can be passed as an input parameter or converted to
+    a dictionary, see :func:`nvlist_out`.
+
+    :param data: the packed nvlist in any encoding.
+    :type data: bytes or bytearray or memoryview
+    :return: an FFI CData object representing the nvlist_t pointer.
+    :rtype: CData
+    :raises ZFSGenericError: if the data is not a valid packed nvlist.
+    """
+    nvlistp = _ffi.new("nvlist_t **")
+    ret = _lib.nvlist_unpack(_ffi.from_buffer(data), len(data), nvlistp, 0)
+    if ret == errno.ENOMEM:
+        raise MemoryError('nvlist_unpack failed')
+    if ret != 0:
+        raise exceptions.ZFSGenericError(ret, None, "Failed to unpack nvlist")
+    return _ffi.gc(nvlistp[0], _lib.nvlist_free)
+
+
+def _template_key(value):
+    '''
+    Build a hashable key for a value of a dictionary to be converted
+    to an nvlist.  The keys of two values are equal if and only if
+    the values are converted to equal nvlists.
+
+    :return: the key or ``None`` if the value can not be cached.
+    '''
+    if isinstance(value, dict):
+        items = []
+        names = set()
+        for (k, v) in value.items():
+            if isinstance(k, str):
+                k = k.encode()
+            elif not isinstance(k, bytes):
+                return None
+            v = _template_key(v)
+            if v is None:
+                return None
+            names.add(k)
+            items.append((k, v))
+        if len(names) != len(items):
+            # The pairs with equal names replace each other in order.
+            return None
+        return ('d', frozenset(items))
+    if isinstance(value, list):
+        elems = tuple(_template_key(x) for x in value)
+        if None in elems:
+            return None
+        return ('l', elems)
+    if value is None:
+        return ('n',)
+    if isinstance(value, bool):
+        return ('b', value)
+    if isinstance(value, numbers.Integral):
+        return ('i', int(value))
+    if isinstance(value, bytes):
+        return ('s', value)
+    if isinstance(value, str):
+        return ('s', value.encode())
+    if isinstance(value, _ffi.CData) and _ffi.typeof(value) in _type_to_suffix:
+        return ('c', _ffi.typeof(value).cname, int(value))
+    # The buffers can be modified after they are converted.
+    return None
+
+
+class _TemplateCache(object):
+
+    '''
+    A bounded mapping of the template keys to the template nvlists,
+    the least recently used template is evicted when the cache is full.
+    '''
+
+    def __init__(self, maxsize):
+        self._maxsize = maxsize
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            template = self._entries.pop(key, None)
+            if template is None:
+                self.misses += 1
+                return None
+            self._entries[key] = template
+            self.hits += 1
+            return template
+
+    def put(self, key, template):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = template
+            while len(self._entries) > self._maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_templates = _TemplateCache(_TEMPLATES_MAXSIZE)
+
+
+def _get_template(props, schema):
+    '''
+    :return: the template nvlist for the dictionary or ``None`` if
+        the dictionary can not be cached.
+    '''
+    key = _template_key(props)
+    if key is None:
+        return None
+    key = (schema, key)
+    template = _templates.get(key)
+    if template is None:
+        template = nvlist_in(props, schema)
+        _templates.put(key, template)
+    return template
+
+
+def _nvlist_alloc():
+    nvlistp = _ffi.new("nvlist_t **")
+    res = _lib.nvlist_alloc(nvlistp, 1, 0)  # UNIQUE_NAME == 1
+    if res != 0:
+        raise MemoryError('nvlist_alloc failed')
+    return _ffi.gc(nvlistp[0], _lib.nvlist_free)
+
+
+def _nvlist_clear(nvlist):
+    '''
+    Remove the pairs of the nvlist, but at most ``_POOL_MAX_PAIRS``.
+
+    :return: ``True`` if the nvlist is empty.
+    '''
+    for _ in range(_POOL_MAX_PAIRS + 1):
+        pair = _lib.nvlist_next_nvpair(nvlist, _ffi.NULL)
+        if pair == _ffi.NULL:
+            return True
+        if _lib.nvlist_remove_nvpair(nvlist, pair) != 0:
+            return False
+    return False
+
+
+class _AllocationPool(threading.local):
+
+    """
+    Per-thread reusable allocations: the empty nvlist_t objects and
+    the nvlist_t pointers used as output parameters.
+
+    The pooled nvlist_t objects are still registered with the garbage
+    collector, so they are freed when the thread exits.
+    """
+
+    def __init__(self):
+        self.nvlists = []
+        self.nvlistps = []
+
+    def get_nvlist(self):
+        if self.nvlists:
+            return self.nvlists.pop()
+        return _nvlist_alloc()
+
+    def put_nvlist(self, nvlist):
+        if len(self.nvlists) < _POOL_SIZE and _nvlist_clear(nvlist):
+            self.nvlists.append(nvlist)
+        else:
+            _ffi.release(nvlist)
+
+    def get_nvlistp(self):
+        if self.nvlistps:
+            return self.nvlistps.pop()
+        nvlistp = _ffi.new("nvlist_t **")
+        nvlistp[0] = _ffi.NULL  # to be sure
+        return nvlistp
+
+    def put_nvlistp(self, nvlistp):
+        nvlistp[0] = _ffi.NULL
+        if len(self.nvlistps) < _POOL_SIZE:
+            self.nvlistps.append(nvlistp)
+
+
+_pool = _AllocationPool()
+
+
+class NvlistView(Mapping):
+
+    """
+    A read-only mapping backed by a C nvlist_t.
+
+    A value is decoded when it is accessed for the first time and then
+    it is cached.  Embedded nvlists are represented by child views that
+    share the nvlist_t memory with the parent view.  The keys can be
+    looked up as byte strings or as strings, iteration produces byte
+    strings.
+
+    A view is initially empty, it gets populated when it is passed
+    to :func:`nvlist_out`.
+    """
+
+    def __init__(self):
+        self._nvlist = None
+        self._owner = None
+        self._compact_arrays = False
+        self._cache = {}
+        self._len = None
+
+    @classmethod
+    def _child(cls, owner, nvlist):
+        view = cls()
+        view._nvlist = nvlist
+        # The gc'd root nvlist keeps the memory of the embedded nvlist
+        # alive, even after the root view adopts another nvlist.
+        view._owner = owner._owner if owner._owner is not None else owner._nvlist
+        view._compact_arrays = owner._compact_arrays
+        return view
+
+    def _adopt(self, nvlist, compact_arrays):
+        self._cache.clear()
+        self._len = None
+        self._owner = None
+        self._compact_arrays = compact_arrays
+        if nvlist == _ffi.NULL:
+            self._nvlist = None
+        else:
+            self._nvlist = _ffi.gc(nvlist, _lib.nvlist_free)
+
+    def _nested(self, nvlist):
+        return NvlistView._child(self, nvlist)
+
+    def _lookup(self, key):
+        if self._nvlist is None:
+            return _ffi.NULL
+        pairp = _ffi.new("nvpair_t **")
+        if _lib.nvlist_lookup_nvpair(self._nvlist, key, pairp) != 0:
+            return _ffi.NULL
+        return pairp[0]
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            key = key.encode()
+        try:
+            return self._cache[key]
+        except KeyError:
+            pass
+        if not isinstance(key, bytes):
+            raise KeyError(key)
+        pair = self._lookup(key)
+        if pair == _ffi.NULL:
+            raise KeyError(key)
+        val = _nvpair_value(pair, self._nested, self._compact_arrays)
+        self._cache[key] = val
+        return val
+
+    def __contains__(self, key):
+        if isinstance(key, str):
+            key = key.encode()
+        if key in self._cache:
+            return True
+        if not isinstance(key, bytes):
+            return False
+        return self._lookup(key) != _ffi.NULL
+
+    def __iter__(self):
+        if self._nvlist is None:
+            return
+        pair = _lib.nvlist_next_nvpair(self._nvlist, _ffi.NULL)
+        while pair != _ffi.NULL:
+            yield _ffi.string(_lib.nvpair_name(pair))
+            pair = _lib.nvlist_next_nvpair(self._nvlist, pair)
+
+    def __len__(self):
+        if self._len is None:
+            self._len = sum(1 for _ in self)
+        return self._len
+
+    def __repr__(self):
+        return 'NvlistView(%r)' % (self.to_dict(),)
+
+    def to_dict(self):
+        '''
+        Decode the whole nvlist.
+
+        :return: a dictionary with the same contents as the view,
+            the embedded nvlists are decoded to dictionaries as well.
+        :rtype: dict
+        '''
+        if self._nvlist is None:
+            return {}
+        return _nvlist_out_to_dict(self._nvlist, {}, self._compact_arrays)
 
 
 _TypeInfo = namedtuple('_TypeInfo', ['suffix', 'ctype', 'is_array', 'convert'])
 
 
-def _type_info(typeid):
-    return {
-        _lib.DATA_TYPE_BOOLEAN:         _TypeInfo(None, None, None, None),
-        _lib.DATA_TYPE_BOOLEAN_VALUE:   _TypeInfo("boolean_value", "boolean_t *", False, bool),
-        _lib.DATA_TYPE_BYTE:            _TypeInfo("byte", "uchar_t *", False, int),
-        _lib.DATA_TYPE_INT8:            _TypeInfo("int8", "int8_t *", False, int),
-        _lib.DATA_TYPE_UINT8:           _TypeInfo("uint8", "uint8_t *", False, int),
-        _lib.DATA_TYPE_INT16:           _TypeInfo("int16", "int16_t *", False, int),
-        _lib.DATA_TYPE_UINT16:          _TypeInfo("uint16", "uint16_t *", False, int),
-        _lib.DATA_TYPE_INT32:           _TypeInfo("int32", "int32_t *", False, int),
-        _lib.DATA_TYPE_UINT32:          _TypeInfo("uint32", "uint32_t *", False, int),
-        _lib.DATA_TYPE_INT64:           _TypeInfo("int64", "int64_t *", False, int),
-        _lib.DATA_TYPE_UINT64:          _TypeInfo("uint64", "uint64_t *", False, int),
-        _lib.DATA_TYPE_STRING:          _TypeInfo("string", "char **", False, _ffi.string),
-        _lib.DATA_TYPE_NVLIST:          _TypeInfo("nvlist", "nvlist_t **", False, lambda x: _nvlist_to_dict(x, {})),
-        _lib.DATA_TYPE_BOOLEAN_ARRAY:   _TypeInfo("boolean_array", "boolean_t **", True, bool),
-        # XXX use bytearray ?
-        _lib.DATA_TYPE_BYTE_ARRAY:      _TypeInfo("byte_array", "uchar_t **", True, int),
-        _lib.DATA_TYPE_INT8_ARRAY:      _TypeInfo("int8_array", "int8_t **", True, int),
-        _lib.DATA_TYPE_UINT8_ARRAY:     _TypeInfo("uint8_array", "uint8_t **", True, int),
-        _lib.DATA_TYPE_INT16_ARRAY:     _TypeInfo("int16_array", "int16_t **", True, int),
-        _lib.DATA_TYPE_UINT16_ARRAY:    _TypeInfo("uint16_array", "uint16_t **", True, int),
-        _lib.DATA_TYPE_INT32_ARRAY:     _TypeInfo("int32_array", "int32_t **", True, int),
-        _lib.DATA_TYPE_UINT32_ARRAY:    _TypeInfo("uint32_array", "uint32_t **", True, int),
-        _lib.DATA_TYPE_INT64_ARRAY:     _TypeInfo("int64_array", "int64_t **", True, int),
-        _lib.DATA_TYPE_UINT64_ARRAY:    _TypeInfo("uint64_array", "uint64_t **", True, int),
-        _lib.DATA_TYPE_STRING_ARRAY:    _TypeInfo("string_array", "char ***", True, _ffi.string),
-        _lib.DATA_TYPE_NVLIST_ARRAY:    _TypeInfo("nvlist_array", "nvlist_t ***", True, lambda x: _nvlist_to_dict(x, {})),
-    }[typeid]
-
-# only integer properties need to be here
-_prop_name_to_type_str = {
-    "rewind-request":   "uint32",
-    "type":             "uint32",
-    "N_MORE_ERRORS":    "int32",
-    "pool_context":     "int32",
+# The keys are names of data_type_t values, they are resolved together
+# with the C functions by _get_type_table() once the library is loaded.
+# The embedded nvlists do not have a converter, they are decoded recursively.
+_TYPE_INFO = {
+    "DATA_TYPE_BOOLEAN":        _TypeInfo(None, None, None, None),
+    "DATA_TYPE_BOOLEAN_VALUE":  _TypeInfo("boolean_value", "boolean_t *", False, bool),
+    "DATA_TYPE_BYTE":           _TypeInfo("byte", "uchar_t *", False, int),
+    "DATA_TYPE_INT8":           _TypeInfo("int8", "int8_t *", False, int),
+    "DATA_TYPE_UINT8":          _TypeInfo("uint8", "uint8_t *", False, int),
+    "DATA_TYPE_INT16":          _TypeInfo("int16", "int16_t *", False, int),
+    "DATA_TYPE_UINT16":         _TypeInfo("uint16", "uint16_t *", False, int),
+    "DATA_TYPE_INT32":          _TypeInfo("int32", "int32_t *", False, int),
+    "DATA_TYPE_UINT32":         _TypeInfo("uint32", "uint32_t *", False, int),
+    "DATA_TYPE_INT64":          _TypeInfo("int64", "int64_t *", False, int),
+    "DATA_TYPE_UINT64":         _TypeInfo("uint64", "uint64_t *", False, int),
+    "DATA_TYPE_STRING":         _TypeInfo("string", "char **", False, _ffi.string),
+    "DATA_TYPE_NVLIST":         _TypeInfo("nvlist", "nvlist_t **", False, None),
+    "DATA_TYPE_BOOLEAN_ARRAY":  _TypeInfo("boolean_array", "boolean_t **", True, bool),
+    "DATA_TYPE_BYTE_ARRAY":     _TypeInfo("byte_array", "uchar_t **", True, int),
+    "DATA_TYPE_INT8_ARRAY":     _TypeInfo("int8_array", "int8_t **", True, int),
+    "DATA_TYPE_UINT8_ARRAY":    _TypeInfo("uint8_array", "uint8_t **", True, int),
+    "DATA_TYPE_INT16_ARRAY":    _TypeInfo("int16_array", "int16_t **", True, int),
+    "DATA_TYPE_UINT16_ARRAY":   _TypeInfo("uint16_array", "uint16_t **", True, int),
+    "DATA_TYPE_INT32_ARRAY":    _TypeInfo("int32_array", "int32_t **", True, int),
+    "DATA_TYPE_UINT32_ARRAY":   _TypeInfo("uint32_array", "uint32_t **", True, int),
+    "DATA_TYPE_INT64_ARRAY":    _TypeInfo("int64_array", "int64_t **", True, int),
+    "DATA_TYPE_UINT64_ARRAY":   _TypeInfo("uint64_array", "uint64_t **", True, int),
+    "DATA_TYPE_STRING_ARRAY":   _TypeInfo("string_array", "char ***", True, _ffi.string),
+    "DATA_TYPE_NVLIST_ARRAY":   _TypeInfo("nvlist_array", "nvlist_t ***", True, None),
 }
 
+# Element types of the arrays that can be decoded in the compact form.
+_COMPACT_ARRAYS = {
+    "DATA_TYPE_BYTE_ARRAY":     "uchar_t",
+    "DATA_TYPE_INT8_ARRAY":     "int8_t",
+    "DATA_TYPE_UINT8_ARRAY":    "uint8_t",
+    "DATA_TYPE_INT16_ARRAY":    "int16_t",
+    "DATA_TYPE_UINT16_ARRAY":   "uint16_t",
+    "DATA_TYPE_INT32_ARRAY":    "int32_t",
+    "DATA_TYPE_UINT32_ARRAY":   "uint32_t",
+    "DATA_TYPE_INT64_ARRAY":    "int64_t",
+    "DATA_TYPE_UINT64_ARRAY":   "uint64_t",
+}
+
+# An entry of the decoding table.  'getter' is the nvpair_value_* C function
+# and 'ctype' is the type of its output parameter, both are None for
+# DATA_TYPE_BOOLEAN that does not have a value.  'compact' is a _CompactArray
+# for the arrays that can be decoded in the compact form.
+_Decoder = namedtuple('_Decoder', ['getter', 'ctype', 'is_array', 'convert', 'compact'])
+
+# 'typecode' is None for DATA_TYPE_BYTE_ARRAY that is decoded to a byte string.
+_CompactArray = namedtuple('_CompactArray', ['itemsize', 'typecode'])
+
+# data_type_t value -> _Decoder
+_decode_table = None
+# suffix -> nvlist_add_<suffix> C function
+_scalar_adders = None
+# suffix -> nvlist_add_<suffix>_array C function
+_array_adders = None
+
+
+def _get_type_table():
+    global _decode_table, _scalar_adders, _array_adders
+    if _decode_table is None:
+        scalar_adders = {}
+        array_adders = {}
+        for suffix, array_suffix in _type_to_suffix.values():
+            scalar_adders[suffix] = getattr(_lib, "nvlist_add_%s" % (suffix,))
+            array_adders[array_suffix] = getattr(_lib, "nvlist_add_%s_array" % (array_suffix,))
+        decode_table = {}
+        for name, info in _TYPE_INFO.items():
+            typeid = getattr(_lib, name)
+            if info.suffix is None:
+                decode_table[typeid] = _Decoder(None, None, False, None, None)
+            else:
+                decode_table[typeid] = _Decoder(
+                    getattr(_lib, "nvpair_value_%s" % (info.suffix,)),
+                    _ffi.typeof(info.ctype), info.is_array, info.convert,
+                    _compact_array_info(name))
+        _scalar_adders = scalar_adders
+        _array_adders = array_adders
+        _decode_table = decode_table
+    return _decode_table
+
+
+def _array_typecode(itemsize, signed):
+    for typecode in ("bhilq" if signed else "BHILQ"):
+        try:
+            if array.array(typecode).itemsize == itemsize:
+                return typecode
+        except ValueError:
+            # 'q' and 'Q' are not available on Python 2
+            pass
+    return None
+
+
+def _compact_array_info(type_name):
+    ctype = _COMPACT_ARRAYS.get(type_name)
+    if ctype is None:
+        return None
+    itemsize = _ffi.sizeof(ctype)
+    if type_name == "DATA_TYPE_BYTE_ARRAY":
+        return _CompactArray(itemsize, None)
+    typecode = _array_typecode(itemsize, not ctype.startswith("u"))
+    if typecode is None:
+        return None
+    return _CompactArray(itemsize, typecode)
+
+
+def _compact_array(compact, ptr, length):
+    if length == 0:
+        data = b""
+    else:
+        data = _ffi.buffer(ptr, length * compact.itemsize)
+    if compact.typecode is None:
+        return data[:]
+    return _array_from_bytes(compact.typecode, data)
+
+
+class _OutPointers(threading.local):
+
+    """
+    Per-thread output parameters for the nvpair_value_* functions.
+
+    A value is always copied out of an output parameter before
+    the parameter is passed to another C function, so the parameters
+    can be reused by the nested calls for the embedded nvlists.
+    """
 
-def _nvlist_add_array(nvlist, key, array):
+    def __init__(self):
+        self.lenptr = _ffi.new("uint_t *")
+        self.valptrs = {}
+        for decoder in _get_type_table().values():
+            if decoder.ctype is not None and decoder.ctype not in self.valptrs:
+                self.valptrs[decoder.ctype] = _ffi.new(decoder.ctype)
+
+
+_out_pointers = None
+
+
+def _get_out_pointers():
+    global _out_pointers
+    if _out_pointers is None:
+        _out_pointers = _OutPointers()
+    return _out_pointers
+
+
+class NvlistSchema(object):
+
+    """
+    The types of the pairs of the nvlists passed to an operation.
+
+    A schema is compiled into an encoder plan on the first use.  The plan
+    maps every name to a function that adds the pair with the C function
+    resolved at compile time, so the value does not have to be inspected.
+    If the C function does not accept the value, the type is inferred
+    from the value as if the name was not in the schema.
+
+    :param types: maps the names of the pairs to their types.  A type is
+        the name of a scalar nvlist_t type, e.g. ``"uint64"``, ``"int32"``,
+        ``"string"`` or ``"boolean_value"``, ``"boolean"`` for a pair
+        without a value, the name of an integer array type, e.g.
+        ``"uint64_array"``, an :class:`NvlistSchema` for an embedded
+        nvlist or an nvlist array, or ``None`` to infer the type from
+        the value.
+    :type types: dict of bytes:Any
+    :param default: the type of the pairs that are not in ``types``.
+    """
+
+    def __init__(self, types=None, default=None):
+        self._types = {}
+        for (name, typ) in (types or {}).items():
+            if isinstance(name, str):
+                name = name.encode()
+            _check_type(typ)
+            self._types[name] = typ
+        _check_type(default)
+        self._default = default
+        self._plan = None
+
+    def _get_plan(self):
+        plan = self._plan
+        if plan is None:
+            _get_type_table()
+            encoders = dict((name, _compile_encoder(typ)) for (name, typ) in self._types.items())
+            plan = _EncoderPlan(encoders, _compile_encoder(self._default))
+            self._plan = plan
+        return plan
+
+
+_EncoderPlan = namedtuple('_EncoderPlan', ['encoders', 'default'])
+
+_SCALAR_TYPES = frozenset(
+    ["boolean", "string"] + [suffix for (suffix, _) in _type_to_suffix.values()])
+_ARRAY_TYPES = frozenset(
+    "%s_array" % (suffix,) for (_, suffix) in _type_to_suffix.values())
+
+
+def _check_type(typ):
+    if typ is None or isinstance(typ, NvlistSchema):
+        return
+    if typ not in _SCALAR_TYPES and typ not in _ARRAY_TYPES:
+        raise ValueError('Unsupported schema type %r' % (typ,))
+
+
+def _compile_encoder(typ):
+    '''
+    :return: a function that adds a pair of the given type to an nvlist
+        and returns the result of the C function.
+    '''
+    if typ is None:
+        return _nvlist_add_value
+    if isinstance(typ, NvlistSchema):
+        def _encode(nvlist, key, value):
+            if isinstance(value, dict):
+                return _nvlist_add_nvlist(nvlist, key, value, typ)
+            if isinstance(value, list):
+                _nvlist_add_array(nvlist, key, value, typ)
+                return 0
+            return _nvlist_add_value(nvlist, key, value)
+        return _encode
+    if typ == "boolean":
+        add_boolean = _lib.nvlist_add_boolean
+
+        def _encode(nvlist, key, value):
+            if value is None:
+                return add_boolean(nvlist, key)
+            return _nvlist_add_value(nvlist, key, value)
+        return _encode
+    adder = getattr(_lib, "nvlist_add_%s" % (typ,))
+    # CFFI converts bools and C integers of any width to the declared type,
+    # these keep the type they carry, like without a schema.
+    explicit = (bool, _ffi.CData)
+    if typ in _ARRAY_TYPES:
+        def _encode(nvlist, key, value):
+            if value and isinstance(value[0], explicit):
+                return _nvlist_add_value(nvlist, key, value)
+            try:
+                return adder(nvlist, key, value, len(value))
+            except TypeError:
+                return _nvlist_add_value(nvlist, key, value)
+        return _encode
+
+    def _encode(nvlist, key, value):
+        if isinstance(value, explicit):
+            return _nvlist_add_value(nvlist, key, value)
+        try:
+            return adder(nvlist, key, value)
+        except TypeError:
+            return _nvlist_add_value(nvlist, key, value)
+    return _encode
+
+
+# The schema of the nvlists that are not passed to a specific operation.
+# Only integers need to be here, the integers are uint64 by default.
+_DEFAULT_SCHEMA = NvlistSchema({
+    b"rewind-request":  "uint32",
+    b"type":            "uint32",
+    b"N_MORE_ERRORS":   "int32",
+    b"pool_context":    "int32",
+})
+
+
+def _nvlist_add_array(nvlist, key, array, schema=None):
     def _is_integer(x):
         return isinstance(x, numbers.Integral) and not isinstance(x, bool)
 
@@ -162,18 +867,17 @@ def _nvlist_add_array(nvlist, key, array):
                                 _ffi.typeof(element).cname)
 
     if isinstance(specimen, dict):
-        # NB: can't use automatic memory management via nvlist_in() here,
-        # we have a loop, but 'with' would require recursion
-        c_array = []
-        for dictionary in array:
-            nvlistp = _ffi.new('nvlist_t **')
-            res = _lib.nvlist_alloc(nvlistp, 1, 0)  # UNIQUE_NAME == 1
-            if res != 0:
-                raise MemoryError('nvlist_alloc failed')
-            nested_nvlist = _ffi.gc(nvlistp[0], _lib.nvlist_free)
-            _dict_to_nvlist(dictionary, nested_nvlist)
-            c_array.append(nested_nvlist)
-        ret = _lib.nvlist_add_nvlist_array(nvlist, key, c_array, len(c_array))
+        # The array of empty nvlists is added first and then the copies
+        # made by nvlist_add_nvlist_array() are populated in place.
+        empty = _get_empty_nvlist()
+        ret = _lib.nvlist_add_nvlist_array(nvlist, key, [empty] * len(array), len(array))
+        if ret == 0:
+            nestedp = _ffi.new('nvlist_t ***')
+            lenp = _ffi.new('uint_t *')
+            ret = _lib.nvlist_lookup_nvlist_array(nvlist, key, nestedp, lenp)
+        if ret == 0:
+            for (i, dictionary) in enumerate(array):
+                _dict_to_nvlist(dictionary, nestedp[0][i], schema)
     elif isinstance(specimen, bytes):
         c_array = []
         for string in array:
@@ -187,85 +891,315 @@ def _nvlist_add_array(nvlist, key, array):
     elif isinstance(specimen, bool):
         ret = _lib.nvlist_add_boolean_array(nvlist, key, array, len(array))
     elif isinstance(specimen, numbers.Integral):
-        suffix = _prop_name_to_type_str.get(key, "uint64")
-        cfunc = getattr(_lib, "nvlist_add_%s_array" % (suffix,))
-        ret = cfunc(nvlist, key, array, len(array))
+        ret = _lib.nvlist_add_uint64_array(nvlist, key, array, len(array))
     elif isinstance(specimen, _ffi.CData) and _ffi.typeof(specimen) in _type_to_suffix:
         suffix = _type_to_suffix[_ffi.typeof(specimen)][True]
-        cfunc = getattr(_lib, "nvlist_add_%s_array" % (suffix,))
-        ret = cfunc(nvlist, key, array, len(array))
+        _get_type_table()
+        ret = _array_adders[suffix](nvlist, key, array, len(array))
     else:
         raise TypeError('Unsupported value type ' + type(specimen).__name__)
     if ret != 0:
         raise MemoryError('nvlist_add failed, err = %d' % ret)
 
 
-def _nvlist_to_dict(nvlist, props):
+def _buffer_array_suffix(value):
+    if isinstance(value, bytearray):
+        return "byte"
+    if isinstance(value, memoryview):
+        if value.ndim != 1:
+            raise TypeError('Unsupported memoryview with %d dimensions' % value.ndim)
+        typecode = value.format
+        if typecode[:1] in ("<", ">", "!"):
+            order = "little" if typecode[0] == "<" else "big"
+            if order != sys.byteorder:
+                raise TypeError('Unsupported memoryview with %s-endian format %s' %
+                                (order, typecode))
+        typecode = typecode.lstrip("@=<>!")
+    else:
+        typecode = value.typecode
+    if typecode in ("B", "c") and isinstance(value, memoryview):
+        return "byte"
+    if typecode in ("b", "h", "i", "l", "q"):
+        return "int%d" % (value.itemsize * 8)
+    if typecode in ("B", "H", "I", "L", "Q"):
+        return "uint%d" % (value.itemsize * 8)
+    raise TypeError('Unsupported array type code ' + typecode)
+
+
+def _nvlist_add_buffer(nvlist, key, value):
+    suffix = _buffer_array_suffix(value)
+    ctype = "uchar_t *" if suffix == "byte" else suffix + "_t *"
+    # the elements are passed to C as they are laid out in the buffer
+    buf = _ffi.from_buffer(value)
+    _get_type_table()
+    ret = _array_adders[suffix](nvlist, key, _ffi.cast(ctype, buf), len(value))
+    if ret != 0:
+        raise MemoryError('nvlist_add failed, err = %d' % ret)
+
+
+def _nvpair_value(pair, nested, compact_arrays):
+    decoder = _get_type_table()[int(_lib.nvpair_type(pair))]
+    # XXX nvpair_type_is_array() is broken for  DATA_TYPE_INT8_ARRAY at the moment
+    # see https://www.illumos.org/issues/5778
+    # is_array = bool(_lib.nvpair_type_is_array(pair))
+    if decoder.getter is None:
+        return None  # XXX or should it be True ?
+    out = _get_out_pointers()
+    valptr = out.valptrs[decoder.ctype]
+    if decoder.is_array:
+        ret = decoder.getter(pair, valptr, out.lenptr)
+        if ret != 0:
+            raise RuntimeError('nvpair_value failed')
+        length = int(out.lenptr[0])
+        elems = valptr[0]
+        convert = decoder.convert
+        if compact_arrays and decoder.compact is not None:
+            return _compact_array(decoder.compact, elems, length)
+        if convert is None:
+            convert = nested
+        return [convert(elems[i]) for i in range(length)]
+    ret = decoder.getter(pair, valptr)
+    if ret != 0:
+        raise RuntimeError('nvpair_value failed')
+    if decoder.convert is None:
+        return nested(valptr[0])
+    return decoder.convert(valptr[0])
+
+
+def _projection(fields):
+    '''
+    Convert a projection to the canonical form, a dictionary with byte
+    string keys and values that are either None or projections.
+    '''
+    if not isinstance(fields, Mapping):
+        fields = dict.fromkeys(fields)
+    projection = {}
+    for k, v in fields.items():
+        if isinstance(k, str):
+            k = k.encode()
+        projection[k] = None if v is None else _projection(v)
+    return projection
+
+
+def _nvlist_to_dict(nvlist, props, compact_arrays=False, fields=None):
+    def _nested(x):
+        return _nvlist_to_dict(x, {}, compact_arrays)
+
     pair = _lib.nvlist_next_nvpair(nvlist, _ffi.NULL)
-    while pair != _ffi.NULL:
+    if fields is None:
+        while pair != _ffi.NULL:
+            name = _ffi.string(_lib.nvpair_name(pair))
+            props[name] = _nvpair_value(pair, _nested, compact_arrays)
+            pair = _lib.nvlist_next_nvpair(nvlist, pair)
+        return props
+
+    # Stop as soon as all projected pairs are seen.
+    remaining = len(fields)
+    while pair != _ffi.NULL and remaining > 0:
         name = _ffi.string(_lib.nvpair_name(pair))
-        typeid = int(_lib.nvpair_type(pair))
-        typeinfo = _type_info(typeid)
-        # XXX nvpair_type_is_array() is broken for  DATA_TYPE_INT8_ARRAY at the moment
-        # see https://www.illumos.org/issues/5778
-        # is_array = bool(_lib.nvpair_type_is_array(pair))
-        is_array = typeinfo.is_array
-        cfunc = getattr(_lib, "nvpair_value_%s" % (typeinfo.suffix,), None)
-        val = None
-        ret = 0
-        if is_array:
-            valptr = _ffi.new(typeinfo.ctype)
-            lenptr = _ffi.new("uint_t *")
-            ret = cfunc(pair, valptr, lenptr)
-            if ret != 0:
-                raise RuntimeError('nvpair_value failed')
-            length = int(lenptr[0])
-            val = []
-            for i in range(length):
-                val.append(typeinfo.convert(valptr[0][i]))
-        else:
-            if typeid == _lib.DATA_TYPE_BOOLEAN:
-                val = None  # XXX or should it be True ?
+        if name in fields:
+            subfields = fields[name]
+            if subfields is None:
+                props[name] = _nvpair_value(pair, _nested, compact_arrays)
             else:
-                valptr = _ffi.new(typeinfo.ctype)
-                ret = cfunc(pair, valptr)
-                if ret != 0:
-                    raise RuntimeError('nvpair_value failed')
-                val = typeinfo.convert(valptr[0])
-        props[name] = val
+                props[name] = _nvpair_value(
+                    pair,
+                    lambda x: _nvlist_to_dict(x, {}, compact_arrays, subfields),
+                    compact_arrays)
+            remaining -= 1
         pair = _lib.nvlist_next_nvpair(nvlist, pair)
     return props
 
 
-def _dict_to_nvlist(props, nvlist):
+# The record buffer is kept between the calls unless it had to grow
+# larger than this number of records.
+_NATIVE_RECORDS_KEEP = 4096
+_native_state = threading.local()
+# compact_arrays -> data_type_t value -> converter
+_native_converters = {}
+
+
+def _make_native_converters(compact_arrays):
+    def _string(rec):
+        return _ffi.string(_ffi.cast("char *", rec.ptr))
+
+    def _array(ctype, convert):
+        ptype = _ffi.typeof(ctype)
+
+        def _convert(rec):
+            elems = _ffi.unpack(_ffi.cast(ptype, rec.ptr), rec.nelem)
+            if convert is None:
+                return elems
+            return [convert(x) for x in elems]
+        return _convert
+
+    def _compact(compact):
+        def _convert(rec):
+            return _compact_array(compact, rec.ptr, rec.nelem)
+        return _convert
+
+    converters = {
+        _lib.DATA_TYPE_BOOLEAN:         lambda rec: None,
+        _lib.DATA_TYPE_BOOLEAN_VALUE:   lambda rec: bool(rec.u64),
+        _lib.DATA_TYPE_BYTE:            lambda rec: rec.u64,
+        _lib.DATA_TYPE_INT8:            lambda rec: rec.i64,
+        _lib.DATA_TYPE_UINT8:           lambda rec: rec.u64,
+        _lib.DATA_TYPE_INT16:           lambda rec: rec.i64,
+        _lib.DATA_TYPE_UINT16:          lambda rec: rec.u64,
+        _lib.DATA_TYPE_INT32:           lambda rec: rec.i64,
+        _lib.DATA_TYPE_UINT32:          lambda rec: rec.u64,
+        _lib.DATA_TYPE_INT64:           lambda rec: rec.i64,
+        _lib.DATA_TYPE_UINT64:          lambda rec: rec.u64,
+        _lib.DATA_TYPE_STRING:          _string,
+        _lib.DATA_TYPE_BOOLEAN_ARRAY:   _array("boolean_t *", bool),
+        _lib.DATA_TYPE_BYTE_ARRAY:      _array("uchar_t *", None),
+        _lib.DATA_TYPE_INT8_ARRAY:      _array("int8_t *", None),
+        _lib.DATA_TYPE_UINT8_ARRAY:     _array("uint8_t *", None),
+        _lib.DATA_TYPE_INT16_ARRAY:     _array("int16_t *", None),
+        _lib.DATA_TYPE_UINT16_ARRAY:    _array("uint16_t *", None),
+        _lib.DATA_TYPE_INT32_ARRAY:     _array("int32_t *", None),
+        _lib.DATA_TYPE_UINT32_ARRAY:    _array("uint32_t *", None),
+        _lib.DATA_TYPE_INT64_ARRAY:     _array("int64_t *", None),
+        _lib.DATA_TYPE_UINT64_ARRAY:    _array("uint64_t *", None),
+        _lib.DATA_TYPE_STRING_ARRAY:    _array("char **", _ffi.string),
+    }
+    if compact_arrays:
+        for typeid, decoder in _get_type_table().items():
+            if decoder.compact is not None:
+                converters[typeid] = _compact(decoder.compact)
+    return converters
+
+
+def _native_records(nvlist):
+    recs = getattr(_native_state, 'recs', None)
+    if recs is None:
+        recs = _ffi.new("pyzfs_nvrec_t[]", 64)
+        _native_state.recs = recs
+    count = _lib.pyzfs_nvlist_flatten(nvlist, recs, len(recs))
+    if count > len(recs):
+        recs = _ffi.new("pyzfs_nvrec_t[]", count)
+        if count <= _NATIVE_RECORDS_KEEP:
+            _native_state.recs = recs
+        count = _lib.pyzfs_nvlist_flatten(nvlist, recs, count)
+    return (recs, count)
+
+
+def _nvlist_to_dict_native(nvlist, props, compact_arrays=False):
+    converters = _native_converters.get(compact_arrays)
+    if converters is None:
+        converters = _make_native_converters(compact_arrays)
+        _native_converters[compact_arrays] = converters
+    nvlist_type = _lib.DATA_TYPE_NVLIST
+    nvlist_array_type = _lib.DATA_TYPE_NVLIST_ARRAY
+
+    (recs, count) = _native_records(nvlist)
+    if count < 0:
+        # Let the reference implementation report the problem.
+        return _nvlist_to_dict(nvlist, props, compact_arrays)
+
+    # Each stack frame is a container being populated and the number of
+    # its entries that are yet to be seen, the top level count is never
+    # exhausted.
+    stack = [[props, -1]]
+    for i in range(count):
+        rec = recs[i]
+        typeid = rec.type
+        if typeid == nvlist_type:
+            val = {}
+            nested = rec.nelem
+        elif typeid == nvlist_array_type:
+            val = []
+            nested = rec.nelem
+        else:
+            val = converters[typeid](rec)
+            nested = 0
+        frame = stack[-1]
+        if rec.name == _ffi.NULL:
+            frame[0].append(val)
+        else:
+            frame[0][_ffi.string(rec.name)] = val
+        frame[1] -= 1
+        if nested > 0:
+            stack.append([val, nested])
+        else:
+            while stack[-1][1] == 0:
+                stack.pop()
+    return props
+
+
+def _nvlist_out_to_dict(nvlist, props, compact_arrays=False):
+    if libnvpair.api_mode:
+        return _nvlist_to_dict_native(nvlist, props, compact_arrays)
+    return _nvlist_to_dict(nvlist, props, compact_arrays)
+
+
+_empty_nvlist = None
+
+
+def _get_empty_nvlist():
+    global _empty_nvlist
+    if _empty_nvlist is None:
+        _empty_nvlist = nvlist_in({})
+    return _empty_nvlist
+
+
+def _nvlist_add_nvlist(nvlist, key, props, schema=None):
+    # nvlist_add_nvlist() copies the nvlist, so an empty nvlist is added
+    # first and then the copy is populated in place.
+    ret = _lib.nvlist_add_nvlist(nvlist, key, _get_empty_nvlist())
+    if ret != 0:
+        return ret
+    nestedp = _pool.get_nvlistp()
+    try:
+        ret = _lib.nvlist_lookup_nvlist(nvlist, key, nestedp)
+        if ret != 0:
+            return ret
+        _dict_to_nvlist(props, nestedp[0], schema)
+    finally:
+        # The embedded nvlist belongs to the parent.
+        _pool.put_nvlistp(nestedp)
+    return 0
+
+
+def _nvlist_add_value(nvlist, key, value):
+    '''
+    Add a pair with the type inferred from the value.
+    '''
+    if isinstance(value, dict):
+        return _nvlist_add_nvlist(nvlist, key, value)
+    elif isinstance(value, list):
+        _nvlist_add_array(nvlist, key, value)
+    elif isinstance(value, (array.array, bytearray, memoryview)):
+        _nvlist_add_buffer(nvlist, key, value)
+    elif isinstance(value, bytes):
+        return _lib.nvlist_add_string(nvlist, key, value)
+    elif isinstance(value, str):
+        return _lib.nvlist_add_string(nvlist, key, value.encode())
+    elif isinstance(value, bool):
+        return _lib.nvlist_add_boolean_value(nvlist, key, value)
+    elif value is None:
+        return _lib.nvlist_add_boolean(nvlist, key)
+    elif isinstance(value, numbers.Integral):
+        return _lib.nvlist_add_uint64(nvlist, key, value)
+    elif isinstance(value, _ffi.CData) and _ffi.typeof(value) in _type_to_suffix:
+        suffix = _type_to_suffix[_ffi.typeof(value)][False]
+        _get_type_table()
+        return _scalar_adders[suffix](nvlist, key, value)
+    else:
+        raise TypeError('Unsupported value type ' + type(value).__name__)
+    return 0
+
+
+def _dict_to_nvlist(props, nvlist, schema=None):
+    plan = (schema or _DEFAULT_SCHEMA)._get_plan()
+    encoders = plan.encoders
+    default = plan.default
     for k, v in list(props.items()):
-        if not (isinstance(k, bytes) or isinstance(k, str)):
-            raise TypeError('Unsupported key type ' + type(k).__name__)
-        if isinstance(k, str):
+        if not isinstance(k, bytes):
+            if not isinstance(k, str):
+                raise TypeError('Unsupported key type ' + type(k).__name__)
             k = k.encode()
-        ret = 0
-        if isinstance(v, dict):
-            ret = _lib.nvlist_add_nvlist(nvlist, k, nvlist_in(v))
-        elif isinstance(v, list):
-            _nvlist_add_array(nvlist, k, v)
-        elif isinstance(v, bytes):
-            ret = _lib.nvlist_add_string(nvlist, k, v)
-        elif isinstance(v, str):
-            ret = _lib.nvlist_add_string(nvlist, k, v.encode())
-        elif isinstance(v, bool):
-            ret = _lib.nvlist_add_boolean_value(nvlist, k, v)
-        elif v is None:
-            ret = _lib.nvlist_add_boolean(nvlist, k)
-        elif isinstance(v, numbers.Integral):
-            suffix = _prop_name_to_type_str.get(k, "uint64")
-            cfunc = getattr(_lib, "nvlist_add_%s" % (suffix,))
-            ret = cfunc(nvlist, k, v)
-        elif isinstance(v, _ffi.CData) and _ffi.typeof(v) in _type_to_suffix:
-            suffix = _type_to_suffix[_ffi.typeof(v)][False]
-            cfunc = getattr(_lib, "nvlist_add_%s" % (suffix,))
-            ret = cfunc(nvlist, k, v)
-        else:
-            raise TypeError('Unsupported value type ' + type(v).__name__)
+        ret = encoders.get(k, default)(nvlist, k, v)
         if ret != 0:
             raise MemoryError('nvlist_add failed')
 
@@ -0,0 +1,306 @@
+# Copyright 2015 ClusterHQ. See LICENSE file for details.
+
+"""
+A pure Python decoder of packed nvlists in the native encoding.
+
+The decoder builds the Python objects straight from the packed bytes
+without unpacking the nvlist with libnvpair, so it does not need the C
+library and it can run in any process.  It produces exactly the same
+dictionaries as ``nvlist_out`` does for the unpacked nvlist, including
+the compact arrays and the projections, see :mod:`._nvlist`.
+
+The native encoding is a 4 byte stream header (the encoding, the byte
+order and two reserved bytes) followed by the nvlist.  An nvlist is
+its version and flags, two 32-bit integers, followed by the nvpairs and
+a 32-bit zero that terminates the list.  An nvpair is a copy of the
+in-memory ``nvpair_t``: a 16 byte header with the total size of
+the nvpair, the size of the name, the number of the elements and the data
+type, the NUL-terminated name and the value aligned to 8 bytes.
+The embedded nvlists follow the nvpair that contains them.
+
+The XDR encoding is not supported.
+"""
+from __future__ import unicode_literals
+
+import array
+import errno
+import struct
+import sys
+
+from . import exceptions
+
+_NV_ENCODE_NATIVE = 0
+_NV_BIG_ENDIAN = 0
+_NV_LITTLE_ENDIAN = 1
+
+_NVS_HEADER_SIZE = 4
+_NVL_HEADER_SIZE = 8
+_NVP_HEADER_SIZE = 16
+_NVP_END_SIZE = 4
+
+# data_type_t values
+DATA_TYPE_BOOLEAN = 1
+DATA_TYPE_BYTE = 2
+DATA_TYPE_INT16 = 3
+DATA_TYPE_UINT16 = 4
+DATA_TYPE_INT32 = 5
+DATA_TYPE_UINT32 = 6
+DATA_TYPE_INT64 = 7
+DATA_TYPE_UINT64 = 8
+DATA_TYPE_STRING = 9
+DATA_TYPE_BYTE_ARRAY = 10
+DATA_TYPE_INT16_ARRAY = 11
+DATA_TYPE_UINT16_ARRAY = 12
+DATA_TYPE_INT32_ARRAY = 13
+DATA_TYPE_UINT32_ARRAY = 14
+DATA_TYPE_INT64_ARRAY = 15
+DATA_TYPE_UINT64_ARRAY = 16
+DATA_TYPE_STRING_ARRAY = 17
+DATA_TYPE_NVLIST = 19
+DATA_TYPE_NVLIST_ARRAY = 20
+DATA_TYPE_BOOLEAN_VALUE = 21
+DATA_TYPE_INT8 = 22
+DATA_TYPE_UINT8 = 23
+DATA_TYPE_BOOLEAN_ARRAY = 24
+DATA_TYPE_INT8_ARRAY = 25
+DATA_TYPE_UINT8_ARRAY = 26
+
+# The struct format of the scalar values and of the array elements.
+# boolean_t is an enum, that is, an int.
+_SCALARS = {
+    DATA_TYPE_BOOLEAN_VALUE:    'i',
+    DATA_TYPE_BYTE:             'B',
+    DATA_TYPE_INT8:             'b',
+    DATA_TYPE_UINT8:            'B',
+    DATA_TYPE_INT16:            'h',
+    DATA_TYPE_UINT16:           'H',
+    DATA_TYPE_INT32:            'i',
+    DATA_TYPE_UINT32:           'I',
+    DATA_TYPE_INT64:            'q',
+    DATA_TYPE_UINT64:           'Q',
+}
+_ARRAYS = {
+    DATA_TYPE_BOOLEAN_ARRAY:    'i',
+    DATA_TYPE_BYTE_ARRAY:       'B',
+    DATA_TYPE_INT8_ARRAY:       'b',
+    DATA_TYPE_UINT8_ARRAY:      'B',
+    DATA_TYPE_INT16_ARRAY:      'h',
+    DATA_TYPE_UINT16_ARRAY:     'H',
+    DATA_TYPE_INT32_ARRAY:      'i',
+    DATA_TYPE_UINT32_ARRAY:     'I',
+    DATA_TYPE_INT64_ARRAY:      'q',
+    DATA_TYPE_UINT64_ARRAY:     'Q',
+}
+
+# sizeof (uint64_t), the string arrays start with the zeroed pointers
+_POINTER_SIZE = 8
+
+# byte order -> data_type_t value -> decoder
+_decoders = {}
+
+
+def _array_typecode(fmt):
+    itemsize = struct.calcsize('=' + fmt)
+    for typecode in ('bhilq' if fmt.islower() else 'BHILQ'):
+        try:
+            if array.array(typecode).itemsize == itemsize:
+                return typecode
+        except ValueError:
+            # 'q' and 'Q' are not available on Python 2
+            pass
+    return None
+
+
+def _array_from_bytes(typecode, data):
+    val = array.array(typecode)
+    if hasattr(val, "frombytes"):
+        val.frombytes(data)
+    else:
+        # Python 2
+        val.fromstring(data[:])
+    return val
+
+
+def _make_decoders(order):
+    '''
+    Build the decoders of the values for the given struct byte order.
+    A decoder takes the data, the offset of the value, the end of
+    the nvpair, the number of the elements and the compact arrays flag.
+    '''
+    swap = (order == '<') != (sys.byteorder == 'little')
+
+    def _scalar(fmt, convert):
+        unpack_from = struct.Struct(order + fmt).unpack_from
+        if convert is None:
+            return lambda data, off, end, nelem, compact: unpack_from(data, off)[0]
+        return lambda data, off, end, nelem, compact: convert(unpack_from(data, off)[0])
+
+    def _array(fmt, convert, byte_array, compactable):
+        typecode = _array_typecode(fmt) if compactable else None
+        itemsize = struct.calcsize(order + fmt)
+
+        def _decode(data, off, end, nelem, compact):
+            if compact and byte_array:
+                return bytes(data[off:off + nelem])
+            if compact and typecode is not None:
+                val = _array_from_bytes(typecode, bytes(data[off:off + nelem * itemsize]))
+                if swap:
+                    val.byteswap()
+                return val
+            elems = struct.unpack_from('%s%d%s' % (order, nelem, fmt), data, off)
+            if convert is None:
+                return list(elems)
+            return [convert(x) for x in elems]
+        return _decode
+
+    def _string(data, off, end, nelem, compact):
+        nul = data.index(b'\0', off, end)
+        return bytes(data[off:nul])
+
+    def _string_array(data, off, end, nelem, compact):
+        # The pointers to the strings precede the strings.
+        off += nelem * _POINTER_SIZE
+        val = []
+        for _ in range(nelem):
+            nul = data.index(b'\0', off, end)
+            val.append(bytes(data[off:nul]))
+            off = nul + 1
+        return val
+
+    decoders = {
+        DATA_TYPE_BOOLEAN: lambda data, off, end, nelem, compact: None,
+        DATA_TYPE_STRING: _string,
+        DATA_TYPE_STRING_ARRAY: _string_array,
+    }
+    for (typeid, fmt) in _SCALARS.items():
+        convert = bool if typeid == DATA_TYPE_BOOLEAN_VALUE else None
+        decoders[typeid] = _scalar(fmt, convert)
+    for (typeid, fmt) in _ARRAYS.items():
+        # The boolean arrays are never decoded in the compact form.
+        is_boolean = typeid == DATA_TYPE_BOOLEAN_ARRAY
+        decoders[typeid] = _array(fmt, bool if is_boolean else None,
+                                  typeid == DATA_TYPE_BYTE_ARRAY, not is_boolean)
+    return decoders
+
+
+def _align8(n):
+    return (n + 7) & ~7
+
+
+class _Decoder(object):
+
+    def __init__(self, data, order, compact_arrays):
+        self.data = data
+        self.compact = compact_arrays
+        decoders = _decoders.get(order)
+        if decoders is None:
+            decoders = _make_decoders(order)
+            _decoders[order] = decoders
+        self.decoders = decoders
+        self.pair_header = struct.Struct(order + 'ihhii').unpack_from
+        self.int32 = struct.Struct(order + 'i').unpack_from
+
+    def nvlist(self, pos, props, fields):
+        '''
+        Decode the nvlist at ``pos`` into ``props``.
+
+        :return: the position after the nvlist.
+        '''
+        data = self.data
+        pos += _NVL_HEADER_SIZE
+        while True:
+            (size,) = self.int32(data, pos)
+            if size == 0:
+                return pos + _NVP_END_SIZE
+            (size, name_sz, _, nelem, typeid) = self.pair_header(data, pos)
+            if size < _NVP_HEADER_SIZE or name_sz < 1:
+                raise ValueError('invalid nvpair header')
+            name_end = pos + _NVP_HEADER_SIZE + name_sz - 1
+            name = bytes(data[pos + _NVP_HEADER_SIZE:name_end])
+            valoff = pos + _align8(_NVP_HEADER_SIZE + name_sz)
+            end = pos + size
+            if end > len(data):
+                raise ValueError('truncated nvpair')
+            pos = end
+            if fields is not None and name not in fields:
+                if typeid == DATA_TYPE_NVLIST:
+                    pos = self.skip(pos)
+                elif typeid == DATA_TYPE_NVLIST_ARRAY:
+                    for _ in range(nelem):
+                        pos = self.skip(pos)
+                continue
+            subfields = fields[name] if fields is not None else None
+            if typeid == DATA_TYPE_NVLIST:
+                val = {}
+                pos = self.nvlist(pos, val, subfields)
+            elif typeid == DATA_TYPE_NVLIST_ARRAY:
+                val = []
+                for _ in range(nelem):
+                    elem = {}
+                    pos = self.nvlist(pos, elem, subfields)
+                    val.append(elem)
+            else:
+                decode = self.decoders.get(typeid)
+                if decode is None:
+                    raise exceptions.ZFSGenericError(
+                        errno.ENOTSUP, None, "Unsupported nvpair type %d" % typeid)
+                val = decode(data, valoff, end, nelem, self.compact)
+            props[name] = val
+
+    def skip(self, pos):
+        '''
+        :return: the position after the nvlist at ``pos``.
+        '''
+        data = self.data
+        pos += _NVL_HEADER_SIZE
+        while True:
+            (size,) = self.int32(data, pos)
+            if size == 0:
+                return pos + _NVP_END_SIZE
+            (size, _, _, nelem, typeid) = self.pair_header(data, pos)
+            if size < _NVP_HEADER_SIZE:
+                raise ValueError('invalid nvpair header')
+            pos += size
+            if typeid == DATA_TYPE_NVLIST:
+                pos = self.skip(pos)
+            elif typeid == DATA_TYPE_NVLIST_ARRAY:
+                for _ in range(nelem):
+                    pos = self.skip(pos)
+
+
+def unpack_nvlist(data, compact_arrays=False, fields=None):
+    '''
+    Decode a packed nvlist.
+
+    :param data: the packed nvlist in the native encoding.
+    :type data: bytes or bytearray or memoryview
+    :param bool compact_arrays: whether arrays of integers should be decoded
+        to ``array.array`` objects and byte arrays to byte strings
+        instead of lists.
+    :param fields: the projection of the nvlist to decode, by default
+        the whole nvlist is decoded.  It must be in the canonical form,
+        see :func:`._nvlist._projection`.
+    :type fields: dict or None
+    :return: the decoded nvlist.
+    :rtype: dict
+    :raises ZFSGenericError: with ``ENOTSUP`` if the encoding or a data type
+        is not supported or with ``EINVAL`` if the data is malformed.
+    '''
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    if len(data) < _NVS_HEADER_SIZE:
+        raise exceptions.ZFSGenericError(errno.EINVAL, None, "Truncated nvlist")
+    (encoding, endian) = struct.unpack_from('BB', data, 0)
+    if encoding != _NV_ENCODE_NATIVE or endian not in (_NV_BIG_ENDIAN, _NV_LITTLE_ENDIAN):
+        raise exceptions.ZFSGenericError(
+            errno.ENOTSUP, None, "Unsupported nvlist encoding")
+    order = '<' if endian == _NV_LITTLE_ENDIAN else '>'
+    props = {}
+    try:
+        _Decoder(data, order, compact_arrays).nvlist(_NVS_HEADER_SIZE, props, fields)
+    except (struct.error, ValueError, IndexError):
+        raise exceptions.ZFSGenericError(errno.EINVAL, None, "Malformed nvlist")
+    return props
+
+
+# vim: softtabstop=4 tabstop=4 expandtab shiftwidth=4
@@ -0,0 +1,141 @@
+# Copyright 2015 ClusterHQ. See LICENSE file for details.
+
+"""
+Helpers for running many independent libzfs_core operations in parallel.
+
+The C calls release the interpreter lock while they wait for the kernel,
+so the operations on different datasets can overlap when they are made
+from several threads.
+"""
+from __future__ import unicode_literals
+
+import collections
+import threading
+
+from builtins import object
+from builtins import range
+
+from ._error_translation import _pool_name
+
+# The default limits on the number of the concurrent operations.
+_MAX_WORKERS = 16
+_MAX_PER_POOL = 4
+
+
+def _dataset_pool(name):
+    if isinstance(name, bytes):
+        name = name.decode('utf-8', 'replace')
+    return _pool_name(name)
+
+
+class _Scheduler(object):
+
+    '''
+    Hands out the pending calls to the workers.
+
+    A call is handed out only if fewer than ``max_per_pool`` calls for
+    the same pool are in progress.  Among the eligible calls the one that
+    comes first in the input is handed out first.
+    '''
+
+    def __init__(self, calls, max_per_pool):
+        self._cond = threading.Condition()
+        self._max_per_pool = max_per_pool
+        self._pending = collections.OrderedDict()
+        self._running = collections.defaultdict(int)
+        for index, args in enumerate(calls):
+            pool = _dataset_pool(args[0])
+            self._pending.setdefault(pool, collections.deque()).append((index, args))
+
+    def take(self):
+        '''
+        Wait for a call that can be started.
+
+        :return: a tuple of the pool name, the input index and the arguments
+            of the call or ``None`` if no calls are left.
+        '''
+        with self._cond:
+            while True:
+                if not self._pending:
+                    return None
+                best = None
+                for pool, calls in self._pending.items():
+                    if self._running[pool] >= self._max_per_pool:
+                        continue
+                    if best is None or calls[0][0] < self._pending[best][0][0]:
+                        best = pool
+                if best is not None:
+                    calls = self._pending[best]
+                    (index, args) = calls.popleft()
+                    if not calls:
+                        del self._pending[best]
+                    self._running[best] += 1
+                    return (best, index, args)
+                self._cond.wait()
+
+    def done(self, pool):
+        with self._cond:
+            self._running[pool] -= 1
+            self._cond.notify_all()
+
+
+def map_parallel(func, calls, max_workers=_MAX_WORKERS, max_per_pool=_MAX_PER_POOL):
+    '''
+    Call the given function for each element of ``calls`` using a pool
+    of threads.
+
+    The calls that operate on the same ZFS pool are limited separately
+    from the overall limit, so that a busy pool does not take all the
+    threads and a single pool is not flooded with requests.  The pool
+    of a call is determined by the dataset name in the first argument.
+
+    :param func: the function to call, for example, :func:`.lzc_get_props`.
+    :param calls: the arguments of the calls, each element is either a tuple
+        of positional arguments or a single dataset name.
+    :type calls: list of tuple or list of bytes
+    :param int max_workers: the maximum number of the concurrent calls.
+    :param int max_per_pool: the maximum number of the concurrent calls
+        for datasets in the same ZFS pool.
+    :return: a list with the result of each call in the same order as
+        ``calls``; if a call raises an exception, then the exception object
+        takes the place of its result.
+    :rtype: list
+
+    Example::
+
+        props = map_parallel(lzc_get_props, names)
+        for name, p in zip(names, props):
+            if isinstance(p, Exception):
+                ...
+    '''
+    if max_workers < 1 or max_per_pool < 1:
+        raise ValueError('the limits must be positive')
+    calls = [c if isinstance(c, tuple) else (c,) for c in calls]
+    results = [None] * len(calls)
+    scheduler = _Scheduler(calls, max_per_pool)
+
+    def _worker():
+        while True:
+            call = scheduler.take()
+            if call is None:
+                return
+            (pool, index, args) = call
+            try:
+                results[index] = func(*args)
+            except Exception as e:
+                results[index] = e
+            finally:
+                scheduler.done(pool)
+
+    threads = []
+    for _ in range(min(max_workers, len(calls))):
+        thread = threading.Thread(target=_worker, name='lzc worker')
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    return results
+
+
+# vim: softtabstop=4 tabstop=4 expandtab shiftwidth=4
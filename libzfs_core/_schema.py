@@ -0,0 +1,73 @@
+# Copyright 2015 ClusterHQ. See LICENSE file for details.
+
+"""
+The schemas of the nvlists passed to the libzfs_core functions.
+
+The native ZFS properties are typed after their definitions in ZFS:
+the numeric properties are uint64 and the string properties are strings.
+The index properties, like ``compression``, accept either the name of
+the value or its number, they are typed as strings because the names are
+used more often; a number is added as uint64.  The user properties are
+always strings.
+"""
+from __future__ import unicode_literals
+
+from ._nvlist import NvlistSchema
+
+_NUMBER_PROPS = [
+    b'quota', b'reservation', b'refquota', b'refreservation',
+    b'volsize', b'volblocksize', b'recordsize', b'version',
+    b'filesystem_limit', b'snapshot_limit', b'special_small_blocks',
+    b'pbkdf2iters',
+]
+
+_STRING_PROPS = [
+    b'mountpoint', b'sharenfs', b'sharesmb', b'mlslabel', b'context',
+    b'fscontext', b'defcontext', b'rootcontext', b'keylocation',
+]
+
+_INDEX_PROPS = [
+    b'aclinherit', b'aclmode', b'acltype', b'atime', b'canmount',
+    b'casesensitivity', b'checksum', b'compression', b'copies', b'dedup',
+    b'devices', b'dnodesize', b'encryption', b'exec', b'keyformat',
+    b'logbias', b'nbmand', b'normalization', b'overlay', b'primarycache',
+    b'readonly', b'redundant_metadata', b'relatime', b'secondarycache',
+    b'setuid', b'snapdev', b'snapdir', b'sync', b'utf8only', b'volmode',
+    b'vscan', b'xattr', b'zoned',
+]
+
+
+def _props_types():
+    types = dict.fromkeys(_NUMBER_PROPS, 'uint64')
+    types.update(dict.fromkeys(_STRING_PROPS + _INDEX_PROPS, 'string'))
+    return types
+
+
+# The properties of lzc_create, lzc_clone, lzc_snapshot and lzc_set_props.
+_ZFS_PROPS = NvlistSchema(_props_types())
+
+# The properties to set on the received dataset.
+_RECEIVE_PROPS = NvlistSchema(_props_types())
+
+# The options of lzc_list.
+_LIST_OPTIONS = NvlistSchema({
+    b'recurse': 'uint64',
+    b'type': NvlistSchema(default='boolean'),
+    b'fd': 'int32',
+})
+
+# The sets of names: the snapshots to create or destroy, the bookmarks to
+# destroy and the bookmark properties to get.
+_NAMES = NvlistSchema(default='boolean')
+
+# The snapshots mapped to the hold tags.
+_HOLDS = NvlistSchema(default='string')
+
+# The snapshots mapped to the sets of the hold tags to release.
+_RELEASE = NvlistSchema(default=_NAMES)
+
+# The bookmarks mapped to the snapshots.
+_BOOKMARKS = NvlistSchema(default='string')
+
+
+# vim: softtabstop=4 tabstop=4 expandtab shiftwidth=4
@@ -0,0 +1,249 @@
+# Copyright 2015 ClusterHQ. See LICENSE file for details.
+
+"""
+An in-memory index of the datasets built from a single recursive listing.
+"""
+from __future__ import unicode_literals
+
+from builtins import object
+
+from . import _libzfs_core as _lzc
+from . import exceptions
+from ._cache import _ancestors
+from ._libzfs_core import _PROPS_FIELDS, _parent_name
+
+_LIST_TYPES = ['filesystem', 'volume', 'snapshot']
+
+# The listing elements are decoded to dictionaries up front, so that
+# the index does not keep an nvlist per dataset alive.
+_TREE_FIELDS = dict(_PROPS_FIELDS)
+_TREE_FIELDS[b'properties'] = None
+
+
+class _Node(object):
+
+    __slots__ = ('name', 'type', 'props', 'children', 'snapshots')
+
+    def __init__(self, name, type, props):
+        self.name = name
+        self.type = type
+        self.props = props
+        self.children = []
+        self.snapshots = []
+
+
+class DatasetTree(object):
+
+    '''
+    An index of the filesystems, volumes and snapshots in a subtree
+    of datasets.
+
+    The index is built from a single recursive listing, after that
+    the lookups do not involve the kernel.  The information is not
+    updated automatically, the index or any of its subtrees can be
+    listed again with :meth:`refresh`.
+
+    :param bytes root: the name of the dataset at the root of the index,
+        usually the name of a pool.
+    :raises DatasetNotFound: if the root dataset does not exist.
+
+    Example::
+
+        tree = DatasetTree(b'pool')
+        for child in tree.children(b'pool/fs'):
+            for snap in tree.snapshots(child):
+                ...
+    '''
+
+    def __init__(self, root):
+        self._root = _lzc._b(root)
+        self._nodes = {}
+        # Maps the origin snapshots to the lists of their clones
+        # and the clones to their origins.
+        self._clones = {}
+        self._origins = {}
+        self.refresh()
+
+    @property
+    def root(self):
+        '''
+        The name of the root dataset.
+        '''
+        return self._root
+
+    def refresh(self, name=None):
+        '''
+        List the subtree of the given dataset again and replace
+        the information about it in the index.
+
+        :param name: the name of the dataset in the index or of a dataset
+            to be added to the index, by default the root dataset.
+        :type name: bytes or None
+        :raises DatasetNotFound: if the root dataset does not exist.
+
+        If the dataset does not exist, then it is removed from the index.
+        The clones outside of the subtree of ``name`` are updated only
+        if the information about their origins is refreshed.
+        '''
+        name = self._root if name is None else _lzc._b(name)
+        if self._root not in set(_ancestors(name)):
+            raise ValueError('%r is not in the subtree of %r' % (name, self._root))
+        try:
+            entries = list(_lzc._list(name, recurse=None, types=_LIST_TYPES, fields=_TREE_FIELDS))
+        except exceptions.DatasetNotFound:
+            if name == self._root:
+                raise
+            entries = []
+        self._remove(name)
+        added = [self._add(entry) for entry in entries]
+        # The entries are linked after all of them are added,
+        # so that their order does not matter.
+        for node in added:
+            parent = self._nodes.get(_parent_name(node.name))
+            if parent is not None:
+                if node.type == 'snapshot':
+                    parent.snapshots.append(node.name)
+                else:
+                    parent.children.append(node.name)
+
+    def _remove(self, name):
+        node = self._nodes.get(name)
+        if node is None:
+            return
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            stack.extend(self._nodes[n] for n in node.children)
+            stack.extend(self._nodes[n] for n in node.snapshots)
+            del self._nodes[node.name]
+            for clone in self._clones.pop(node.name, []):
+                if self._origins.get(clone) == node.name:
+                    del self._origins[clone]
+        parent = self._nodes.get(_parent_name(name))
+        if parent is not None:
+            siblings = parent.snapshots if b'@' in name else parent.children
+            siblings.remove(name)
+
+    def _add(self, entry):
+        name = _lzc._b(entry[b'name'])
+        props = entry[b'properties']
+        if b'clones' in props:
+            clones = [_lzc._b(c) for c in props[b'clones'][b'value'].keys()]
+            self._clones[name] = clones
+            for clone in clones:
+                self._origins[clone] = name
+        node = _Node(name, _lzc._entry_type(entry), _lzc._props_from_entry(name, entry))
+        self._nodes[name] = node
+        return node
+
+    def _node(self, name):
+        node = self._nodes.get(_lzc._b(name))
+        if node is None:
+            raise exceptions.DatasetNotFound(name)
+        return node
+
+    def __contains__(self, name):
+        return _lzc._b(name) in self._nodes
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def __iter__(self):
+        return iter(self._nodes)
+
+    def type(self, name):
+        '''
+        Get the type of the dataset.
+
+        :param bytes name: the name of the dataset.
+        :return: one of "filesystem", "volume" and "snapshot".
+        :rtype: str
+        :raises DatasetNotFound: if the dataset is not in the index.
+        '''
+        return self._node(name).type
+
+    def props(self, name):
+        '''
+        Get the properties of the dataset as of the last listing.
+
+        :param bytes name: the name of the dataset.
+        :return: the same dictionary as :func:`.lzc_get_props` would return.
+            The dictionary is shared and must not be modified.
+        :rtype: dict of bytes:Any
+        :raises DatasetNotFound: if the dataset is not in the index.
+        '''
+        return self._node(name).props
+
+    def parent(self, name):
+        '''
+        Get the parent of the filesystem or volume or the filesystem
+        or volume of the snapshot.
+
+        :param bytes name: the name of the dataset.
+        :return: the name of the parent or ``None`` if it is not in the index.
+        :rtype: bytes or None
+        :raises DatasetNotFound: if the dataset is not in the index.
+        '''
+        parent = _parent_name(self._node(name).name)
+        return parent if parent in self._nodes else None
+
+    def children(self, name):
+        '''
+        Get the child filesystems and volumes of the filesystem.
+
+        :param bytes name: the name of the filesystem.
+        :return: the names of the children.
+        :rtype: list of bytes
+        :raises DatasetNotFound: if the dataset is not in the index.
+        '''
+        return list(self._node(name).children)
+
+    def snapshots(self, name):
+        '''
+        Get the snapshots of the filesystem or volume.
+
+        :param bytes name: the name of the filesystem or volume.
+        :return: the names of the snapshots.
+        :rtype: list of bytes
+        :raises DatasetNotFound: if the dataset is not in the index.
+        '''
+        return list(self._node(name).snapshots)
+
+    def descendants(self, name):
+        '''
+        Generate the names of all filesystems and volumes below the dataset.
+
+        :param bytes name: the name of the dataset.
+        :raises DatasetNotFound: if the dataset is not in the index.
+        '''
+        stack = list(reversed(self._node(name).children))
+        while stack:
+            child = stack.pop()
+            yield child
+            stack.extend(reversed(self._nodes[child].children))
+
+    def clones(self, name):
+        '''
+        Get the clones of the snapshot.
+
+        :param bytes name: the name of the snapshot.
+        :return: the names of the clones.
+        :rtype: list of bytes
+        :raises DatasetNotFound: if the snapshot is not in the index.
+        '''
+        return list(self._clones.get(self._node(name).name, []))
+
+    def origin(self, name):
+        '''
+        Get the origin snapshot of the clone.
+
+        :param bytes name: the name of the filesystem or volume.
+        :return: the name of the origin snapshot or ``None`` if the dataset
+            is not a clone of a snapshot in the index.
+        :rtype: bytes or None
+        :raises DatasetNotFound: if the dataset is not in the index.
+        '''
+        return self._origins.get(self._node(name).name)
+
+
+# vim: softtabstop=4 tabstop=4 expandtab shiftwidth=4
@@ -0,0 +1,218 @@
+# Copyright 2015 ClusterHQ. See LICENSE file for details.
+
+"""
+:mod:`asyncio` interface for the long running libzfs_core operations.
+
+The coroutines in this module have the same signatures, return values
+and exceptions as the functions of the same names in :mod:`libzfs_core`.
+The C calls are made on a bounded thread pool, so the number of threads
+does not grow with the number of operations in progress; the excess
+operations wait for a free thread.  The pool can be replaced with
+:func:`set_executor`.
+
+The listing coroutines do not use the thread pool for reading
+the listing, the pipe is read by the event loop when it becomes readable.
+
+This module requires Python 3.6 or newer.
+"""
+from __future__ import unicode_literals
+
+import asyncio
+import concurrent.futures
+import errno
+import functools
+import os
+import struct
+import threading
+
+from . import _error_translation as errors
+from . import _libzfs_core as _lzc
+from . import exceptions
+
+# The default maximum number of the concurrent C calls.
+_MAX_WORKERS = 8
+
+_executor = None
+_executor_lock = threading.Lock()
+
+# asyncio.get_running_loop() is new in Python 3.7.
+_get_running_loop = getattr(asyncio, 'get_running_loop', asyncio.get_event_loop)
+
+
+def set_executor(executor):
+    '''
+    Replace the executor that runs the C calls.
+
+    :param executor: the new executor or ``None`` to use the default
+        thread pool with up to 8 threads.
+    :type executor: concurrent.futures.Executor or None
+
+    The previous executor is not shut down.
+    '''
+    global _executor
+    with _executor_lock:
+        _executor = executor
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = concurrent.futures.ThreadPoolExecutor(_MAX_WORKERS)
+        return _executor
+
+
+async def _run(func, *args, **kwargs):
+    loop = _get_running_loop()
+    return await loop.run_in_executor(
+        _get_executor(), functools.partial(func, *args, **kwargs))
+
+
+async def lzc_snapshot(snaps, props=None):
+    '''
+    A coroutine version of :func:`libzfs_core.lzc_snapshot`.
+    '''
+    return await _run(_lzc.lzc_snapshot, snaps, props)
+
+
+async def lzc_destroy_snaps(snaps, defer):
+    '''
+    A coroutine version of :func:`libzfs_core.lzc_destroy_snaps`.
+    '''
+    return await _run(_lzc.lzc_destroy_snaps, snaps, defer)
+
+
+async def lzc_send(snapname, fromsnap, fd, flags=None):
+    '''
+    A coroutine version of :func:`libzfs_core.lzc_send`.
+
+    The stream is written to ``fd`` by a thread of the executor,
+    the file descriptor must not be closed until the coroutine completes.
+    '''
+    return await _run(_lzc.lzc_send, snapname, fromsnap, fd, flags)
+
+
+async def lzc_receive(snapname, fd, force=False, origin=None, props=None):
+    '''
+    A coroutine version of :func:`libzfs_core.lzc_receive`.
+
+    The stream is read from ``fd`` by a thread of the executor,
+    the file descriptor must not be closed until the coroutine completes.
+    '''
+    return await _run(_lzc.lzc_receive, snapname, fd, force, origin, props)
+
+
+async def _readable(loop, fd):
+    waiter = loop.create_future()
+
+    def _ready():
+        if not waiter.done():
+            waiter.set_result(None)
+
+    loop.add_reader(fd, _ready)
+    try:
+        await waiter
+    finally:
+        loop.remove_reader(fd)
+
+
+async def _list(name, recurse=None, types=None, lazy=False,
+                bufsize=_lzc._LIST_BUFSIZE, fields=None):
+    '''
+    An asynchronous generator version of the private ``_list`` function
+    of :mod:`libzfs_core`.  The records are decoded as soon as they are
+    complete.
+    '''
+    loop = _get_running_loop()
+    options = _lzc._list_options(recurse, types)
+    if fields is not None:
+        fields = _lzc._projection(fields)
+    (fd, other_fd) = await _run(_lzc.lzc_list, name, options)
+    if fd is None:
+        return
+
+    try:
+        os.set_blocking(fd, False)
+        pending = bytearray()
+        eof = False
+        while True:
+            offset = 0
+            cbuf = _lzc._ffi.from_buffer(pending)
+            try:
+                while len(pending) - offset >= _lzc._PIPE_RECORD_SIZE:
+                    (size, _, err, _, _) = struct.unpack_from(
+                        _lzc._PIPE_RECORD_FORMAT, pending, offset)
+                    if err == errno.ESRCH:
+                        return
+                    errors.lzc_list_translate_error(err, name, options)
+                    if size == 0:
+                        return
+                    start = offset + _lzc._PIPE_RECORD_SIZE
+                    if len(pending) - start < size:
+                        break
+                    entry = _lzc._unpack_entry(cbuf + start, size, lazy, fields)
+                    offset = start + size
+                    yield entry
+            finally:
+                # The buffer can not be resized while it is exported.
+                _lzc._ffi.release(cbuf)
+            del pending[:offset]
+
+            if eof:
+                if pending:
+                    raise exceptions.ZFSGenericError(
+                        errno.EIO, None, "Truncated list data")
+                return
+            await _readable(loop, fd)
+            while True:
+                try:
+                    data = os.read(fd, bufsize)
+                except BlockingIOError:
+                    break
+                if not data:
+                    eof = True
+                    break
+                pending += data
+    finally:
+        os.close(other_fd)
+        os.close(fd)
+
+
+async def _list_names(name, types):
+    entries = _list(name, recurse=1, types=types, fields=_lzc._NAME_FIELDS)
+    try:
+        async for entry in entries:
+            entry_name = entry[b'name']
+            if entry_name != name:
+                yield entry_name
+    finally:
+        await entries.aclose()
+
+
+def lzc_iter_children(name):
+    '''
+    An asynchronous generator version of
+    :func:`libzfs_core.lzc_iter_children`.
+
+    The listing resources are released when the generator is exhausted
+    or closed with ``aclose()``.
+    '''
+    if not _lzc.is_supported(_lzc.lzc_iter_children):
+        raise NotImplementedError('lzc_iter_children')
+    return _list_names(name, ['filesystem', 'volume'])
+
+
+def lzc_iter_snaps(name):
+    '''
+    An asynchronous generator version of
+    :func:`libzfs_core.lzc_iter_snaps`.
+
+    The listing resources are released when the generator is exhausted
+    or closed with ``aclose()``.
+    '''
+    if not _lzc.is_supported(_lzc.lzc_iter_snaps):
+        raise NotImplementedError('lzc_iter_snaps')
+    return _list_names(name, ['snapshot'])
+
+
+# vim: softtabstop=4 tabstop=4 expandtab shiftwidth=4
@@ -4,6 +4,11 @@
 The package that contains a module per each C library that
 `libzfs_core` uses.  The modules expose CFFI objects required
 to make calls to functions in the libraries.
+
+If the optional API mode extension module built by :mod:`.build`
+is available and can be loaded, then its objects are used.
+Otherwise, the declarations are parsed at import time and the libraries
+are loaded in the ABI mode upon first use.
 """
 from __future__ import unicode_literals
 
@@ -29,9 +34,25 @@ def _setup_cffi():
                     if self._lib is None:
                         self._lib = self._ffi.dlopen(self._libname)
 
-            return getattr(self._lib, name)
+            attr = getattr(self._lib, name)
+            # Subsequent lookups of the same name do not reach __getattr__.
+            setattr(self, name, attr)
+            return attr
 
     MODULES = ["libnvpair", "libzfs_core"]
+
+    try:
+        from ._cffi_api import ffi, lib
+    except ImportError:
+        pass
+    else:
+        for module_name in MODULES:
+            module = importlib.import_module("." + module_name, __package__)
+            setattr(module, "ffi", ffi)
+            setattr(module, "lib", lib)
+            setattr(module, "api_mode", True)
+        return
+
     ffi = FFI()
 
     for module_name in MODULES:
@@ -40,6 +61,7 @@ def _setup_cffi():
         lib = LazyLibrary(ffi, module.LIBRARY)
         setattr(module, "ffi", ffi)
         setattr(module, "lib", lib)
+        setattr(module, "api_mode", False)
 
 
 _setup_cffi()
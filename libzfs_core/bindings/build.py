@@ -0,0 +1,110 @@
+# Copyright 2015 ClusterHQ. See LICENSE file for details.
+
+"""
+CFFI builder for the optional API mode extension module.
+
+The extension module is compiled from the ``CDEF`` and ``SOURCE``
+attributes of the binding modules and it links directly against
+``libnvpair`` and ``libzfs_core``.  That avoids parsing the declarations
+at every import and calls no longer go through the generic ``libffi``
+dispatch.
+
+The module is built by ``setup.py`` as an optional extension: if the
+development headers are not installed or the build fails for any other
+reason, then the package is still installed and the bindings fall back
+to the ABI mode at run time.
+
+Besides the library functions the extension module contains helpers
+defined by the ``HELPERS_CDEF`` and ``HELPERS_SOURCE`` attributes of
+the binding modules.  The helpers are not available in the ABI mode.
+
+Some ``libzfs_core`` functions are uncommitted extensions that are not
+provided by every ZFS implementation.  A prototype for a function that
+is not declared by the installed headers is left out of the API mode
+declarations, so :func:`libzfs_core.is_supported` reports such a function
+as unavailable just like it does in the ABI mode.
+"""
+from __future__ import unicode_literals
+
+import glob
+import os
+import re
+import runpy
+
+from cffi import FFI
+
+MODULE_NAME = "libzfs_core.bindings._cffi_api"
+
+_BINDINGS_DIR = os.path.dirname(os.path.abspath(__file__))
+_MODULES = ["libnvpair", "libzfs_core"]
+_INCLUDE_ROOTS = ["/usr/include", "/usr/local/include"]
+_PROTOTYPE_RE = re.compile(r'^\s*[\w\s\*]*?\b(\w+)\s*\(.*\)\s*;\s*$')
+_IDENTIFIER_RE = re.compile(r'\b(\w+)\s*\(')
+
+
+def _include_dirs():
+    dirs = []
+    for root in _INCLUDE_ROOTS:
+        for subdir in ["libspl", "libzfs"]:
+            path = os.path.join(root, subdir)
+            if os.path.isdir(path):
+                dirs.append(path)
+    return dirs
+
+
+def _declared_functions(include_dirs):
+    declared = set()
+    for include_dir in include_dirs:
+        for pattern in ["*.h", os.path.join("sys", "*.h")]:
+            for header in glob.glob(os.path.join(include_dir, pattern)):
+                with open(header) as f:
+                    declared.update(_IDENTIFIER_RE.findall(f.read()))
+    return declared
+
+
+def _filter_cdef(cdef, declared):
+    # Without any headers the build is going to fail anyway,
+    # keep the declarations intact in that case.
+    if not declared:
+        return cdef
+    lines = []
+    for line in cdef.splitlines():
+        match = _PROTOTYPE_RE.match(line)
+        if match is not None and match.group(1) not in declared:
+            continue
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def _make_builder():
+    include_dirs = _include_dirs()
+    declared = _declared_functions(include_dirs)
+    builder = FFI()
+    sources = []
+    libraries = []
+    modules = [runpy.run_path(os.path.join(_BINDINGS_DIR, name + ".py"))
+               for name in _MODULES]
+    for module in modules:
+        builder.cdef(_filter_cdef(module["CDEF"], declared))
+        sources.append(module["SOURCE"])
+        libraries.append(module["LIBRARY"])
+    # The helpers use the library declarations, so they come last.
+    for module in modules:
+        builder.cdef(module.get("HELPERS_CDEF", ""))
+        sources.append(module.get("HELPERS_SOURCE", ""))
+    builder.set_source(
+        MODULE_NAME,
+        "\n".join(sources),
+        include_dirs=include_dirs,
+        libraries=libraries,
+        optional=True,
+    )
+    return builder
+
+
+ffibuilder = _make_builder()
+
+if __name__ == "__main__":
+    ffibuilder.compile(verbose=True)
+
+# vim: softtabstop=4 tabstop=4 expandtab shiftwidth=4
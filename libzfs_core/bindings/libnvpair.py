@@ -47,6 +47,8 @@ CDEF = """
     int nvlist_alloc(nvlist_t **, uint_t, int);
     void nvlist_free(nvlist_t *);
 
+    int nvlist_size(nvlist_t *, size_t *, int);
+    int nvlist_pack(nvlist_t *, char **, size_t *, int, int);
     int nvlist_unpack(char *, size_t, nvlist_t **, int);
 
     void dump_nvlist(nvlist_t *, int);
@@ -78,6 +80,10 @@ CDEF = """
     int nvlist_add_string_array(nvlist_t *, const char *, char *const *, uint_t);
     int nvlist_add_nvlist_array(nvlist_t *, const char *, nvlist_t **, uint_t);
 
+    int nvlist_remove_nvpair(nvlist_t *, nvpair_t *);
+    int nvlist_lookup_nvpair(nvlist_t *, const char *, nvpair_t **);
+    int nvlist_lookup_nvlist(nvlist_t *, const char *, nvlist_t **);
+    int nvlist_lookup_nvlist_array(nvlist_t *, const char *, nvlist_t ***, uint_t *);
     nvpair_t *nvlist_next_nvpair(nvlist_t *, nvpair_t *);
     nvpair_t *nvlist_prev_nvpair(nvlist_t *, nvpair_t *);
     char *nvpair_name(nvpair_t *);
@@ -111,8 +117,191 @@ CDEF = """
 
 SOURCE = """
 #include <libzfs/sys/nvpair.h>
+#include <libzfs/libnvpair.h>
 """
 
 LIBRARY = "nvpair"
 
+# The helpers are compiled into the API mode extension module only.
+# pyzfs_nvlist_flatten() walks an nvlist in a single native call and
+# describes every nvpair with a record.  A record for an embedded nvlist or
+# for an element of an nvlist array (the latter has no name) holds the number
+# of the nvpairs in the embedded nvlist and the records of those nvpairs
+# follow it immediately.  The function returns the total number of records
+# or -1 if the nvlist can not be described.  If the number is greater than
+# the size of the provided array, then only that many records are filled in.
+HELPERS_CDEF = """
+    typedef struct {
+        const char *name;
+        data_type_t type;
+        uint_t nelem;
+        int64_t i64;
+        uint64_t u64;
+        void *ptr;
+    } pyzfs_nvrec_t;
+
+    int pyzfs_nvlist_flatten(nvlist_t *, pyzfs_nvrec_t *, int);
+"""
+
+HELPERS_SOURCE = """
+typedef struct {
+    const char *name;
+    data_type_t type;
+    uint_t nelem;
+    int64_t i64;
+    uint64_t u64;
+    void *ptr;
+} pyzfs_nvrec_t;
+
+#define PYZFS_NV_MAX_DEPTH 64
+
+#define PYZFS_SCALAR(func, ctype, field)                \
+    {                                                   \
+        ctype v;                                        \
+        if (func(pair, &v) != 0)                        \
+            return (-1);                                \
+        rec->field = v;                                 \
+        break;                                          \
+    }
+
+#define PYZFS_ARRAY(func, ctype)                        \
+    {                                                   \
+        ctype *v;                                       \
+        uint_t n;                                       \
+        if (func(pair, &v, &n) != 0)                    \
+            return (-1);                                \
+        rec->ptr = (void *)v;                           \
+        rec->nelem = n;                                 \
+        break;                                          \
+    }
+
+static void
+pyzfs_nvrec_init(pyzfs_nvrec_t *rec, const char *name, data_type_t type)
+{
+    rec->name = name;
+    rec->type = type;
+    rec->nelem = 0;
+    rec->i64 = 0;
+    rec->u64 = 0;
+    rec->ptr = NULL;
+}
+
+static int
+pyzfs_flatten(nvlist_t *nvl, pyzfs_nvrec_t *recs, int maxrecs, int *count,
+    int depth)
+{
+    nvpair_t *pair;
+    pyzfs_nvrec_t scratch;
+    int npairs = 0;
+
+    if (depth > PYZFS_NV_MAX_DEPTH)
+        return (-1);
+
+    for (pair = nvlist_next_nvpair(nvl, NULL); pair != NULL;
+        pair = nvlist_next_nvpair(nvl, pair)) {
+        int idx = (*count)++;
+        pyzfs_nvrec_t *rec = idx < maxrecs ? &recs[idx] : &scratch;
+
+        pyzfs_nvrec_init(rec, nvpair_name(pair), nvpair_type(pair));
+        npairs++;
+
+        switch (rec->type) {
+        case DATA_TYPE_BOOLEAN:
+            break;
+        case DATA_TYPE_BOOLEAN_VALUE:
+            PYZFS_SCALAR(nvpair_value_boolean_value, boolean_t, u64)
+        case DATA_TYPE_BYTE:
+            PYZFS_SCALAR(nvpair_value_byte, uchar_t, u64)
+        case DATA_TYPE_INT8:
+            PYZFS_SCALAR(nvpair_value_int8, int8_t, i64)
+        case DATA_TYPE_UINT8:
+            PYZFS_SCALAR(nvpair_value_uint8, uint8_t, u64)
+        case DATA_TYPE_INT16:
+            PYZFS_SCALAR(nvpair_value_int16, int16_t, i64)
+        case DATA_TYPE_UINT16:
+            PYZFS_SCALAR(nvpair_value_uint16, uint16_t, u64)
+        case DATA_TYPE_INT32:
+            PYZFS_SCALAR(nvpair_value_int32, int32_t, i64)
+        case DATA_TYPE_UINT32:
+            PYZFS_SCALAR(nvpair_value_uint32, uint32_t, u64)
+        case DATA_TYPE_INT64:
+            PYZFS_SCALAR(nvpair_value_int64, int64_t, i64)
+        case DATA_TYPE_UINT64:
+            PYZFS_SCALAR(nvpair_value_uint64, uint64_t, u64)
+        case DATA_TYPE_STRING:
+            PYZFS_SCALAR(nvpair_value_string, char *, ptr)
+        case DATA_TYPE_BOOLEAN_ARRAY:
+            PYZFS_ARRAY(nvpair_value_boolean_array, boolean_t)
+        case DATA_TYPE_BYTE_ARRAY:
+            PYZFS_ARRAY(nvpair_value_byte_array, uchar_t)
+        case DATA_TYPE_INT8_ARRAY:
+            PYZFS_ARRAY(nvpair_value_int8_array, int8_t)
+        case DATA_TYPE_UINT8_ARRAY:
+            PYZFS_ARRAY(nvpair_value_uint8_array, uint8_t)
+        case DATA_TYPE_INT16_ARRAY:
+            PYZFS_ARRAY(nvpair_value_int16_array, int16_t)
+        case DATA_TYPE_UINT16_ARRAY:
+            PYZFS_ARRAY(nvpair_value_uint16_array, uint16_t)
+        case DATA_TYPE_INT32_ARRAY:
+            PYZFS_ARRAY(nvpair_value_int32_array, int32_t)
+        case DATA_TYPE_UINT32_ARRAY:
+            PYZFS_ARRAY(nvpair_value_uint32_array, uint32_t)
+        case DATA_TYPE_INT64_ARRAY:
+            PYZFS_ARRAY(nvpair_value_int64_array, int64_t)
+        case DATA_TYPE_UINT64_ARRAY:
+            PYZFS_ARRAY(nvpair_value_uint64_array, uint64_t)
+        case DATA_TYPE_STRING_ARRAY:
+            PYZFS_ARRAY(nvpair_value_string_array, char *)
+        case DATA_TYPE_NVLIST: {
+            nvlist_t *child;
+            int n;
+
+            if (nvpair_value_nvlist(pair, &child) != 0)
+                return (-1);
+            n = pyzfs_flatten(child, recs, maxrecs, count, depth + 1);
+            if (n < 0)
+                return (-1);
+            rec->nelem = n;
+            break;
+        }
+        case DATA_TYPE_NVLIST_ARRAY: {
+            nvlist_t **children;
+            uint_t n, i;
+
+            if (nvpair_value_nvlist_array(pair, &children, &n) != 0)
+                return (-1);
+            rec->nelem = n;
+            for (i = 0; i < n; i++) {
+                int eidx = (*count)++;
+                pyzfs_nvrec_t *elem =
+                    eidx < maxrecs ? &recs[eidx] : &scratch;
+                int m;
+
+                m = pyzfs_flatten(children[i], recs, maxrecs, count,
+                    depth + 1);
+                if (m < 0)
+                    return (-1);
+                pyzfs_nvrec_init(elem, NULL, DATA_TYPE_NVLIST);
+                elem->nelem = m;
+            }
+            break;
+        }
+        default:
+            return (-1);
+        }
+    }
+    return (npairs);
+}
+
+static int
+pyzfs_nvlist_flatten(nvlist_t *nvl, pyzfs_nvrec_t *recs, int maxrecs)
+{
+    int count = 0;
+
+    if (pyzfs_flatten(nvl, recs, maxrecs, &count, 0) < 0)
+        return (-1);
+    return (count);
+}
+"""
+
 # vim: softtabstop=4 tabstop=4 expandtab shiftwidth=4
@@ -0,0 +1,28 @@
+# Copyright 2015 ClusterHQ. See LICENSE file for details.
+
+"""
+The coroutines used by the asyncio interface tests.
+
+They are kept apart from :mod:`test_aio`, which has to be importable
+by Python 2.
+"""
+from __future__ import unicode_literals
+
+import asyncio
+
+from .. import aio
+
+
+def collect(name):
+    async def _collect():
+        return [x async for x in aio._list(name)]
+    return asyncio.run(_collect())
+
+
+def run_many(func, count):
+    async def _many():
+        return await asyncio.gather(*[aio._run(func) for _ in range(count)])
+    return asyncio.run(_many())
+
+
+# vim: softtabstop=4 tabstop=4 expandtab shiftwidth=4
@@ -0,0 +1,103 @@
+# Copyright 2015 ClusterHQ. See LICENSE file for details.
+
+"""
+Tests for the asyncio interface.
+
+The listing tests replace ``lzc_list`` with a function that returns
+a pipe with a prepared record stream, so they do not need ZFS.
+"""
+from __future__ import unicode_literals
+
+import errno
+import os
+import struct
+import sys
+import threading
+import time
+import unittest
+
+from .. import _libzfs_core as lzc
+from .. import exceptions as lzc_exc
+
+if sys.version_info >= (3, 7):
+    import concurrent.futures
+    from .. import aio
+    from . import _aio_helpers
+
+
+def _record(payload, err=0):
+    return struct.pack(lzc._PIPE_RECORD_FORMAT, len(payload), 0, err, 0, 0) + payload
+
+
+@unittest.skipIf(sys.version_info < (3, 7), 'requires Python 3.7')
+class AioTest(unittest.TestCase):
+
+    def setUp(self):
+        self._orig_lzc_list = lzc.lzc_list
+
+    def tearDown(self):
+        lzc.lzc_list = self._orig_lzc_list
+        aio.set_executor(None)
+
+    def _fake_list(self, data):
+        fds = []
+
+        def _lzc_list(name, options):
+            (rfd, wfd) = os.pipe()
+            os.write(wfd, data)
+            fds.extend([rfd, wfd])
+            return (rfd, wfd)
+
+        lzc.lzc_list = _lzc_list
+        return fds
+
+    def _assertClosed(self, fds):
+        self.assertEqual(len(fds), 2)
+        for fd in fds:
+            with self.assertRaises(OSError):
+                os.fstat(fd)
+
+    def _collect(self):
+        return _aio_helpers.collect(b'pool/fs')
+
+    def test_list_empty(self):
+        fds = self._fake_list(_record(b''))
+        self.assertEqual(self._collect(), [])
+        self._assertClosed(fds)
+
+    def test_list_not_found(self):
+        fds = self._fake_list(_record(b'', errno.ESRCH))
+        self.assertEqual(self._collect(), [])
+        self._assertClosed(fds)
+
+    def test_list_error(self):
+        fds = self._fake_list(_record(b'', errno.ENOENT))
+        with self.assertRaises(lzc_exc.DatasetNotFound):
+            self._collect()
+        self._assertClosed(fds)
+
+    def test_list_bad_payload(self):
+        fds = self._fake_list(_record(b'\xff' * 16) + _record(b''))
+        with self.assertRaises(lzc_exc.ZFSGenericError):
+            self._collect()
+        self._assertClosed(fds)
+
+    def test_executor_is_bounded(self):
+        aio.set_executor(concurrent.futures.ThreadPoolExecutor(2))
+        lock = threading.Lock()
+        state = {'running': 0, 'max': 0}
+
+        def _op():
+            with lock:
+                state['running'] += 1
+                state['max'] = max(state['max'], state['running'])
+            time.sleep(0.05)
+            with lock:
+                state['running'] -= 1
+            return True
+
+        self.assertEqual(_aio_helpers.run_many(_op, 6), [True] * 6)
+        self.assertEqual(state['max'], 2)
+
+
+# vim: softtabstop=4 tabstop=4 expandtab shiftwidth=4
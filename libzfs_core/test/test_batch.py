@@ -0,0 +1,216 @@
+# Copyright 2015 ClusterHQ. See LICENSE file for details.
+
+"""
+Tests for the coalescing of the snapshot, hold and bookmark requests.
+
+The library functions are replaced with fakes that record the calls,
+so the tests do not need a ZFS pool.
+"""
+from __future__ import unicode_literals
+
+import threading
+import unittest
+
+from .. import _libzfs_core as lzc
+from .. import exceptions as lzc_exc
+from .._batch import Batcher
+
+
+class _FakeOps(object):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = []
+        self.existing = set()
+        self.failing = {}
+
+    def lzc_snapshot(self, snaps, props=None):
+        with self._lock:
+            self.calls.append(('snapshot', sorted(snaps), props))
+        errs = [self.failing[s] for s in snaps if s in self.failing]
+        if errs:
+            raise lzc_exc.SnapshotFailure(errs, 0)
+
+    def lzc_hold(self, holds, fd=None):
+        with self._lock:
+            self.calls.append(('hold', sorted(holds.items()), fd))
+        errs = [self.failing[s] for s in holds if s in self.failing]
+        if errs:
+            raise lzc_exc.HoldFailure(errs, 0)
+        return [s for s in holds if s not in self.existing]
+
+    def lzc_bookmark(self, bookmarks):
+        with self._lock:
+            self.calls.append(('bookmark', sorted(bookmarks.items()), None))
+        errs = [self.failing[b] for b in list(bookmarks) + list(bookmarks.values())
+                if b in self.failing]
+        if errs:
+            raise lzc_exc.BookmarkFailure(errs, 0)
+
+
+class BatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.ops = _FakeOps()
+        self._saved = {}
+        for name in ['lzc_snapshot', 'lzc_hold', 'lzc_bookmark']:
+            self._saved[name] = getattr(lzc, name)
+            setattr(lzc, name, getattr(self.ops, name))
+
+    def tearDown(self):
+        for name, func in self._saved.items():
+            setattr(lzc, name, func)
+
+    def test_snapshots_coalesced_per_pool(self):
+        with Batcher(window=0.05) as batcher:
+            futures = [batcher.snapshot(b'pool%d/fs%d@snap' % (i % 2, i)) for i in range(6)]
+        for f in futures:
+            self.assertIsNone(f.result(5))
+        self.assertEqual(len(self.ops.calls), 2)
+        self.assertEqual(sorted(c[1] for c in self.ops.calls), [
+            [b'pool0/fs0@snap', b'pool0/fs2@snap', b'pool0/fs4@snap'],
+            [b'pool1/fs1@snap', b'pool1/fs3@snap', b'pool1/fs5@snap'],
+        ])
+
+    def test_concurrent_submitters(self):
+        batcher = Batcher(window=0.2)
+        futures = []
+        lock = threading.Lock()
+
+        def _submit(i):
+            f = batcher.snapshot(b'pool/fs%d@snap' % i)
+            with lock:
+                futures.append(f)
+
+        threads = [threading.Thread(target=_submit, args=(i,)) for i in range(20)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        for f in futures:
+            f.result(5)
+        batcher.close()
+        self.assertEqual(len(self.ops.calls), 1)
+        self.assertEqual(len(self.ops.calls[0][1]), 20)
+
+    def test_window_expires(self):
+        batcher = Batcher(window=0.01)
+        try:
+            batcher.snapshot(b'pool/fs@snap1').result(5)
+            batcher.snapshot(b'pool/fs@snap2').result(5)
+        finally:
+            batcher.close()
+        self.assertEqual(len(self.ops.calls), 2)
+
+    def test_different_props_not_coalesced(self):
+        with Batcher(window=0.05) as batcher:
+            f1 = batcher.snapshot(b'pool/fs1@snap', {b'user:a': b'1'})
+            f2 = batcher.snapshot(b'pool/fs2@snap', {b'user:a': b'2'})
+            f3 = batcher.snapshot(b'pool/fs3@snap', {b'user:a': b'1'})
+        for f in (f1, f2, f3):
+            f.result(5)
+        self.assertEqual(sorted((c[1], c[2]) for c in self.ops.calls), [
+            ([b'pool/fs1@snap', b'pool/fs3@snap'], {b'user:a': b'1'}),
+            ([b'pool/fs2@snap'], {b'user:a': b'2'}),
+        ])
+
+    def test_max_batch(self):
+        with Batcher(window=10, max_batch=3) as batcher:
+            futures = [batcher.snapshot(b'pool/fs%d@snap' % i) for i in range(3)]
+            for f in futures:
+                f.result(5)
+            self.assertEqual(len(self.ops.calls), 1)
+
+    def test_duplicate_goes_to_next_batch(self):
+        with Batcher(window=0.05) as batcher:
+            f1 = batcher.hold(b'pool/fs@snap', b'tag1')
+            f2 = batcher.hold(b'pool/fs@snap', b'tag2')
+        f1.result(5)
+        f2.result(5)
+        self.assertEqual(sorted(c[1] for c in self.ops.calls), [
+            [(b'pool/fs@snap', b'tag1')],
+            [(b'pool/fs@snap', b'tag2')],
+        ])
+
+    def test_failure_routed_and_rest_retried(self):
+        bad = b'pool/bad@snap'
+        self.ops.failing[bad] = lzc_exc.SnapshotExists(bad)
+        with Batcher(window=0.05) as batcher:
+            good = [batcher.snapshot(b'pool/fs%d@snap' % i) for i in range(3)]
+            failed = batcher.snapshot(bad)
+        for f in good:
+            self.assertIsNone(f.result(5))
+        with self.assertRaises(lzc_exc.SnapshotFailure) as ctx:
+            failed.result(5)
+        self.assertEqual(len(ctx.exception.errors), 1)
+        self.assertIsInstance(ctx.exception.errors[0], lzc_exc.SnapshotExists)
+        self.assertEqual(len(self.ops.calls), 2)
+        self.assertNotIn(bad, self.ops.calls[1][1])
+
+    def test_unattributed_failure_bisected(self):
+        self.ops.failing[b'pool/fs2@snap'] = lzc_exc.ZFSError('general')
+        with Batcher(window=0.05) as batcher:
+            futures = [batcher.snapshot(b'pool/fs%d@snap' % i) for i in range(4)]
+        with self.assertRaises(lzc_exc.SnapshotFailure):
+            futures[2].result(5)
+        for i in (0, 1, 3):
+            self.assertIsNone(futures[i].result(5))
+        # The whole batch, its halves and the quarters of the failed half.
+        self.assertEqual(len(self.ops.calls), 5)
+
+    def test_hold_missing_snapshots(self):
+        self.ops.existing.add(b'pool/fs@snap1')
+        with Batcher(window=0.05) as batcher:
+            f1 = batcher.hold(b'pool/fs@snap1', b'tag')
+            f2 = batcher.hold(b'pool/fs@snap2', b'tag')
+        self.assertEqual(f1.result(5), [])
+        self.assertEqual(f2.result(5), [b'pool/fs@snap2'])
+        self.assertEqual(len(self.ops.calls), 1)
+
+    def test_bookmark_failure_by_snapshot(self):
+        snap = b'pool/fs@missing'
+        self.ops.failing[snap] = lzc_exc.SnapshotNotFound(snap)
+        with Batcher(window=0.05) as batcher:
+            ok = batcher.bookmark(b'pool/fs#ok', b'pool/fs@snap')
+            failed = batcher.bookmark(b'pool/fs#bad', snap)
+        self.assertIsNone(ok.result(5))
+        with self.assertRaises(lzc_exc.BookmarkFailure):
+            failed.result(5)
+
+    def test_other_exception(self):
+        def _broken(snaps, props=None):
+            raise lzc_exc.ZFSInitializationFailed(1)
+
+        lzc.lzc_snapshot = _broken
+        with Batcher(window=0.01) as batcher:
+            f = batcher.snapshot(b'pool/fs@snap')
+        with self.assertRaises(lzc_exc.ZFSInitializationFailed):
+            f.result(5)
+
+    def test_unexpected_exception(self):
+        def _broken(snaps, props=None):
+            raise RuntimeError('broken')
+
+        lzc.lzc_snapshot = _broken
+        with Batcher(window=0.01) as batcher:
+            futures = [batcher.snapshot(b'pool/fs%d@snap' % i) for i in range(3)]
+        for f in futures:
+            with self.assertRaises(RuntimeError):
+                f.result(5)
+
+    def test_invalid_bookmark_value(self):
+        with Batcher(window=0.01) as batcher:
+            ok = batcher.bookmark(b'pool/fs#ok', b'pool/fs@snap')
+            bad = batcher.bookmark(b'pool/fs#bad', 42)
+        for f in (ok, bad):
+            with self.assertRaises(AttributeError):
+                f.result(5)
+
+    def test_closed(self):
+        batcher = Batcher()
+        batcher.close()
+        with self.assertRaises(ValueError):
+            batcher.snapshot(b'pool/fs@snap')
+
+
+# vim: softtabstop=4 tabstop=4 expandtab shiftwidth=4
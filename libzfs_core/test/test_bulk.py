@@ -0,0 +1,251 @@
+# Copyright 2015 ClusterHQ. See LICENSE file for details.
+
+"""
+Tests for the pool partitioning and chunking of the multi-entity operations.
+
+The library functions are replaced with fakes that record the calls,
+so the tests do not need a ZFS pool.
+"""
+from __future__ import unicode_literals
+
+import threading
+import unittest
+
+from .. import _bulk
+from .. import _libzfs_core as lzc
+from .. import exceptions as lzc_exc
+
+
+class _Recorder(object):
+
+    def __init__(self, fail=None, missing=()):
+        self._lock = threading.Lock()
+        self._fail = fail or {}
+        self._missing = set(missing)
+        self.calls = []
+
+    def _record(self, names):
+        names = list(names)
+        pools = set(n.split(b'/')[0].split(b'@')[0].split(b'#')[0] for n in names)
+        assert len(pools) == 1
+        with self._lock:
+            self.calls.append(names)
+        return names
+
+    def destroy_snaps(self, snaps, defer):
+        names = self._record(snaps)
+        errs = [self._fail[n] for n in names if n in self._fail]
+        if errs:
+            raise lzc_exc.SnapshotDestructionFailure(errs, 1)
+
+    def hold(self, holds, fd=None):
+        names = self._record(holds)
+        return [n for n in names if n in self._missing]
+
+
+class BulkTest(unittest.TestCase):
+
+    def setUp(self):
+        self._saved = {}
+
+    def _patch(self, name, func):
+        self._saved[name] = getattr(lzc, name)
+        setattr(lzc, name, func)
+
+    def tearDown(self):
+        for name, func in self._saved.items():
+            setattr(lzc, name, func)
+
+    def test_empty(self):
+        recorder = _Recorder()
+        self._patch('lzc_destroy_snaps', recorder.destroy_snaps)
+        self.assertEqual(_bulk.bulk_destroy_snaps([], False), [])
+        self.assertEqual(recorder.calls, [])
+
+    def test_partition_by_pool(self):
+        recorder = _Recorder()
+        self._patch('lzc_destroy_snaps', recorder.destroy_snaps)
+        snaps = [b'pool%d/fs@snap%d' % (i % 3, i) for i in range(12)]
+        _bulk.bulk_destroy_snaps(snaps, False)
+        self.assertEqual(len(recorder.calls), 3)
+        self.assertEqual(sorted(sum(recorder.calls, [])), sorted(snaps))
+
+    def test_chunk_by_count(self):
+        recorder = _Recorder()
+        self._patch('lzc_destroy_snaps', recorder.destroy_snaps)
+        snaps = [b'pool/fs@snap%d' % i for i in range(10)]
+        _bulk.bulk_destroy_snaps(snaps, False, max_entries=4)
+        self.assertEqual([len(c) for c in recorder.calls], [4, 4, 2])
+        self.assertEqual(sum(recorder.calls, []), snaps)
+
+    def test_chunk_by_size(self):
+        snaps = [b'pool/fs@' + b'x' * 100 + b'%d' % i for i in range(10)]
+        size = _bulk._packed_size(snaps[0], None)
+        chunks = _bulk._chunks(snaps, None, 1000, _bulk._NVLIST_HEADER_SIZE + 3 * size)
+        self.assertEqual([len(c) for c in chunks], [3, 3, 3, 1])
+
+    def test_oversized_entry(self):
+        chunks = _bulk._chunks([b'pool/fs@a', b'pool/fs@b'], None, 1000, 1)
+        self.assertEqual(chunks, [[b'pool/fs@a'], [b'pool/fs@b']])
+
+    def test_value_size(self):
+        small = _bulk._packed_size(b'pool/fs@snap', [b'tag'])
+        large = _bulk._packed_size(b'pool/fs@snap', [b'tag1', b'tag2'])
+        self.assertGreater(large, small)
+
+    def test_merged_failure(self):
+        bad1 = b'pool1/fs@snap'
+        bad2 = b'pool2/fs@snap'
+        recorder = _Recorder(fail={
+            bad1: lzc_exc.SnapshotIsHeld(bad1),
+            bad2: lzc_exc.SnapshotIsHeld(bad2),
+        })
+        self._patch('lzc_destroy_snaps', recorder.destroy_snaps)
+        snaps = [b'pool0/fs@snap', bad1, bad2]
+        with self.assertRaises(lzc_exc.SnapshotDestructionFailure) as ctx:
+            _bulk.bulk_destroy_snaps(snaps, False)
+        self.assertEqual(sorted(e.name for e in ctx.exception.errors), [bad1, bad2])
+        self.assertEqual(ctx.exception.suppressed_count, 2)
+        self.assertEqual(len(recorder.calls), 3)
+
+    def test_generic_error_merged(self):
+        def _fail(snaps, defer):
+            if snaps[0].startswith(b'pool1'):
+                raise lzc_exc.ZFSInitializationFailed(1)
+
+        self._patch('lzc_destroy_snaps', _fail)
+        with self.assertRaises(lzc_exc.SnapshotDestructionFailure) as ctx:
+            _bulk.bulk_destroy_snaps([b'pool0/fs@snap', b'pool1/fs@snap'], False)
+        self.assertEqual(len(ctx.exception.errors), 1)
+        self.assertIsInstance(ctx.exception.errors[0], lzc_exc.ZFSInitializationFailed)
+
+    def test_programming_error_propagated(self):
+        def _broken(snaps, defer):
+            raise TypeError('broken')
+
+        self._patch('lzc_destroy_snaps', _broken)
+        with self.assertRaises(TypeError):
+            _bulk.bulk_destroy_snaps([b'pool0/fs@snap', b'pool1/fs@snap'], False)
+
+    def test_hold_missing_merged(self):
+        missing = [b'pool0/fs@gone', b'pool1/fs@gone']
+        recorder = _Recorder(missing=missing)
+        self._patch('lzc_hold', recorder.hold)
+        holds = dict((b'pool%d/fs@snap%d' % (i % 2, i), b'tag') for i in range(6))
+        holds.update((m, b'tag') for m in missing)
+        result = _bulk.bulk_hold(holds, max_entries=2)
+        self.assertEqual(sorted(result), missing)
+        self.assertEqual(sorted(sum(recorder.calls, [])), sorted(holds))
+
+
+class BestEffortTest(unittest.TestCase):
+
+    def _snapshot(self, bad, named=True):
+        calls = []
+
+        def _call(snaps):
+            calls.append(list(snaps))
+            errs = [lzc_exc.SnapshotExists(s if named else None) for s in snaps if s in bad]
+            if errs:
+                raise lzc_exc.SnapshotFailure(errs, 0)
+        return (_call, calls)
+
+    def test_named_errors_dropped(self):
+        snaps = [b'pool/fs@snap%d' % i for i in range(100)]
+        bad = set(snaps[10:13])
+        (call, calls) = self._snapshot(bad)
+        (result, failed, suppressed) = _bulk._best_effort(call, snaps)
+        self.assertEqual(set(failed), bad)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(calls[1], [s for s in snaps if s not in bad])
+
+    def test_unnamed_errors_bisected(self):
+        snaps = [b'pool/fs@snap%d' % i for i in range(1024)]
+        bad = set([snaps[5], snaps[700]])
+        (call, calls) = self._snapshot(bad, named=False)
+        (result, failed, suppressed) = _bulk._best_effort(call, snaps)
+        self.assertEqual(set(failed), bad)
+        self.assertLessEqual(len(calls), 2 * 2 * 10 + 1)
+        succeeded = set(sum([c for c in calls if not bad.intersection(c)], []))
+        self.assertEqual(succeeded, set(snaps) - bad)
+
+    def test_aliases(self):
+        def _call(bookmarks):
+            if b'pool/fs#b2' in bookmarks:
+                raise lzc_exc.BookmarkFailure([lzc_exc.SnapshotNotFound(b'pool/fs@gone')], 0)
+
+        (result, failed, suppressed) = _bulk._best_effort(
+            _call, [b'pool/fs#b1', b'pool/fs#b2'], {b'pool/fs@gone': [b'pool/fs#b2']})
+        self.assertEqual(list(failed), [b'pool/fs#b2'])
+
+    def test_generic_error_not_retried(self):
+        calls = []
+
+        def _call(snaps):
+            calls.append(snaps)
+            raise lzc_exc.ZFSInitializationFailed(1)
+
+        (result, failed, suppressed) = _bulk._best_effort(_call, [b'pool/fs@a', b'pool/fs@b'])
+        self.assertEqual(len(calls), 1)
+        self.assertIsInstance(failed[b'pool/fs@a'], lzc_exc.ZFSInitializationFailed)
+
+    def _suppressing(self, bad, extra):
+        def _call(snaps, props=None):
+            errs = [lzc_exc.SnapshotExists(s) for s in snaps if s in bad]
+            if errs:
+                # Only the first error is reported.
+                raise lzc_exc.SnapshotFailure(errs[:1], len(errs) - 1 + extra)
+        return _call
+
+    def test_suppressed_errors_found_again(self):
+        snaps = [b'pool/fs@snap%d' % i for i in range(8)]
+        bad = set(snaps[1:4])
+        (result, failed, suppressed) = _bulk._best_effort(self._suppressing(bad, 0), snaps)
+        self.assertEqual(set(failed), bad)
+        self.assertEqual(suppressed, 0)
+
+    def test_suppressed_errors_counted(self):
+        snaps = [b'pool/fs@snap%d' % i for i in range(8)]
+        bad = set(snaps[1:4])
+        (result, failed, suppressed) = _bulk._best_effort(self._suppressing(bad, 2), snaps)
+        self.assertEqual(set(failed), bad)
+        self.assertEqual(suppressed, 2)
+        (result, failed, suppressed) = _bulk._best_effort(
+            self._suppressing(bad, 2), sorted(bad))
+        self.assertEqual(suppressed, 2)
+
+    def test_bulk_snapshot_best_effort_suppressed(self):
+        bad = set([b'pool0/fs@bad', b'pool1/fs@bad'])
+        saved = lzc.lzc_snapshot
+        lzc.lzc_snapshot = self._suppressing(bad, 3)
+        try:
+            with self.assertRaises(lzc_exc.SnapshotFailure) as ctx:
+                _bulk.bulk_snapshot([b'pool0/fs@a', b'pool1/fs@a'] + sorted(bad),
+                                    best_effort=True)
+        finally:
+            lzc.lzc_snapshot = saved
+        self.assertEqual(sorted(e.name for e in ctx.exception.errors), sorted(bad))
+        self.assertEqual(ctx.exception.suppressed_count, 6)
+
+    def test_programming_error_propagated(self):
+        def _call(snaps):
+            raise AttributeError('broken')
+
+        with self.assertRaises(AttributeError):
+            _bulk._best_effort(_call, [b'pool/fs@a', b'pool/fs@b'])
+
+    def test_bulk_snapshot_best_effort(self):
+        bad = b'pool0/fs@bad'
+        (call, calls) = self._snapshot(set([bad]))
+        saved = lzc.lzc_snapshot
+        lzc.lzc_snapshot = lambda snaps, props=None: call(snaps)
+        try:
+            with self.assertRaises(lzc_exc.SnapshotFailure) as ctx:
+                _bulk.bulk_snapshot([b'pool0/fs@a', bad, b'pool1/fs@a'], best_effort=True)
+        finally:
+            lzc.lzc_snapshot = saved
+        self.assertEqual([e.name for e in ctx.exception.errors], [bad])
+        self.assertIn([b'pool0/fs@a'], calls)
+
+
+# vim: softtabstop=4 tabstop=4 expandtab shiftwidth=4
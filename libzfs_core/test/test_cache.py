@@ -0,0 +1,275 @@
+# Copyright 2015 ClusterHQ. See LICENSE file for details.
+
+"""
+Tests for the caching of the dataset information.
+
+The functions that query the kernel are replaced with fakes,
+so the tests do not need a ZFS pool.
+"""
+from __future__ import unicode_literals
+
+import unittest
+
+from .. import _cache
+from .. import _libzfs_core as lzc
+
+
+class _FakeClock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class _FakeLib(object):
+
+    DMU_OST_ZFS = 2
+
+    def __init__(self, existing=()):
+        self.existing = set(existing)
+        self.exists_calls = 0
+
+    def lzc_list(self, *args):
+        raise AssertionError('not expected to be called')
+
+    def lzc_set_props(self, *args):
+        return 0
+
+    def lzc_exists(self, name):
+        self.exists_calls += 1
+        return name in self.existing
+
+    def lzc_create(self, name, ds_type, props):
+        self.existing.add(name)
+        return 0
+
+    def lzc_rename(self, source, target, *args):
+        self.existing = set(target + n[len(source):] if n.startswith(source) else n
+                            for n in self.existing)
+        return 0
+
+
+class CacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self._saved_clock = _cache._clock
+        self.clock = _FakeClock()
+        _cache._clock = self.clock
+
+    def tearDown(self):
+        _cache._clock = self._saved_clock
+
+    def _lookup(self, cache, key):
+        return cache.lookup(key)[0]
+
+    def test_hit_and_miss(self):
+        cache = _cache._Cache(10, 5)
+        (value, generation) = cache.lookup(b'pool/fs')
+        self.assertIs(value, _cache._MISSING)
+        cache.store(b'pool/fs', 1, generation)
+        self.assertEqual(self._lookup(cache, b'pool/fs'), 1)
+        self.assertEqual(cache.stats(), _cache.CacheStats(1, 1, 0, 0, 1))
+
+    def test_expiration(self):
+        cache = _cache._Cache(10, 5)
+        cache.store(b'pool/fs', 1, 0)
+        self.clock.now += 4
+        self.assertEqual(self._lookup(cache, b'pool/fs'), 1)
+        self.clock.now += 2
+        self.assertIs(self._lookup(cache, b'pool/fs'), _cache._MISSING)
+        self.assertEqual(cache.stats().size, 0)
+
+    def test_lru_eviction(self):
+        cache = _cache._Cache(2, 5)
+        cache.store(b'pool/a', 1, 0)
+        cache.store(b'pool/b', 2, 0)
+        self._lookup(cache, b'pool/a')
+        cache.store(b'pool/c', 3, 0)
+        self.assertEqual(self._lookup(cache, b'pool/a'), 1)
+        self.assertIs(self._lookup(cache, b'pool/b'), _cache._MISSING)
+        self.assertEqual(cache.stats().evictions, 1)
+
+    def test_invalidate_descendants(self):
+        cache = _cache._Cache(10, 5)
+        names = [b'pool/fs', b'pool/fs/child', b'pool/fs@snap', b'pool/fs#bmark',
+                 b'pool/fs2', b'pool/other', b'pool']
+        for name in names:
+            cache.store(name, 1, 0)
+        cache.invalidate([b'pool/fs'])
+        remaining = [n for n in names if self._lookup(cache, n) is not _cache._MISSING]
+        self.assertEqual(remaining, [b'pool/fs2', b'pool/other', b'pool'])
+        self.assertEqual(cache.stats().invalidations, 4)
+
+    def test_invalidate_str_names(self):
+        cache = _cache._Cache(10, 5)
+        cache.store('pool/fs/child', 1, 0)
+        cache.invalidate(['pool/fs'])
+        self.assertIs(self._lookup(cache, 'pool/fs/child'), _cache._MISSING)
+
+    def test_stale_store_rejected(self):
+        cache = _cache._Cache(10, 5)
+        (_, generation) = cache.lookup(b'pool/fs')
+        cache.invalidate([b'pool/other'])
+        cache.store(b'pool/fs', 1, generation)
+        self.assertIs(self._lookup(cache, b'pool/fs'), _cache._MISSING)
+
+    def test_invalid_limits(self):
+        with self.assertRaises(ValueError):
+            _cache._Cache(0, 5)
+        with self.assertRaises(ValueError):
+            _cache._Cache(10, 0)
+
+
+class PropsCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+        self._saved = lzc._get_props
+
+        def _get_props(name):
+            self.calls.append(name)
+            return {'name': name, 'clones': []}
+
+        lzc._get_props = _get_props
+        self._saved_lib = lzc._lib
+        lzc._lib = _FakeLib()
+
+    def tearDown(self):
+        lzc._get_props = self._saved
+        lzc._lib = self._saved_lib
+        _cache.disable_props_cache()
+
+    def test_disabled_by_default(self):
+        lzc.lzc_get_props(b'pool/fs')
+        lzc.lzc_get_props(b'pool/fs')
+        self.assertEqual(len(self.calls), 2)
+        self.assertIsNone(_cache.props_cache_stats())
+
+    def test_cached(self):
+        _cache.enable_props_cache()
+        self.assertEqual(lzc.lzc_get_props(b'pool/fs')['name'], b'pool/fs')
+        self.assertEqual(lzc.lzc_get_props(b'pool/fs')['name'], b'pool/fs')
+        self.assertEqual(self.calls, [b'pool/fs'])
+        stats = _cache.props_cache_stats()
+        self.assertEqual((stats.hits, stats.misses, stats.size), (1, 1, 1))
+
+    def test_result_copied(self):
+        _cache.enable_props_cache()
+        lzc.lzc_get_props(b'pool/fs')['clones'].append(b'junk')
+        self.assertEqual(lzc.lzc_get_props(b'pool/fs')['clones'], [])
+
+    def test_invalidated_by_set_prop(self):
+        _cache.enable_props_cache()
+        lzc.lzc_get_props(b'pool/fs/child')
+        lzc.lzc_set_props(b'pool/fs', b'user:foo', b'bar')
+        lzc.lzc_get_props(b'pool/fs/child')
+        self.assertEqual(len(self.calls), 2)
+
+    def test_disable(self):
+        _cache.enable_props_cache()
+        lzc.lzc_get_props(b'pool/fs')
+        _cache.disable_props_cache()
+        lzc.lzc_get_props(b'pool/fs')
+        self.assertEqual(len(self.calls), 2)
+
+
+class ExistsCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self._saved_lib = lzc._lib
+        self.lib = _FakeLib([b'pool', b'pool/fs', b'pool/fs@snap'])
+        lzc._lib = self.lib
+        self._saved_list = lzc._list
+        _cache.enable_exists_cache(ttl=60)
+
+    def tearDown(self):
+        lzc._lib = self._saved_lib
+        lzc._list = self._saved_list
+        _cache.disable_exists_cache()
+
+    def test_positive_and_negative(self):
+        for _ in range(3):
+            self.assertTrue(lzc.lzc_exists(b'pool/fs'))
+            self.assertFalse(lzc.lzc_exists(b'pool/other'))
+        self.assertEqual(self.lib.exists_calls, 2)
+        stats = _cache.exists_cache_stats()
+        self.assertEqual((stats.hits, stats.misses, stats.size), (4, 2, 2))
+
+    def test_updated_by_create(self):
+        self.assertFalse(lzc.lzc_exists(b'pool/new'))
+        lzc.lzc_create(b'pool/new')
+        self.assertTrue(lzc.lzc_exists(b'pool/new'))
+        self.assertEqual(self.lib.exists_calls, 1)
+
+    def test_updated_by_rename(self):
+        self.assertTrue(lzc.lzc_exists(b'pool/fs'))
+        self.assertTrue(lzc.lzc_exists(b'pool/fs@snap'))
+        lzc.lzc_rename(b'pool/fs', b'pool/renamed')
+        calls = self.lib.exists_calls
+        self.assertFalse(lzc.lzc_exists(b'pool/fs'))
+        self.assertTrue(lzc.lzc_exists(b'pool/renamed'))
+        self.assertEqual(self.lib.exists_calls, calls)
+        # The descendants are looked up again.
+        self.assertFalse(lzc.lzc_exists(b'pool/fs@snap'))
+        self.assertTrue(lzc.lzc_exists(b'pool/renamed@snap'))
+        self.assertEqual(self.lib.exists_calls, calls + 2)
+
+    def _fake_list(self, names):
+        def _list(name, recurse=None, types=None, lazy=False, fields=None):
+            for n in names:
+                yield {b'name': n}
+        lzc._list = _list
+
+    def test_prime(self):
+        self._fake_list([b'pool', b'pool/fs', b'pool/fs@snap'])
+        lzc.prime_exists_cache(b'pool')
+        self.assertTrue(lzc.lzc_exists(b'pool/fs'))
+        self.assertTrue(lzc.lzc_exists(b'pool/fs@snap'))
+        self.assertFalse(lzc.lzc_exists(b'pool/fs/child'))
+        self.assertFalse(lzc.lzc_exists(b'pool/fs@other'))
+        self.assertEqual(self.lib.exists_calls, 0)
+        # Outside of the listed subtree.
+        self.assertFalse(lzc.lzc_exists(b'pool2'))
+        self.assertEqual(self.lib.exists_calls, 1)
+
+    def test_prime_dropped_by_rename(self):
+        self._fake_list([b'pool', b'pool/fs', b'pool/fs@snap'])
+        lzc.prime_exists_cache(b'pool')
+        lzc.lzc_rename(b'pool/fs', b'pool/renamed')
+        self.assertTrue(lzc.lzc_exists(b'pool/renamed@snap'))
+        self.assertEqual(self.lib.exists_calls, 1)
+
+    def test_prime_kept_by_create(self):
+        self._fake_list([b'pool', b'pool/fs'])
+        lzc.prime_exists_cache(b'pool')
+        lzc.lzc_create(b'pool/new')
+        self.assertTrue(lzc.lzc_exists(b'pool/new'))
+        self.assertFalse(lzc.lzc_exists(b'pool/new/child'))
+        self.assertEqual(self.lib.exists_calls, 0)
+
+    def test_prime_over_maxsize(self):
+        cache = _cache._ExistsCache(3, 60)
+        names = [b'pool/fs', b'pool/fs@a', b'pool/fs@b', b'pool/fs@c', b'pool/fs@d']
+        cache.prime(b'pool/fs', names, cache.generation())
+        for name in names:
+            self.assertIsNot(cache.lookup(name)[0], False)
+        self.assertIs(cache.lookup(b'pool/fs@other')[0], _cache._MISSING)
+
+    def test_prime_dropped_by_eviction(self):
+        cache = _cache._ExistsCache(3, 60)
+        cache.prime(b'pool/fs', [b'pool/fs', b'pool/fs@a'], cache.generation())
+        self.assertIs(cache.lookup(b'pool/fs@other')[0], False)
+        cache.store(b'pool2', True, cache.generation())
+        cache.store(b'pool3', True, cache.generation())
+        self.assertIs(cache.lookup(b'pool/fs')[0], _cache._MISSING)
+        self.assertIs(cache.lookup(b'pool/fs@other')[0], _cache._MISSING)
+
+    def test_prime_disabled(self):
+        _cache.disable_exists_cache()
+        lzc._list = None
+        lzc.prime_exists_cache(b'pool')
+
+
+# vim: softtabstop=4 tabstop=4 expandtab shiftwidth=4
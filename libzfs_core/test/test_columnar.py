@@ -0,0 +1,143 @@
+# Copyright 2015 ClusterHQ. See LICENSE file for details.
+
+"""
+Tests for the columnar listings.
+
+The listing is replaced with a fake that produces projected entries
+of synthetic snapshots, so the tests do not need a ZFS pool.
+"""
+from __future__ import unicode_literals
+
+import array
+import sys
+import unittest
+
+from .. import _columnar
+from .. import _libzfs_core as lzc
+from .._columnar import ColumnarListing, list_columnar
+
+
+def _entry(name, **props):
+    return {
+        b'name': name,
+        b'properties': dict((k.encode(), {b'value': v}) for k, v in props.items()),
+    }
+
+
+class ColumnarListingTest(unittest.TestCase):
+
+    def _listing(self):
+        listing = ColumnarListing([b'guid', b'createtxg'])
+        listing.append(b'pool/fs@a', {b'guid': 10, b'createtxg': 1})
+        listing.append(b'pool/fs@bb', {b'guid': 20})
+        listing.append('pool/fs@ccc', {b'guid': 2 ** 64 - 1, b'createtxg': 3})
+        return listing
+
+    def test_empty(self):
+        listing = ColumnarListing()
+        self.assertEqual(len(listing), 0)
+        self.assertEqual(list(listing), [])
+        self.assertEqual(list(listing.names()), [])
+        with self.assertRaises(IndexError):
+            listing[0]
+
+    def test_names(self):
+        listing = self._listing()
+        self.assertEqual(len(listing), 3)
+        self.assertEqual(list(listing.names()), [b'pool/fs@a', b'pool/fs@bb', b'pool/fs@ccc'])
+        self.assertEqual(listing.name(1), b'pool/fs@bb')
+        self.assertEqual(listing.name(-1), b'pool/fs@ccc')
+
+    def test_columns(self):
+        listing = self._listing()
+        self.assertEqual(listing.columns, (b'guid', b'createtxg'))
+        guid = listing.column(b'guid')
+        self.assertIsInstance(guid, array.array)
+        self.assertEqual(guid.tolist(), [10, 20, 2 ** 64 - 1])
+        # A missing value is stored as zero.
+        self.assertEqual(listing.column('createtxg').tolist(), [1, 0, 3])
+        with self.assertRaises(KeyError):
+            listing.column(b'used')
+
+    def test_rows(self):
+        listing = self._listing()
+        row = listing[0]
+        self.assertEqual(row.name, b'pool/fs@a')
+        self.assertEqual(row[b'guid'], 10)
+        self.assertEqual(row.to_dict(), {b'name': b'pool/fs@a', b'guid': 10, b'createtxg': 1})
+        self.assertEqual([r.name for r in listing], list(listing.names()))
+        with self.assertRaises(AttributeError):
+            row.extra = 1
+
+    def test_nbytes(self):
+        listing = self._listing()
+        names = len(b'pool/fs@a' b'pool/fs@bb' b'pool/fs@ccc')
+        self.assertEqual(listing.nbytes(), names + 4 * 8 + 2 * 3 * 8)
+
+    @unittest.skipIf(_columnar.numpy is None, 'NumPy is not installed')
+    def test_numpy_column(self):
+        listing = self._listing()
+        column = listing.numpy_column(b'guid')
+        self.assertEqual(column.tolist(), [10, 20, 2 ** 64 - 1])
+        self.assertEqual(len(ColumnarListing().numpy_column(b'guid')), 0)
+
+    def _assertAppendRefused(self, listing, view):
+        with self.assertRaises(BufferError):
+            listing.append(b'pool/fs@dddd', {b'guid': 40, b'createtxg': 4})
+        self.assertEqual(len(listing), 3)
+        self.assertEqual(list(listing.names())[-1], b'pool/fs@ccc')
+        self.assertEqual(listing.column(b'guid').tolist(), [10, 20, 2 ** 64 - 1])
+        self.assertEqual(listing.column(b'createtxg').tolist(), [1, 0, 3])
+        del view
+        listing.append(b'pool/fs@dddd', {b'guid': 40, b'createtxg': 4})
+        self.assertEqual(listing[3].to_dict(),
+                         {b'name': b'pool/fs@dddd', b'guid': 40, b'createtxg': 4})
+
+    @unittest.skipIf(sys.version_info[0] < 3, 'the arrays are not locked on Python 2')
+    def test_append_refused_while_exported(self):
+        for prop in (b'guid', b'createtxg'):
+            listing = self._listing()
+            self._assertAppendRefused(listing, memoryview(listing.column(prop)))
+
+    @unittest.skipIf(sys.version_info[0] < 3, 'the arrays are not locked on Python 2')
+    @unittest.skipIf(_columnar.numpy is None, 'NumPy is not installed')
+    def test_append_refused_while_numpy_view(self):
+        listing = self._listing()
+        self._assertAppendRefused(listing, listing.numpy_column(b'createtxg'))
+
+    @unittest.skipIf(_columnar.numpy is not None, 'NumPy is installed')
+    def test_numpy_missing(self):
+        with self.assertRaises(ImportError):
+            self._listing().numpy_column(b'guid')
+
+
+class ListColumnarTest(unittest.TestCase):
+
+    def setUp(self):
+        self._saved = lzc._list
+        lzc._list = self._list
+        self.calls = []
+
+    def tearDown(self):
+        lzc._list = self._saved
+
+    def _list(self, name, recurse=None, types=None, lazy=False, fields=None):
+        self.calls.append((name, recurse, types, fields))
+        yield _entry(b'pool/fs', guid=1)
+        yield _entry(b'pool/fs@a', guid=2, createtxg=5)
+        yield _entry(b'pool/fs@b', guid=3, createtxg=6)
+
+    def test_list(self):
+        listing = list_columnar('pool/fs', columns=[b'guid', b'createtxg'])
+        self.assertEqual(list(listing.names()), [b'pool/fs@a', b'pool/fs@b'])
+        self.assertEqual(listing.column(b'guid').tolist(), [2, 3])
+        self.assertEqual(listing.column(b'createtxg').tolist(), [5, 6])
+        (name, recurse, types, fields) = self.calls[0]
+        self.assertEqual((name, recurse, types), (b'pool/fs', 1, ['snapshot']))
+        self.assertEqual(fields, {
+            b'name': None,
+            b'properties': {b'guid': [b'value'], b'createtxg': [b'value']},
+        })
+
+
+# vim: softtabstop=4 tabstop=4 expandtab shiftwidth=4
@@ -0,0 +1,109 @@
+# Copyright 2015 ClusterHQ. See LICENSE file for details.
+
+"""
+Tests for the translation of the error lists of the multi-entity operations.
+
+These tests do not need a ZFS pool.
+"""
+from __future__ import unicode_literals
+
+import errno
+import unittest
+
+from .. import _error_translation as errors
+from .. import exceptions as lzc_exc
+from .._constants import MAXNAMELEN
+
+
+class TranslateErrListTest(unittest.TestCase):
+
+    def _errors(self, func, *args):
+        with self.assertRaises(lzc_exc.MultipleOperationsFailure) as ctx:
+            func(*args)
+        return ctx.exception.errors
+
+    def test_snapshot_exdev(self):
+        snaps = ['pool/fs1@snap', 'pool/fs2@snap']
+        errlist = dict((s, errno.EXDEV) for s in snaps)
+        errs = self._errors(errors.lzc_snapshot_translate_errors, errno.EXDEV, errlist, snaps, {})
+        self.assertTrue(all(isinstance(e, lzc_exc.DuplicateSnapshots) for e in errs))
+
+        snaps = ['pool1/fs@snap', 'pool2/fs@snap']
+        errlist = dict((s, errno.EXDEV) for s in snaps)
+        errs = self._errors(errors.lzc_snapshot_translate_errors, errno.EXDEV, errlist, snaps, {})
+        self.assertTrue(all(isinstance(e, lzc_exc.PoolsDiffer) for e in errs))
+
+    def test_snapshot_einval(self):
+        snaps = ['pool/fs@snap', 'pool/fs@sn!ap']
+        errs = self._errors(errors.lzc_snapshot_translate_errors, errno.EINVAL,
+                            {snaps[0]: errno.EINVAL}, snaps, {})
+        self.assertIsInstance(errs[0], lzc_exc.NameInvalid)
+
+        snaps = ['pool/fs@snap', 'pool/fs@' + 'x' * MAXNAMELEN]
+        errs = self._errors(errors.lzc_snapshot_translate_errors, errno.EINVAL,
+                            {snaps[0]: errno.EINVAL}, snaps, {})
+        self.assertIsInstance(errs[0], lzc_exc.NameTooLong)
+
+        snaps = ['pool/fs@snap']
+        errs = self._errors(errors.lzc_snapshot_translate_errors, errno.EINVAL,
+                            {snaps[0]: errno.EINVAL}, snaps, {})
+        self.assertIsInstance(errs[0], lzc_exc.PropertyInvalid)
+
+    def test_bookmark_einval(self):
+        bookmarks = {'pool1/fs#bmark': 'pool1/fs@snap', 'pool2/fs#bmark': 'pool2/fs@snap'}
+        errs = self._errors(errors.lzc_bookmark_translate_errors, errno.EINVAL,
+                            {'pool1/fs#bmark': errno.EINVAL}, bookmarks)
+        self.assertIsInstance(errs[0], lzc_exc.PoolsDiffer)
+
+        bookmarks = {'pool/fs#bm!ark': 'pool/fs@snap', 'pool/fs#other': 'pool/fs@snap'}
+        errs = self._errors(errors.lzc_bookmark_translate_errors, errno.EINVAL, {}, bookmarks)
+        self.assertIsInstance(errs[0], lzc_exc.BookmarkNameInvalid)
+        self.assertEqual(errs[0].name, 'pool/fs#bm!ark')
+
+    def test_hold_einval(self):
+        holds = {'pool1/fs@snap': 'tag', 'pool2/fs@snap': 'tag'}
+        errs = self._errors(errors.lzc_hold_translate_errors, errno.EINVAL,
+                            {'pool1/fs@snap': errno.EINVAL}, holds, -1)
+        self.assertIsInstance(errs[0], lzc_exc.PoolsDiffer)
+
+        holds = {'pool/fs@snap': 'tag'}
+        errs = self._errors(errors.lzc_hold_translate_errors, errno.EINVAL,
+                            {'pool/fs@snap': errno.EINVAL}, holds, -1)
+        self.assertIsInstance(errs[0], lzc_exc.ZFSGenericError)
+
+    def test_large_errlist(self):
+        snaps = ['pool%d/fs%d@snap' % (i % 2, i) for i in range(5000)]
+        errlist = dict((s, errno.EXDEV) for s in snaps)
+        errs = self._errors(errors.lzc_snapshot_translate_errors, errno.EXDEV, errlist, snaps, {})
+        self.assertEqual(len(errs), len(snaps))
+
+
+class NameContextTest(unittest.TestCase):
+
+    def test_pools(self):
+        names = errors._NameContext(['pool1/fs@snap', 'pool1/fs#bmark', 'pool1'])
+        self.assertTrue(names.same_pool())
+        self.assertFalse(names.pools_differ('pool1/other'))
+        self.assertTrue(names.pools_differ('pool2/fs'))
+
+    def test_invalid_cached(self):
+        calls = []
+
+        def _validator(name):
+            calls.append(name)
+            return '!' not in name
+
+        names = errors._NameContext(['pool/a', 'pool/b!', 'pool/c!'])
+        self.assertEqual(names.invalid(_validator), ['pool/b!', 'pool/c!'])
+        self.assertEqual(names.invalid(_validator), ['pool/b!', 'pool/c!'])
+        self.assertEqual(len(calls), 3)
+
+    def test_empty(self):
+        names = errors._NameContext([])
+        self.assertTrue(names.same_pool())
+        self.assertFalse(names.pools_differ('pool'))
+        self.assertFalse(names.too_long())
+        self.assertEqual(names.invalid(errors._is_valid_snap_name), [])
+
+
+# vim: softtabstop=4 tabstop=4 expandtab shiftwidth=4
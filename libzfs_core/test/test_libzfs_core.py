@@ -3113,6 +3113,57 @@ class ZFSTest(unittest.TestCase):
         snaps = list(lzc.lzc_list_snaps(snap))
         self.assertEqual(snaps, [])
 
+    @needs_support(lzc.lzc_iter_children)
+    def test_iter_children(self):
+        name = ZFSTest.pool.makeName("fs1/fs")
+        names = [ZFSTest.pool.makeName("fs1/fs/test1"),
+                 ZFSTest.pool.makeName("fs1/fs/test2"), ]
+        snap = ZFSTest.pool.makeName("fs1/fs@test")
+
+        for fs in names:
+            lzc.lzc_create(fs)
+        lzc.lzc_snapshot([snap])
+
+        children = list(lzc.lzc_iter_children(name))
+        self.assertItemsEqual(children, names)
+
+    @needs_support(lzc.lzc_iter_children)
+    def test_iter_children_nonexistent(self):
+        fs = ZFSTest.pool.makeName("nonexistent")
+
+        children = lzc.lzc_iter_children(fs)
+        with self.assertRaises(lzc_exc.DatasetNotFound):
+            list(children)
+
+    @needs_support(lzc.lzc_iter_snaps)
+    def test_iter_snaps(self):
+        name = ZFSTest.pool.makeName("fs1/fs")
+        names = [ZFSTest.pool.makeName("fs1/fs@test1"),
+                 ZFSTest.pool.makeName("fs1/fs@test2"),
+                 ZFSTest.pool.makeName("fs1/fs@test3"), ]
+        fs = ZFSTest.pool.makeName("fs1/fs/test")
+
+        lzc.lzc_snapshot(names)
+        lzc.lzc_create(fs)
+
+        snaps = list(lzc.lzc_iter_snaps(name))
+        self.assertItemsEqual(snaps, names)
+
+    @needs_support(lzc.lzc_iter_snaps)
+    @unittest.skipUnless(os.path.isdir('/proc/self/fd'), 'needs /proc/self/fd')
+    def test_iter_snaps_early_close(self):
+        name = ZFSTest.pool.makeName("fs1/fs")
+        names = [ZFSTest.pool.makeName("fs1/fs@test%d" % i) for i in range(10)]
+
+        lzc.lzc_snapshot(names)
+
+        fds = len(os.listdir('/proc/self/fd'))
+        with contextlib.closing(lzc.lzc_iter_snaps(name)) as snaps:
+            first = next(snaps)
+            self.assertIn(first, names)
+            self.assertGreater(len(os.listdir('/proc/self/fd')), fds)
+        self.assertEqual(len(os.listdir('/proc/self/fd')), fds)
+
     @needs_support(lzc.lzc_get_props)
     def test_get_fs_props(self):
         fs = ZFSTest.pool.makeName("new")
@@ -3227,6 +3278,74 @@ class ZFSTest(unittest.TestCase):
         clones_prop = lzc.lzc_get_props(snap)["clones"]
         self.assertItemsEqual(clones_prop, [clone1, clone2])
 
+    @needs_support(lzc.lzc_get_props_recursive)
+    def test_get_props_recursive(self):
+        fs = ZFSTest.pool.makeName("new")
+        child = ZFSTest.pool.makeName("new/child")
+        snap = ZFSTest.pool.makeName("new@snap")
+
+        lzc.lzc_create(fs, props={"user:foo": "parent"})
+        lzc.lzc_create(child, props={"user:foo": "child"})
+        lzc.lzc_snapshot([snap])
+        all_props = lzc.lzc_get_props_recursive(fs)
+        self.assertItemsEqual(all_props.keys(), _bytes([fs, child]))
+        for name in (fs, child):
+            self.assertEqual(all_props[_bytes(name)], lzc.lzc_get_props(name))
+
+    @needs_support(lzc.lzc_get_props_recursive)
+    def test_get_props_recursive_depth_and_types(self):
+        fs = ZFSTest.pool.makeName("new")
+        child = ZFSTest.pool.makeName("new/child")
+        grandchild = ZFSTest.pool.makeName("new/child/grandchild")
+        snap = ZFSTest.pool.makeName("new/child@snap")
+
+        lzc.lzc_create(fs)
+        lzc.lzc_create(child)
+        lzc.lzc_create(grandchild)
+        lzc.lzc_snapshot([snap])
+        all_props = lzc.lzc_get_props_recursive(fs, depth=1)
+        self.assertItemsEqual(all_props.keys(), _bytes([fs, child]))
+        all_props = lzc.lzc_get_props_recursive(fs, types=['snapshot'])
+        self.assertItemsEqual(all_props.keys(), _bytes([snap]))
+        self.assertEqual(all_props[_bytes(snap)], lzc.lzc_get_props(snap))
+
+    @needs_support(lzc.lzc_get_props_recursive)
+    def test_get_props_recursive_mountpoint(self):
+        fs = ZFSTest.pool.makeName("new")
+        child = ZFSTest.pool.makeName("new/child")
+        grandchild = ZFSTest.pool.makeName("new/child/grandchild")
+        other = ZFSTest.pool.makeName("new/other")
+
+        lzc.lzc_create(fs, props={"mountpoint": "/mnt"})
+        lzc.lzc_create(child)
+        lzc.lzc_create(grandchild)
+        lzc.lzc_create(other, props={"mountpoint": "legacy"})
+        all_props = lzc.lzc_get_props_recursive(fs)
+        self.assertEqual(all_props[_bytes(fs)]["mountpoint"], b"/mnt")
+        self.assertEqual(all_props[_bytes(child)]["mountpoint"], b"/mnt/child")
+        self.assertEqual(all_props[_bytes(grandchild)]["mountpoint"], b"/mnt/child/grandchild")
+        self.assertEqual(all_props[_bytes(other)]["mountpoint"], b"legacy")
+
+    @needs_support(lzc.lzc_get_props_recursive)
+    def test_get_props_recursive_fields(self):
+        fs = ZFSTest.pool.makeName("new")
+        child = ZFSTest.pool.makeName("new/child")
+
+        lzc.lzc_create(fs, props={"mountpoint": "/mnt", "user:foo": "bar"})
+        lzc.lzc_create(child)
+        all_props = lzc.lzc_get_props_recursive(fs, fields=["user:foo", "guid"])
+        self.assertEqual(sorted(all_props[_bytes(fs)].keys()), [b"guid", b"user:foo"])
+        self.assertEqual(all_props[_bytes(fs)][b"user:foo"], b"bar")
+        all_props = lzc.lzc_get_props_recursive(fs, fields=["mountpoint"])
+        self.assertEqual(all_props[_bytes(child)], {b"mountpoint": b"/mnt/child"})
+
+    @needs_support(lzc.lzc_get_props_recursive)
+    def test_get_props_recursive_nonexistent(self):
+        fs = ZFSTest.pool.makeName("nonexistent")
+
+        with self.assertRaises(lzc_exc.DatasetNotFound):
+            lzc.lzc_get_props_recursive(fs)
+
     @needs_support(lzc.lzc_rename)
     def test_rename(self):
         src = ZFSTest.pool.makeName("source")
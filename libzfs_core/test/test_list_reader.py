@@ -0,0 +1,145 @@
+# Copyright 2015 ClusterHQ. See LICENSE file for details.
+
+"""
+Tests for the readers of the :func:`.lzc_list` record stream.
+
+The records are written to pipes or memory buffers by the tests,
+so the tests do not need a ZFS pool.
+"""
+from __future__ import unicode_literals
+
+import contextlib
+import io
+import os
+import struct
+import threading
+import unittest
+
+from .. import _libzfs_core as lzc
+from .. import exceptions as lzc_exc
+
+
+class RecordReaderTest(unittest.TestCase):
+
+    @staticmethod
+    def _record(payload, err=0):
+        return struct.pack(lzc._PIPE_RECORD_FORMAT, len(payload), 0, err, 0, 0) + payload
+
+    @contextlib.contextmanager
+    def _pipe(self, data):
+        (rfd, wfd) = os.pipe()
+        try:
+            os.write(wfd, data)
+            os.close(wfd)
+            wfd = None
+            yield rfd
+        finally:
+            os.close(rfd)
+            if wfd is not None:
+                os.close(wfd)
+
+    def _read_all(self, data, bufsize):
+        records = []
+        with self._pipe(data) as fd:
+            reader = lzc._RecordReader(fd, bufsize)
+            while True:
+                header = reader.read_header()
+                if header is None:
+                    break
+                (size, err) = header
+                payload = lzc._ffi.buffer(reader.read_payload(size), size)[:]
+                records.append((payload, err))
+        return records
+
+    def test_empty(self):
+        self.assertEqual(self._read_all(b'', 1024), [])
+
+    def test_records(self):
+        expected = [(b'x' * i, i % 3) for i in range(100)]
+        data = b''.join(self._record(p, e) for (p, e) in expected)
+        for bufsize in [1, 7, 64, 1000, lzc._LIST_BUFSIZE]:
+            self.assertEqual(self._read_all(data, bufsize), expected)
+
+    def test_record_larger_than_buffer(self):
+        expected = [(b'a' * 10, 0), (b'b' * 5000, 0), (b'c' * 10, 0)]
+        data = b''.join(self._record(p, e) for (p, e) in expected)
+        self.assertEqual(self._read_all(data, 64), expected)
+
+    def test_buffer_grows_on_demand(self):
+        payloads = [b'%04d' % i * 250 for i in range(200)]
+        data = b''.join(self._record(p) for p in payloads)
+        reader = lzc._RecordReader(io.BytesIO(data), 64 * 1024)
+        self.assertEqual(len(reader._buf), lzc._LIST_INITIAL_BUFSIZE)
+        records = [(size, err, bytes(payload))
+                   for (size, err, payload) in reader.records(raw=True)]
+        self.assertEqual(records, [(1000, 0, p) for p in payloads])
+        self.assertEqual(len(reader._buf), 64 * 1024)
+
+    def test_truncated_header(self):
+        data = self._record(b'abc')[:lzc._PIPE_RECORD_SIZE - 1]
+        with self.assertRaises(lzc_exc.ZFSGenericError):
+            self._read_all(data, 1024)
+
+    def test_truncated_payload(self):
+        data = self._record(b'abc')[:-1]
+        with self.assertRaises(lzc_exc.ZFSGenericError):
+            self._read_all(data, 1024)
+
+    def test_records_stop_at_terminal_record(self):
+        data = (self._record(b'a') + self._record(b'', 0) + self._record(b'b'))
+        with self._pipe(data) as fd:
+            records = list(lzc._RecordReader(fd, 1024).records())
+        self.assertEqual(len(records), 2)
+        self.assertEqual(records[1], (0, 0, None))
+
+    @contextlib.contextmanager
+    def _writer(self, data):
+        (rfd, wfd) = os.pipe()
+
+        def _write():
+            try:
+                view = memoryview(data)
+                while view:
+                    view = view[os.write(wfd, view):]
+            finally:
+                os.close(wfd)
+
+        thread = threading.Thread(target=_write)
+        thread.start()
+        try:
+            yield rfd
+        finally:
+            thread.join(10)
+            self.assertFalse(thread.is_alive())
+
+    def test_pump(self):
+        expected = [(b'x' * (i * 100), 0) for i in range(1, 200)]
+        data = b''.join(self._record(p, e) for (p, e) in expected)
+        with self._writer(data + self._record(b'')) as fd:
+            pump = lzc._RecordPump(fd, chunk_size=1000, queue_size=4)
+            records = [
+                (lzc._ffi.buffer(p, size)[:] if p is not None else None, e)
+                for (size, e, p) in lzc._RecordReader(pump, 4096).records()
+            ]
+            pump._thread.join(10)
+        self.assertEqual(records[:-1], expected)
+        self.assertEqual(records[-1], (None, 0))
+        self.assertFalse(pump._thread.is_alive())
+
+    def test_pump_stop(self):
+        data = b''.join(self._record(b'x' * 1000) for _ in range(2000))
+        with self._writer(data) as fd:
+            pump = lzc._RecordPump(fd, chunk_size=1000, queue_size=4)
+            next(lzc._RecordReader(pump, 4096).records())
+            pump.stop()
+        pump._thread.join(10)
+        self.assertFalse(pump._thread.is_alive())
+
+    def test_pump_truncated(self):
+        with self._writer(self._record(b'abc')[:-1]) as fd:
+            pump = lzc._RecordPump(fd)
+            with self.assertRaises(lzc_exc.ZFSGenericError):
+                list(lzc._RecordReader(pump, 1024).records())
+
+
+# vim: softtabstop=4 tabstop=4 expandtab shiftwidth=4
@@ -9,12 +9,28 @@ value types or out of bounds values are detected.
 """
 from __future__ import unicode_literals
 
+import array
+import ctypes
+import errno
+import gc
+import sys
+import threading
 import unittest
 
 from builtins import zip
 
 from . import _bytes
-from .._nvlist import nvlist_in, nvlist_out, _lib
+from .. import exceptions as lzc_exc
+from .._nvlist import (
+    nvlist_in, nvlist_out, _lib, _nvlist_to_dict, _nvlist_to_dict_native,
+    NvlistView, nvlist_to_bytes, nvlist_from_bytes, NV_ENCODE_XDR,
+    nvlist_in_cached, _template_key, _TemplateCache, _templates, NvlistSchema,
+    nvlist_in_scope, _AllocationPool, _pool, _POOL_SIZE, _POOL_MAX_PAIRS,
+    _buffer_array_suffix
+)
+from .._schema import _LIST_OPTIONS, _ZFS_PROPS
+from .._packed import unpack_nvlist
+from ..bindings import libnvpair
 from ..ctypes import (
     uint8_t, int8_t, uint16_t, int16_t, uint32_t, int32_t,
     uint64_t, int64_t, boolean_t, uchar_t
@@ -613,4 +629,590 @@ class TestNVList(unittest.TestCase):
         self.assertEqual(_bytes(props), res)
 
 
+@unittest.skipUnless(libnvpair.api_mode, 'the API mode extension is not available')
+class TestNVListNative(TestNVList):
+
+    """
+    Run all the conversion tests with the native converter and check that
+    it produces exactly the same result as the reference implementation.
+    """
+
+    def _dict_to_nvlist_to_dict(self, props):
+        res = {}
+        nv_in = nvlist_in(props)
+        with nvlist_out({}) as nv_out:
+            _lib.nvlist_dup(nv_in, nv_out, 0)
+            expected = _nvlist_to_dict(nv_out[0], {})
+            _nvlist_to_dict_native(nv_out[0], res)
+        self.assertEqual(expected, res)
+        for key in expected:
+            self.assertIs(type(expected[key]), type(res[key]))
+        return res
+
+
+class TestNVListCompactArrays(unittest.TestCase):
+
+    def _dict_to_nvlist_to_dict(self, props):
+        res = {}
+        nv_in = nvlist_in(props)
+        with nvlist_out(res, compact_arrays=True) as nv_out:
+            _lib.nvlist_dup(nv_in, nv_out, 0)
+            expected = _nvlist_to_dict(nv_out[0], {}, compact_arrays=True)
+        self.assertEqual(expected, res)
+        return res
+
+    def _assertArrayEqual(self, val, typecode_signed, itemsize, values):
+        self.assertIsInstance(val, array.array)
+        self.assertEqual(val.itemsize, itemsize)
+        self.assertEqual(val.typecode.islower(), typecode_signed)
+        self.assertEqual(val.tolist(), values)
+
+    def test_implicit_uint64_array(self):
+        props = {b"key": [0, 1, 2 ** 64 - 1]}
+        res = self._dict_to_nvlist_to_dict(props)
+        self._assertArrayEqual(res[b"key"], False, 8, [0, 1, 2 ** 64 - 1])
+
+    def test_explicit_int_arrays(self):
+        props = {
+            b"int8": [int8_t(-(2 ** 7)), int8_t(1)],
+            b"uint16": [uint16_t(2 ** 16 - 1)],
+            b"int32": [int32_t(-(2 ** 31)), int32_t(2 ** 31 - 1)],
+            b"int64": [int64_t(-(2 ** 63))],
+        }
+        res = self._dict_to_nvlist_to_dict(props)
+        self._assertArrayEqual(res[b"int8"], True, 1, [-(2 ** 7), 1])
+        self._assertArrayEqual(res[b"uint16"], False, 2, [2 ** 16 - 1])
+        self._assertArrayEqual(res[b"int32"], True, 4, [-(2 ** 31), 2 ** 31 - 1])
+        self._assertArrayEqual(res[b"int64"], True, 8, [-(2 ** 63)])
+
+    def test_explicit_byte_array(self):
+        props = {b"key": [uchar_t(0), uchar_t(1), uchar_t(2 ** 8 - 1)]}
+        res = self._dict_to_nvlist_to_dict(props)
+        self.assertEqual(res, {b"key": b"\x00\x01\xff"})
+
+    def test_non_integer_arrays(self):
+        props = {
+            b"bool": [True, False],
+            b"string": [b"a", b"b"],
+            b"nvlist": [{b"key": [1, 2]}],
+        }
+        res = self._dict_to_nvlist_to_dict(props)
+        self.assertEqual(res[b"bool"], [True, False])
+        self.assertEqual(res[b"string"], [b"a", b"b"])
+        self.assertEqual(len(res[b"nvlist"]), 1)
+        self._assertArrayEqual(res[b"nvlist"][0][b"key"], False, 8, [1, 2])
+
+    def test_nested_dict(self):
+        props = {b"key": {b"nested": [1, 2, 3]}}
+        res = self._dict_to_nvlist_to_dict(props)
+        self._assertArrayEqual(res[b"key"][b"nested"], False, 8, [1, 2, 3])
+
+    def test_array_value(self):
+        props = {b"key": array.array("i", [-1, 0, 2 ** 31 - 1])}
+        res = self._dict_to_nvlist_to_dict(props)
+        self.assertEqual(res, props)
+        res = {}
+        with nvlist_out(res) as nv_out:
+            _lib.nvlist_dup(nvlist_in(props), nv_out, 0)
+        self.assertEqual(res, {b"key": [-1, 0, 2 ** 31 - 1]})
+
+    def test_empty_array_value(self):
+        props = {b"key": array.array("H")}
+        res = self._dict_to_nvlist_to_dict(props)
+        self.assertEqual(res, props)
+
+    def test_bytearray_value(self):
+        props = {b"key": bytearray(b"abc")}
+        res = self._dict_to_nvlist_to_dict(props)
+        self.assertEqual(res, {b"key": b"abc"})
+
+    def test_memoryview_value(self):
+        props = {
+            b"bytes": memoryview(b"abc"),
+            b"ints": memoryview(array.array("h", [-1, 1])),
+        }
+        res = self._dict_to_nvlist_to_dict(props)
+        self.assertEqual(res[b"bytes"], b"abc")
+        self._assertArrayEqual(res[b"ints"], True, 2, [-1, 1])
+
+    def _byte_order_views(self):
+        little = memoryview((ctypes.c_uint64.__ctype_le__ * 2)(1, 2 ** 64 - 1))
+        big = memoryview((ctypes.c_int16.__ctype_be__ * 2)(-1, 1))
+        if sys.byteorder == "little":
+            return (little, "uint64", big)
+        return (big, "int16", little)
+
+    def test_memoryview_byte_order_suffix(self):
+        (native, suffix, other) = self._byte_order_views()
+        self.assertEqual(_buffer_array_suffix(native), suffix)
+        with self.assertRaises(TypeError):
+            _buffer_array_suffix(other)
+
+    def test_memoryview_explicit_native_order(self):
+        (native, _, _) = self._byte_order_views()
+        res = self._dict_to_nvlist_to_dict({b"key": native})
+        self.assertEqual(list(res[b"key"]), native.tolist())
+
+    def test_invalid_array_value_type(self):
+        with self.assertRaises(TypeError):
+            self._dict_to_nvlist_to_dict({b"key": array.array("d", [1.0])})
+
+
+class TestNVListProjection(unittest.TestCase):
+
+    _props = {
+        b"name": b"pool/fs@snap",
+        b"dmu_objset_stats": {b"dds_type": 2, b"dds_is_snapshot": True},
+        b"properties": {
+            b"guid": {b"value": 1234, b"source": b""},
+            b"createtxg": {b"value": 42, b"source": b""},
+            b"used": {b"value": 4096, b"source": b""},
+        },
+        b"dicts": [{b"key": 1, b"other": 2}],
+    }
+
+    def _project(self, fields):
+        res = {}
+        with nvlist_out(res, fields=fields) as nv_out:
+            _lib.nvlist_dup(nvlist_in(self._props), nv_out, 0)
+        return res
+
+    def test_top_level(self):
+        res = self._project({b"name": None, b"properties": None})
+        self.assertEqual(res, {
+            b"name": self._props[b"name"],
+            b"properties": self._props[b"properties"],
+        })
+
+    def test_nested(self):
+        res = self._project({b"name": None, b"properties": {b"guid": None, b"createtxg": [b"value"]}})
+        self.assertEqual(res, {
+            b"name": b"pool/fs@snap",
+            b"properties": {
+                b"guid": {b"value": 1234, b"source": b""},
+                b"createtxg": {b"value": 42},
+            },
+        })
+
+    def test_list_and_str_keys(self):
+        res = self._project(["name", "missing"])
+        self.assertEqual(res, {b"name": b"pool/fs@snap"})
+
+    def test_nvlist_array(self):
+        res = self._project({b"dicts": [b"key"]})
+        self.assertEqual(res, {b"dicts": [{b"key": 1}]})
+
+    def test_empty(self):
+        self.assertEqual(self._project([]), {})
+
+    def test_view(self):
+        with self.assertRaises(TypeError):
+            with nvlist_out(NvlistView(), fields=[b"name"]):
+                pass
+
+
+class TestNVListTemplates(unittest.TestCase):
+
+    _props = {
+        b"compression": b"lz4",
+        b"quota": 2 ** 30,
+        b"user:nested": {b"key": {b"deeper": True}},
+        b"dicts": [{b"key": 1}, {b"key": 2, b"other": {b"x": None}}],
+    }
+
+    def setUp(self):
+        _templates.clear()
+
+    def _to_dict(self, nvlist):
+        res = {}
+        with nvlist_out(res) as nv_out:
+            _lib.nvlist_dup(nvlist, nv_out, 0)
+        return res
+
+    def test_hit(self):
+        first = nvlist_in_cached(self._props)
+        second = nvlist_in_cached(dict(self._props))
+        self.assertNotEqual(first, second)
+        self.assertEqual(self._to_dict(first), self._props)
+        self.assertEqual(self._to_dict(second), self._props)
+        self.assertEqual((_templates.hits, _templates.misses), (1, 1))
+
+    def test_nested_in_place(self):
+        self.assertEqual(self._to_dict(nvlist_in(self._props)), self._props)
+
+    def test_distinct_values(self):
+        for props in ({b"key": 1}, {b"key": True}, {b"key": b"1"}, {b"key": [1]}):
+            self.assertEqual(self._to_dict(nvlist_in_cached(props)), props)
+        self.assertEqual(_templates.misses, 4)
+
+    def test_str_keys(self):
+        nvlist_in_cached({b"key": b"value"})
+        self.assertEqual(self._to_dict(nvlist_in_cached({"key": "value"})), {b"key": b"value"})
+        self.assertEqual(_templates.hits, 1)
+
+    def test_buffers_not_cached(self):
+        props = {b"key": bytearray(b"abc")}
+        self.assertEqual(self._to_dict(nvlist_in_cached(props)), {b"key": [97, 98, 99]})
+        self.assertEqual(len(_templates), 0)
+
+    def test_key(self):
+        self.assertEqual(_template_key({b"a": 1, "b": [b"x"]}), _template_key({"b": ["x"], b"a": 1}))
+        self.assertNotEqual(_template_key({b"a": 1}), _template_key({b"a": True}))
+        self.assertNotEqual(_template_key({b"a": 1}), _template_key({b"a": uint32_t(1)}))
+        self.assertIsNone(_template_key({b"a": array.array('i', [1])}))
+        self.assertIsNone(_template_key({b"a": 1, "a": 2}))
+        self.assertIsNone(_template_key({1: 1}))
+
+    def test_eviction(self):
+        cache = _TemplateCache(2)
+        cache.put(1, "one")
+        cache.put(2, "two")
+        self.assertEqual(cache.get(1), "one")
+        cache.put(3, "three")
+        self.assertIsNone(cache.get(2))
+        self.assertEqual(cache.get(1), "one")
+        self.assertEqual(len(cache), 2)
+
+
+class TestNVListSchema(unittest.TestCase):
+
+    def _types(self, nvlist):
+        types = {}
+        pair = _lib.nvlist_next_nvpair(nvlist, libnvpair.ffi.NULL)
+        while pair != libnvpair.ffi.NULL:
+            types[libnvpair.ffi.string(_lib.nvpair_name(pair))] = int(_lib.nvpair_type(pair))
+            pair = _lib.nvlist_next_nvpair(nvlist, pair)
+        return types
+
+    def _to_dict(self, nvlist):
+        res = {}
+        with nvlist_out(res) as nv_out:
+            _lib.nvlist_dup(nvlist, nv_out, 0)
+        return res
+
+    def test_typed(self):
+        schema = NvlistSchema({"int32": "int32", b"uint16": "uint16", b"str": "string",
+                               b"array": "uint8_array"})
+        props = {b"int32": -1, b"uint16": 2 ** 16 - 1, b"str": b"value", b"array": [1, 2]}
+        nvlist = nvlist_in(props, schema)
+        self.assertEqual(self._types(nvlist), {
+            b"int32": _lib.DATA_TYPE_INT32,
+            b"uint16": _lib.DATA_TYPE_UINT16,
+            b"str": _lib.DATA_TYPE_STRING,
+            b"array": _lib.DATA_TYPE_UINT8_ARRAY,
+        })
+        self.assertEqual(self._to_dict(nvlist), props)
+
+    def test_overflow(self):
+        with self.assertRaises(OverflowError):
+            nvlist_in({b"key": 2 ** 32}, NvlistSchema({b"key": "uint32"}))
+
+    def test_inferred_fallback(self):
+        schema = NvlistSchema({b"num": "uint32", b"str": "string", b"flag": "boolean"})
+        props = {b"num": b"lz4", b"str": "text", b"flag": 1, b"other": True}
+        nvlist = nvlist_in(props, schema)
+        self.assertEqual(self._types(nvlist), {
+            b"num": _lib.DATA_TYPE_STRING,
+            b"str": _lib.DATA_TYPE_STRING,
+            b"flag": _lib.DATA_TYPE_UINT64,
+            b"other": _lib.DATA_TYPE_BOOLEAN_VALUE,
+        })
+        self.assertEqual(self._to_dict(nvlist), _bytes(props))
+
+    def test_explicit_ctype(self):
+        schema = NvlistSchema({b"num": "uint64", b"array": "uint64_array"})
+        props = {b"num": int32_t(-5), b"array": [uint16_t(1), uint16_t(2)]}
+        nvlist = nvlist_in(props, schema)
+        self.assertEqual(self._types(nvlist), {
+            b"num": _lib.DATA_TYPE_INT32,
+            b"array": _lib.DATA_TYPE_UINT16_ARRAY,
+        })
+        self.assertEqual(self._to_dict(nvlist), {b"num": -5, b"array": [1, 2]})
+
+    def test_bool_value(self):
+        schema = NvlistSchema({b"num": "uint64", b"array": "uint32_array"})
+        props = {b"num": True, b"array": [True, False]}
+        nvlist = nvlist_in(props, schema)
+        self.assertEqual(self._types(nvlist), {
+            b"num": _lib.DATA_TYPE_BOOLEAN_VALUE,
+            b"array": _lib.DATA_TYPE_BOOLEAN_ARRAY,
+        })
+        self.assertEqual(self._to_dict(nvlist), props)
+
+    def test_none_value(self):
+        nvlist = nvlist_in({b"key": None}, NvlistSchema({b"key": "uint64"}))
+        self.assertEqual(self._types(nvlist), {b"key": _lib.DATA_TYPE_BOOLEAN})
+
+    def test_default(self):
+        nvlist = nvlist_in({b"a": 1, b"b": 2}, NvlistSchema({b"a": "uint64"}, default="int16"))
+        self.assertEqual(self._types(nvlist), {b"a": _lib.DATA_TYPE_UINT64, b"b": _lib.DATA_TYPE_INT16})
+
+    def test_nested(self):
+        nested = NvlistSchema(default="uint8")
+        schema = NvlistSchema({b"dict": nested, b"dicts": nested})
+        props = {b"dict": {b"key": 1}, b"dicts": [{b"key": 2}, {b"key": 3}]}
+        nvlist = nvlist_in(props, schema)
+        self.assertEqual(self._to_dict(nvlist), props)
+        dictp = libnvpair.ffi.new("nvlist_t **")
+        _lib.nvlist_lookup_nvlist(nvlist, b"dict", dictp)
+        self.assertEqual(self._types(dictp[0]), {b"key": _lib.DATA_TYPE_UINT8})
+
+    def test_default_schema(self):
+        nvlist = nvlist_in({"rewind-request": 1, "pool_context": 1, "other": 1})
+        self.assertEqual(self._types(nvlist), {
+            b"rewind-request": _lib.DATA_TYPE_UINT32,
+            b"pool_context": _lib.DATA_TYPE_INT32,
+            b"other": _lib.DATA_TYPE_UINT64,
+        })
+
+    def test_list_options(self):
+        options = {"recurse": None, "type": {"snapshot": None}, "fd": 3}
+        nvlist = nvlist_in(options, _LIST_OPTIONS)
+        self.assertEqual(self._types(nvlist), {
+            b"recurse": _lib.DATA_TYPE_BOOLEAN,
+            b"type": _lib.DATA_TYPE_NVLIST,
+            b"fd": _lib.DATA_TYPE_INT32,
+        })
+        self.assertEqual(self._to_dict(nvlist), _bytes(options))
+
+    def test_zfs_props(self):
+        props = {b"compression": b"lz4", b"quota": 2 ** 30, b"user:prop": b"value", b"copies": 2}
+        nvlist = nvlist_in(props, _ZFS_PROPS)
+        self.assertEqual(self._types(nvlist), {
+            b"compression": _lib.DATA_TYPE_STRING,
+            b"quota": _lib.DATA_TYPE_UINT64,
+            b"user:prop": _lib.DATA_TYPE_STRING,
+            b"copies": _lib.DATA_TYPE_UINT64,
+        })
+
+    def test_templates_per_schema(self):
+        _templates.clear()
+        props = {b"key": 1}
+        nvlist_in_cached(props)
+        nvlist = nvlist_in_cached(props, NvlistSchema({b"key": "int8"}))
+        self.assertEqual(self._types(nvlist), {b"key": _lib.DATA_TYPE_INT8})
+        self.assertEqual(_templates.misses, 2)
+
+    def test_invalid_type(self):
+        with self.assertRaises(ValueError):
+            NvlistSchema({b"key": "float"})
+        with self.assertRaises(ValueError):
+            NvlistSchema(default="string_array")
+
+
+class TestNVListScope(unittest.TestCase):
+
+    def _to_dict(self, nvlist):
+        res = {}
+        with nvlist_out(res) as nv_out:
+            _lib.nvlist_dup(nvlist, nv_out, 0)
+        return res
+
+    def test_scope(self):
+        props = {b"key": 1, b"dict": {b"nested": b"val"}, b"dicts": [{b"a": 1}]}
+        with nvlist_in_scope(props) as nvlist:
+            self.assertEqual(self._to_dict(nvlist), props)
+        self.assertEqual(self._to_dict(nvlist), {})
+
+    def test_reuse(self):
+        with nvlist_in_scope({b"key": 1}) as first:
+            pass
+        with nvlist_in_scope({b"other": 2}) as second:
+            self.assertEqual(self._to_dict(second), {b"other": 2})
+        self.assertEqual(first, second)
+
+    def test_nested_scopes(self):
+        with nvlist_in_scope({b"a": 1}) as first:
+            with nvlist_in_scope({b"b": 2}) as second:
+                self.assertNotEqual(first, second)
+                self.assertEqual(self._to_dict(first), {b"a": 1})
+
+    def test_exception(self):
+        with self.assertRaises(TypeError):
+            with nvlist_in_scope({b"key": 1, b"bad": 1.5}):
+                pass
+        with nvlist_in_scope({}) as nvlist:
+            self.assertEqual(self._to_dict(nvlist), {})
+
+    def test_large_nvlist_not_pooled(self):
+        props = dict((b"key%d" % i, i) for i in range(_POOL_MAX_PAIRS + 1))
+        with nvlist_in_scope(props) as nvlist:
+            pass
+        self.assertNotIn(nvlist, _pool.nvlists)
+
+    def test_cached(self):
+        _templates.clear()
+        props = {b"compression": b"lz4"}
+        for _ in range(2):
+            with nvlist_in_scope(props, cached=True) as nvlist:
+                self.assertEqual(self._to_dict(nvlist), props)
+        self.assertEqual((_templates.hits, _templates.misses), (1, 1))
+
+    def test_out_pointers(self):
+        res = {}
+        with nvlist_out(res) as first:
+            _lib.nvlist_dup(nvlist_in({b"key": 1}), first, 0)
+        with nvlist_out(res) as second:
+            self.assertEqual(second[0], libnvpair.ffi.NULL)
+        self.assertEqual(first, second)
+
+
+class TestAllocationPool(unittest.TestCase):
+
+    def test_nvlistp(self):
+        pool = _AllocationPool()
+        nvlistp = pool.get_nvlistp()
+        self.assertEqual(nvlistp[0], libnvpair.ffi.NULL)
+        pool.put_nvlistp(nvlistp)
+        self.assertIs(pool.get_nvlistp(), nvlistp)
+
+    def test_bounded(self):
+        pool = _AllocationPool()
+        cells = [pool.get_nvlistp() for _ in range(_POOL_SIZE + 2)]
+        for cell in cells:
+            pool.put_nvlistp(cell)
+        self.assertEqual(len(pool.nvlistps), _POOL_SIZE)
+
+    def test_per_thread(self):
+        pool = _AllocationPool()
+        pool.put_nvlistp(pool.get_nvlistp())
+        sizes = []
+        thread = threading.Thread(target=lambda: sizes.append(len(pool.nvlistps)))
+        thread.start()
+        thread.join()
+        self.assertEqual(sizes, [0])
+        self.assertEqual(len(pool.nvlistps), 1)
+
+
+class TestNVListPacking(unittest.TestCase):
+
+    _props = {
+        b"int": 1,
+        b"str": b"value",
+        b"bool": True,
+        b"flag": None,
+        b"array": [1, 2, 3],
+        b"strings": [b"a", b"b"],
+        b"dict": {b"nested": {b"key": b"val"}},
+        b"dicts": [{b"key": 1}, {b"key": 2}],
+    }
+
+    def _from_bytes(self, data):
+        return _nvlist_to_dict(nvlist_from_bytes(data), {})
+
+    def test_round_trip(self):
+        data = nvlist_to_bytes(self._props)
+        self.assertIsInstance(data, bytes)
+        self.assertEqual(self._from_bytes(data), self._props)
+
+    def test_nvlist(self):
+        data = nvlist_to_bytes(nvlist_in(self._props))
+        self.assertEqual(data, nvlist_to_bytes(self._props))
+
+    def test_empty(self):
+        self.assertEqual(self._from_bytes(nvlist_to_bytes({})), {})
+
+    def test_xdr(self):
+        data = nvlist_to_bytes(self._props, encoding=NV_ENCODE_XDR)
+        self.assertEqual(self._from_bytes(data), self._props)
+
+    def test_buffer_types(self):
+        data = nvlist_to_bytes(self._props)
+        self.assertEqual(self._from_bytes(bytearray(data)), self._props)
+        self.assertEqual(self._from_bytes(memoryview(data)), self._props)
+
+    def test_input_parameter(self):
+        res = {}
+        with nvlist_out(res) as nv_out:
+            _lib.nvlist_dup(nvlist_from_bytes(nvlist_to_bytes(self._props)), nv_out, 0)
+        self.assertEqual(res, self._props)
+
+    def test_pure_python_decoder(self):
+        self.assertEqual(unpack_nvlist(nvlist_to_bytes(self._props)), self._props)
+
+    def test_invalid_data(self):
+        data = nvlist_to_bytes(self._props)
+        with self.assertRaises(lzc_exc.ZFSGenericError) as ctx:
+            nvlist_from_bytes(data[:len(data) // 2])
+        self.assertIn(ctx.exception.errno, (errno.EFAULT, errno.EINVAL))
+
+
+class TestNvlistView(unittest.TestCase):
+
+    _props = {
+        b"int": 1,
+        b"str": b"value",
+        b"bool": None,
+        b"dict": {b"nested": {b"key": b"val"}, b"array": [1, 2]},
+        b"dicts": [{b"key": 1}, {b"key": 2}],
+    }
+
+    def _view(self, props, **kwargs):
+        view = NvlistView()
+        with nvlist_out(view, **kwargs) as nv_out:
+            _lib.nvlist_dup(nvlist_in(props), nv_out, 0)
+        return view
+
+    def test_empty(self):
+        view = NvlistView()
+        with nvlist_out(view):
+            pass
+        self.assertEqual(len(view), 0)
+        self.assertEqual(list(view), [])
+        self.assertEqual(view.to_dict(), {})
+        self.assertNotIn(b"key", view)
+
+    def test_lookup(self):
+        view = self._view(self._props)
+        self.assertEqual(view[b"int"], 1)
+        self.assertEqual(view["str"], b"value")
+        self.assertIsNone(view[b"bool"])
+        self.assertIn(b"bool", view)
+        self.assertIn("int", view)
+        self.assertNotIn(b"missing", view)
+        with self.assertRaises(KeyError):
+            view[b"missing"]
+        self.assertIsNone(view.get(b"missing"))
+
+    def test_iteration(self):
+        view = self._view(self._props)
+        self.assertEqual(len(view), len(self._props))
+        self.assertEqual(sorted(view), sorted(self._props))
+
+    def test_nested(self):
+        view = self._view(self._props)
+        nested = view[b"dict"]
+        self.assertIsInstance(nested, NvlistView)
+        self.assertIs(nested, view[b"dict"])
+        self.assertEqual(nested[b"nested"][b"key"], b"val")
+        self.assertEqual(nested[b"array"], [1, 2])
+        self.assertEqual([x[b"key"] for x in view[b"dicts"]], [1, 2])
+
+    def test_child_outlives_parent(self):
+        view = self._view(self._props)
+        nested = view[b"dict"][b"nested"]
+        del view
+        gc.collect()
+        self.assertEqual(nested[b"key"], b"val")
+
+    def test_child_outlives_reuse(self):
+        view = self._view(self._props)
+        nested = view[b"dict"][b"nested"]
+        with nvlist_out(view) as nv_out:
+            _lib.nvlist_dup(nvlist_in({b"other": 1}), nv_out, 0)
+        gc.collect()
+        self.assertEqual(view.to_dict(), {b"other": 1})
+        self.assertEqual(nested.to_dict(), {b"key": b"val"})
+
+    def test_to_dict(self):
+        view = self._view(self._props)
+        self.assertEqual(view.to_dict(), self._props)
+        self.assertEqual(view, self._props)
+
+    def test_compact_arrays(self):
+        view = self._view({b"key": {b"array": [1, 2]}}, compact_arrays=True)
+        self.assertIsInstance(view[b"key"][b"array"], array.array)
+        self.assertEqual(view[b"key"][b"array"].tolist(), [1, 2])
+
+
 # vim: softtabstop=4 tabstop=4 expandtab shiftwidth=4
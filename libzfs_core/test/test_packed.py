@@ -0,0 +1,239 @@
+# Copyright 2015 ClusterHQ. See LICENSE file for details.
+
+"""
+Tests for the pure Python decoder of packed nvlists.
+
+The packed nvlists are produced by a small encoder in this module.
+The parity tests unpack the same bytes with libnvpair and check that
+both decoders produce identical results.
+"""
+from __future__ import unicode_literals
+
+import array
+import errno
+import struct
+import unittest
+
+from .. import _packed
+from .. import exceptions as lzc_exc
+from .._nvlist import nvlist_out, _lib, _ffi, _projection
+from .._packed import unpack_nvlist
+
+
+class _Typed(object):
+
+    def __init__(self, typeid, value):
+        self.typeid = typeid
+        self.value = value
+
+
+def _align8(n):
+    return (n + 7) & ~7
+
+
+def _value(value, order):
+    '''
+    :return: the type, the number of elements, the value bytes and
+        the embedded nvlists of a value.
+    '''
+    if isinstance(value, _Typed):
+        typeid = value.typeid
+        value = value.value
+        if typeid in _packed._SCALARS:
+            return (typeid, 1, struct.pack(order + _packed._SCALARS[typeid], value), [])
+        fmt = _packed._ARRAYS[typeid]
+        data = struct.pack('%s%d%s' % (order, len(value), fmt), *value)
+        return (typeid, len(value), data, [])
+    if value is None:
+        return (_packed.DATA_TYPE_BOOLEAN, 0, b'', [])
+    if isinstance(value, bool):
+        return (_packed.DATA_TYPE_BOOLEAN_VALUE, 1, struct.pack(order + 'i', value), [])
+    if isinstance(value, int):
+        return (_packed.DATA_TYPE_UINT64, 1, struct.pack(order + 'Q', value), [])
+    if isinstance(value, bytes):
+        return (_packed.DATA_TYPE_STRING, 1, value + b'\0', [])
+    if isinstance(value, dict):
+        return (_packed.DATA_TYPE_NVLIST, 1, b'\0' * 24, [value])
+    if all(isinstance(v, dict) for v in value):
+        data = b'\0' * (len(value) * (8 + 24))
+        return (_packed.DATA_TYPE_NVLIST_ARRAY, len(value), data, value)
+    if all(isinstance(v, bytes) for v in value):
+        data = b'\0' * (len(value) * 8) + b''.join(v + b'\0' for v in value)
+        return (_packed.DATA_TYPE_STRING_ARRAY, len(value), data, [])
+    data = struct.pack('%s%dQ' % (order, len(value)), *value)
+    return (_packed.DATA_TYPE_UINT64_ARRAY, len(value), data, [])
+
+
+def _pack_nvlist(props, order):
+    data = struct.pack(order + 'iI', 0, 1)
+    for (name, value) in props.items():
+        (typeid, nelem, valdata, embedded) = _value(value, order)
+        name = name + b'\0'
+        valoff = _align8(16 + len(name))
+        size = valoff + _align8(len(valdata))
+        pair = struct.pack(order + 'ihhii', size, len(name), 0, nelem, typeid) + name
+        data += pair.ljust(valoff, b'\0') + valdata.ljust(size - valoff, b'\0')
+        for nested in embedded:
+            data += _pack_nvlist(nested, order)
+    return data + b'\0' * 4
+
+
+def _pack(props, order='<'):
+    endian = _packed._NV_LITTLE_ENDIAN if order == '<' else _packed._NV_BIG_ENDIAN
+    return struct.pack('BBBB', _packed._NV_ENCODE_NATIVE, endian, 0, 0) + _pack_nvlist(props, order)
+
+
+_PROPS = {
+    b'bool': None,
+    b'true': True,
+    b'false': False,
+    b'uint64': 2 ** 64 - 1,
+    b'string': b'value',
+    b'empty': b'',
+    b'byte': _Typed(_packed.DATA_TYPE_BYTE, 255),
+    b'int8': _Typed(_packed.DATA_TYPE_INT8, -128),
+    b'uint8': _Typed(_packed.DATA_TYPE_UINT8, 255),
+    b'int16': _Typed(_packed.DATA_TYPE_INT16, -2 ** 15),
+    b'uint16': _Typed(_packed.DATA_TYPE_UINT16, 2 ** 16 - 1),
+    b'int32': _Typed(_packed.DATA_TYPE_INT32, -2 ** 31),
+    b'uint32': _Typed(_packed.DATA_TYPE_UINT32, 2 ** 32 - 1),
+    b'int64': _Typed(_packed.DATA_TYPE_INT64, -2 ** 63),
+    b'uint64_array': [0, 1, 2 ** 64 - 1],
+    b'int16_array': _Typed(_packed.DATA_TYPE_INT16_ARRAY, [-1, 0, 1]),
+    b'byte_array': _Typed(_packed.DATA_TYPE_BYTE_ARRAY, [0, 1, 255]),
+    b'bool_array': _Typed(_packed.DATA_TYPE_BOOLEAN_ARRAY, [1, 0]),
+    b'string_array': [b'a', b'bc', b''],
+    b'nvlist': {b'value': 1, b'source': b'pool/fs', b'nested': {b'key': b'val'}},
+    b'nvlist_array': [{b'key': 1}, {b'key': 2, b'other': [b'x']}],
+    b'after': 7,
+}
+
+_DECODED = {
+    b'bool': None,
+    b'true': True,
+    b'false': False,
+    b'uint64': 2 ** 64 - 1,
+    b'string': b'value',
+    b'empty': b'',
+    b'byte': 255,
+    b'int8': -128,
+    b'uint8': 255,
+    b'int16': -2 ** 15,
+    b'uint16': 2 ** 16 - 1,
+    b'int32': -2 ** 31,
+    b'uint32': 2 ** 32 - 1,
+    b'int64': -2 ** 63,
+    b'uint64_array': [0, 1, 2 ** 64 - 1],
+    b'int16_array': [-1, 0, 1],
+    b'byte_array': [0, 1, 255],
+    b'bool_array': [True, False],
+    b'string_array': [b'a', b'bc', b''],
+    b'nvlist': {b'value': 1, b'source': b'pool/fs', b'nested': {b'key': b'val'}},
+    b'nvlist_array': [{b'key': 1}, {b'key': 2, b'other': [b'x']}],
+    b'after': 7,
+}
+
+
+class TestUnpackNvlist(unittest.TestCase):
+
+    def test_empty(self):
+        self.assertEqual(unpack_nvlist(_pack({})), {})
+
+    def test_all_types(self):
+        self.assertEqual(unpack_nvlist(_pack(_PROPS)), _DECODED)
+
+    def test_big_endian(self):
+        self.assertEqual(unpack_nvlist(_pack(_PROPS, '>')), _DECODED)
+
+    def test_buffer_types(self):
+        data = _pack(_PROPS)
+        self.assertEqual(unpack_nvlist(bytearray(data)), _DECODED)
+        self.assertEqual(unpack_nvlist(memoryview(data)), _DECODED)
+
+    def test_value_types(self):
+        res = unpack_nvlist(_pack(_PROPS))
+        for key in _DECODED:
+            self.assertIs(type(res[key]), type(_DECODED[key]))
+
+    def test_compact_arrays(self):
+        for order in '<>':
+            res = unpack_nvlist(_pack(_PROPS, order), compact_arrays=True)
+            self.assertIsInstance(res[b'uint64_array'], array.array)
+            self.assertEqual(res[b'uint64_array'].tolist(), [0, 1, 2 ** 64 - 1])
+            self.assertEqual(res[b'int16_array'].typecode, 'h')
+            self.assertEqual(res[b'int16_array'].tolist(), [-1, 0, 1])
+            self.assertEqual(res[b'byte_array'], b'\x00\x01\xff')
+            self.assertEqual(res[b'bool_array'], [True, False])
+            self.assertEqual(res[b'string_array'], [b'a', b'bc', b''])
+
+    def test_projection(self):
+        fields = _projection({
+            'string': None,
+            'nvlist': ['value'],
+            'nvlist_array': ['other'],
+            'after': None,
+        })
+        res = unpack_nvlist(_pack(_PROPS), fields=fields)
+        self.assertEqual(res, {
+            b'string': b'value',
+            b'nvlist': {b'value': 1},
+            b'nvlist_array': [{}, {b'other': [b'x']}],
+            b'after': 7,
+        })
+
+    def test_xdr(self):
+        data = b'\1' + _pack(_PROPS)[1:]
+        with self.assertRaises(lzc_exc.ZFSGenericError) as ctx:
+            unpack_nvlist(data)
+        self.assertEqual(ctx.exception.errno, errno.ENOTSUP)
+
+    def test_truncated(self):
+        data = _pack(_PROPS)
+        for size in (0, 3, 10, 40, len(data) - 1):
+            with self.assertRaises(lzc_exc.ZFSGenericError) as ctx:
+                unpack_nvlist(data[:size])
+            self.assertEqual(ctx.exception.errno, errno.EINVAL)
+
+
+class TestUnpackNvlistParity(unittest.TestCase):
+
+    """
+    Check that the pure Python decoder and libnvpair agree.
+    """
+
+    def _unpack_c(self, data, **kwargs):
+        res = {}
+        with nvlist_out(res, **kwargs) as nvp:
+            ret = _lib.nvlist_unpack(_ffi.from_buffer(data), len(data), nvp, 0)
+            self.assertEqual(ret, 0)
+        return res
+
+    def _assertParity(self, data, **kwargs):
+        expected = self._unpack_c(data, **kwargs)
+        if 'fields' in kwargs:
+            kwargs['fields'] = _projection(kwargs['fields'])
+        res = unpack_nvlist(data, **kwargs)
+        self.assertEqual(res, expected)
+        for key in expected:
+            self.assertIs(type(res[key]), type(expected[key]))
+
+    def test_all_types(self):
+        self._assertParity(_pack(_PROPS))
+
+    def test_compact_arrays(self):
+        self._assertParity(_pack(_PROPS), compact_arrays=True)
+
+    def test_projection(self):
+        self._assertParity(_pack(_PROPS), fields={'nvlist': ['nested'], 'uint64': None})
+
+    def test_listing_record(self):
+        properties = dict((b'prop%d' % i, {b'value': i, b'source': b'pool'}) for i in range(32))
+        record = {
+            b'name': b'pool/fs@snap',
+            b'dmu_objset_stats': {b'dds_type': 2, b'dds_is_snapshot': True},
+            b'properties': properties,
+        }
+        self._assertParity(_pack(record))
+
+
+# vim: softtabstop=4 tabstop=4 expandtab shiftwidth=4
@@ -0,0 +1,83 @@
+# Copyright 2015 ClusterHQ. See LICENSE file for details.
+
+"""
+Tests for the parallel execution of the operations.
+"""
+from __future__ import unicode_literals
+
+import threading
+import time
+import unittest
+
+from .._parallel import map_parallel
+
+
+class _Tracker(object):
+
+    def __init__(self, delay=0.02):
+        self._lock = threading.Lock()
+        self._delay = delay
+        self.running = {}
+        self.max_running = {}
+        self.max_total = 0
+
+    def __call__(self, name, *args):
+        pool = name.split(b'/')[0]
+        with self._lock:
+            self.running[pool] = self.running.get(pool, 0) + 1
+            self.max_running[pool] = max(self.max_running.get(pool, 0), self.running[pool])
+            self.max_total = max(self.max_total, sum(self.running.values()))
+        time.sleep(self._delay)
+        with self._lock:
+            self.running[pool] -= 1
+        if args and isinstance(args[0], Exception):
+            raise args[0]
+        return (name,) + args
+
+
+class TestMapParallel(unittest.TestCase):
+
+    def test_empty(self):
+        self.assertEqual(map_parallel(_Tracker(), []), [])
+
+    def test_results_in_order(self):
+        names = [b'pool%d/fs%d' % (i % 3, i) for i in range(30)]
+        results = map_parallel(_Tracker(0), names)
+        self.assertEqual(results, [(n,) for n in names])
+
+    def test_argument_tuples(self):
+        calls = [(b'pool/a', 1), (b'pool/b', 2)]
+        self.assertEqual(map_parallel(_Tracker(0), calls), calls)
+
+    def test_exceptions_in_place(self):
+        error = ValueError('boom')
+        calls = [(b'pool/a', 1), (b'pool/b', error), (b'pool/c', 3)]
+        results = map_parallel(_Tracker(0), calls)
+        self.assertEqual(results[0], (b'pool/a', 1))
+        self.assertIs(results[1], error)
+        self.assertEqual(results[2], (b'pool/c', 3))
+
+    def test_per_pool_limit(self):
+        tracker = _Tracker()
+        names = [b'pool%d/fs%d' % (i % 2, i) for i in range(20)]
+        map_parallel(tracker, names, max_workers=8, max_per_pool=2)
+        self.assertEqual(tracker.max_running, {b'pool0': 2, b'pool1': 2})
+
+    def test_global_limit(self):
+        tracker = _Tracker()
+        names = [b'pool%d/fs' % i for i in range(12)]
+        map_parallel(tracker, names, max_workers=3, max_per_pool=4)
+        self.assertEqual(tracker.max_total, 3)
+
+    def test_pool_of_snapshot_and_bookmark(self):
+        tracker = _Tracker()
+        names = [b'pool@snap%d' % i for i in range(4)] + [b'pool#bmark%d' % i for i in range(4)]
+        map_parallel(tracker, names, max_workers=8, max_per_pool=1)
+        self.assertEqual(tracker.max_total, 1)
+
+    def test_invalid_limits(self):
+        with self.assertRaises(ValueError):
+            map_parallel(_Tracker(), [b'pool'], max_workers=0)
+
+
+# vim: softtabstop=4 tabstop=4 expandtab shiftwidth=4
@@ -0,0 +1,152 @@
+# Copyright 2015 ClusterHQ. See LICENSE file for details.
+
+"""
+Tests for the in-memory dataset index.
+
+The listing is replaced with a fake that produces the entries
+of a synthetic pool, so the tests do not need a ZFS pool.
+"""
+from __future__ import unicode_literals
+
+import unittest
+
+from .. import _libzfs_core as lzc
+from .. import exceptions as lzc_exc
+from .._tree import DatasetTree
+
+
+def _entry(name, clones=None, volume=False):
+    is_snapshot = b'@' in name
+    props = {b'used': {b'value': 1024, b'source': b''}}
+    if clones is not None:
+        props[b'clones'] = {b'value': dict((c, None) for c in clones), b'source': b''}
+    return {
+        b'name': name,
+        b'dmu_objset_stats': {
+            b'dds_is_snapshot': is_snapshot,
+            b'dds_type': lzc._lib.DMU_OST_ZVOL if volume else lzc._lib.DMU_OST_ZFS,
+        },
+        b'properties': props,
+    }
+
+
+class _FakePool(object):
+
+    def __init__(self):
+        self.entries = [
+            _entry(b'pool'),
+            _entry(b'pool/fs'),
+            _entry(b'pool/fs@snap1', clones=[b'pool/clone']),
+            _entry(b'pool/fs@snap2'),
+            _entry(b'pool/fs/child'),
+            _entry(b'pool/fs/child/grandchild'),
+            _entry(b'pool/vol', volume=True),
+            _entry(b'pool/clone'),
+        ]
+        self.listings = []
+        self.fields = []
+
+    def list(self, name, recurse=None, types=None, lazy=False, fields=None):
+        self.listings.append(name)
+        self.fields.append(fields)
+        found = False
+        for entry in self.entries:
+            n = entry[b'name']
+            if n == name or n.startswith(name + b'/') or n.startswith(name + b'@'):
+                found = True
+                yield entry
+        if not found:
+            raise lzc_exc.DatasetNotFound(name)
+
+
+class DatasetTreeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = _FakePool()
+        self._saved = lzc._list
+        lzc._list = self.pool.list
+
+    def tearDown(self):
+        lzc._list = self._saved
+
+    def test_single_listing(self):
+        tree = DatasetTree(b'pool')
+        self.assertEqual(self.pool.listings, [b'pool'])
+        self.assertEqual(len(tree), len(self.pool.entries))
+        self.assertIn(b'pool/fs/child', tree)
+        self.assertIn('pool/fs/child', tree)
+        self.assertNotIn(b'pool/nonexistent', tree)
+
+    def test_adjacency(self):
+        tree = DatasetTree(b'pool')
+        self.assertEqual(sorted(tree.children(b'pool')), [b'pool/clone', b'pool/fs', b'pool/vol'])
+        self.assertEqual(tree.children(b'pool/fs'), [b'pool/fs/child'])
+        self.assertEqual(tree.snapshots(b'pool/fs'), [b'pool/fs@snap1', b'pool/fs@snap2'])
+        self.assertEqual(tree.parent(b'pool/fs@snap1'), b'pool/fs')
+        self.assertEqual(tree.parent(b'pool/fs/child'), b'pool/fs')
+        self.assertIsNone(tree.parent(b'pool'))
+        self.assertEqual(list(tree.descendants(b'pool/fs')),
+                         [b'pool/fs/child', b'pool/fs/child/grandchild'])
+
+    def test_types(self):
+        tree = DatasetTree(b'pool')
+        self.assertEqual(tree.type(b'pool/fs'), 'filesystem')
+        self.assertEqual(tree.type(b'pool/vol'), 'volume')
+        self.assertEqual(tree.type(b'pool/fs@snap1'), 'snapshot')
+
+    def test_clones(self):
+        tree = DatasetTree(b'pool')
+        self.assertEqual(tree.clones(b'pool/fs@snap1'), [b'pool/clone'])
+        self.assertEqual(tree.clones(b'pool/fs@snap2'), [])
+        self.assertEqual(tree.origin(b'pool/clone'), b'pool/fs@snap1')
+        self.assertIsNone(tree.origin(b'pool/fs'))
+
+    def test_props(self):
+        tree = DatasetTree(b'pool')
+        props = tree.props(b'pool/fs@snap1')
+        self.assertEqual(props[b'used'], 1024)
+        self.assertEqual(props[b'clones'], [b'pool/clone'])
+        self.assertIs(tree.props(b'pool/fs@snap1'), props)
+
+    def test_entries_not_kept(self):
+        tree = DatasetTree(b'pool')
+        # The elements are decoded to dictionaries instead of views.
+        self.assertIsNotNone(self.pool.fields[0])
+        self.assertIsNone(self.pool.fields[0][b'properties'])
+        self.assertFalse(hasattr(tree._nodes[b'pool/fs'], 'entry'))
+
+    def test_missing(self):
+        tree = DatasetTree(b'pool')
+        with self.assertRaises(lzc_exc.DatasetNotFound):
+            tree.children(b'pool/nonexistent')
+        with self.assertRaises(lzc_exc.DatasetNotFound):
+            DatasetTree(b'nopool')
+
+    def test_refresh_subtree(self):
+        tree = DatasetTree(b'pool')
+        self.pool.entries = [e for e in self.pool.entries
+                             if not e[b'name'].startswith(b'pool/fs/child/')]
+        self.pool.entries.append(_entry(b'pool/fs/child@new'))
+        tree.refresh(b'pool/fs/child')
+        self.assertEqual(self.pool.listings, [b'pool', b'pool/fs/child'])
+        self.assertNotIn(b'pool/fs/child/grandchild', tree)
+        self.assertEqual(tree.snapshots(b'pool/fs/child'), [b'pool/fs/child@new'])
+        self.assertEqual(tree.children(b'pool/fs'), [b'pool/fs/child'])
+
+    def test_refresh_removed(self):
+        tree = DatasetTree(b'pool')
+        self.pool.entries = [e for e in self.pool.entries
+                             if not e[b'name'].startswith(b'pool/fs')]
+        tree.refresh(b'pool/fs')
+        self.assertNotIn(b'pool/fs', tree)
+        self.assertNotIn(b'pool/fs@snap1', tree)
+        self.assertIsNone(tree.origin(b'pool/clone'))
+        self.assertNotIn(b'pool/fs', tree.children(b'pool'))
+
+    def test_refresh_outside(self):
+        tree = DatasetTree(b'pool/fs')
+        with self.assertRaises(ValueError):
+            tree.refresh(b'pool/vol')
+
+
+# vim: softtabstop=4 tabstop=4 expandtab shiftwidth=4
@@ -29,10 +29,16 @@ setup(
     include_package_data=True,
     install_requires=[
         "cffi",
+        "futures; python_version < '3'",
     ],
     setup_requires=[
         "cffi",
     ],
+    # The API mode extension is optional, the bindings fall back
+    # to the ABI mode if it can not be built.
+    cffi_modules=[
+        "libzfs_core/bindings/build.py:ffibuilder",
+    ],
     zip_safe=False,
     test_suite="libzfs_core.test",
 )